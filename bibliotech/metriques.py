@@ -0,0 +1,293 @@
+"""
+Métriques au format texte de Prometheus, agrégées entre les workers.
+
+Chaque processus garde ses compteurs et histogrammes en mémoire : une mesure
+coûte une prise de verrou et quelques opérations sur des dictionnaires. Au
+plus toutes les METRIQUES_INTERVALLE secondes, l'état du processus est écrit
+dans METRIQUES_DOSSIER/<pid>-<début>.json (écriture atomique) : un pid
+réutilisé par un nouveau worker n'écrase pas le fichier d'un worker arrêté.
+La vue metriques (/metrics) additionne les fichiers de tous les processus.
+
+Pour que les compteurs restent croissants sans que les fichiers
+s'accumulent, la collecte ajoute ceux des workers arrêtés à archive.json
+puis les supprime. Le dossier est à vider au démarrage du service, pas à
+chaque worker.
+
+La vue est refusée tant que METRIQUES_JETON n'est pas défini.
+"""
+import atexit
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+import glob
+import hmac
+import json
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+DOSSIER = getattr(settings, 'METRIQUES_DOSSIER', os.path.join(tempfile.gettempdir(), 'bibliotech_metriques'))
+INTERVALLE = getattr(settings, 'METRIQUES_INTERVALLE', 5)
+
+# Cumul des workers arrêtés, et fichier verrouillé pendant une collecte
+ARCHIVE = 'archive.json'
+VERROU = '.verrou'
+
+# Seuils (en secondes) des histogrammes de durée
+SEUILS_DUREE = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Nom -> (type, description)
+DEFINITIONS = {
+    'bibliotech_vue_duree_secondes': ('histogram', "Durée de traitement des requêtes par vue"),
+    'bibliotech_requetes_total': ('counter', "Requêtes traitées par vue et statut HTTP"),
+    'bibliotech_supabase_duree_secondes': ('histogram', "Durée des appels Supabase par table et opération"),
+    'bibliotech_supabase_appels_total': ('counter', "Appels Supabase par table, opération et statut HTTP"),
+    'bibliotech_cache_total': ('counter', "Lectures de cache par cache et résultat (hit, miss)"),
+    'bibliotech_auth_total': ('counter', "Opérations d'authentification par résultat"),
+    'bibliotech_sessions_total': ('counter', "Requêtes par état de session (authentifiee, anonyme)"),
+}
+
+
+class Registre:
+    def __init__(self, dossier=DOSSIER, intervalle=INTERVALLE):
+        self.dossier = dossier
+        self.intervalle = intervalle
+        self._verrou = threading.Lock()
+        self._reinitialiser()
+
+    def _reinitialiser(self):
+        self._pid = os.getpid()
+        self._nom_fichier = f'{self._pid}-{time.time_ns()}.json'
+        self._compteurs = {}      # (nom, étiquettes) -> valeur
+        self._histogrammes = {}   # (nom, étiquettes) -> [effectif par seuil..., +Inf, somme]
+        self._derniere_ecriture = time.monotonic()
+
+    def _verifier_processus(self):
+        # Après un fork, l'enfant repart de zéro : l'état hérité est déjà compté par le parent
+        if os.getpid() != self._pid:
+            self._reinitialiser()
+
+    def incrementer(self, nom, valeur=1, **etiquettes):
+        cle = (nom, tuple(sorted(etiquettes.items())))
+        with self._verrou:
+            self._verifier_processus()
+            self._compteurs[cle] = self._compteurs.get(cle, 0) + valeur
+        self._ecrire_si_necessaire()
+
+    def observer(self, nom, valeur, **etiquettes):
+        cle = (nom, tuple(sorted(etiquettes.items())))
+        with self._verrou:
+            self._verifier_processus()
+            seaux = self._histogrammes.get(cle)
+            if seaux is None:
+                seaux = self._histogrammes[cle] = [0] * (len(SEUILS_DUREE) + 2)
+            seaux[bisect_left(SEUILS_DUREE, valeur)] += 1
+            seaux[-1] += valeur
+        self._ecrire_si_necessaire()
+
+    def _ecrire_si_necessaire(self):
+        if time.monotonic() - self._derniere_ecriture >= self.intervalle:
+            self.ecrire()
+
+    def ecrire(self):
+        """Écrit l'état du processus dans son fichier"""
+        with self._verrou:
+            self._verifier_processus()
+            self._derniere_ecriture = time.monotonic()
+            etat = {
+                'compteurs': [[nom, list(etiquettes), valeur] for (nom, etiquettes), valeur in self._compteurs.items()],
+                'histogrammes': [[nom, list(etiquettes), list(seaux)] for (nom, etiquettes), seaux in self._histogrammes.items()],
+            }
+        try:
+            _ecrire_etat(self.dossier, self._nom_fichier, etat)
+        except Exception as e:
+            print(f"Erreur lors de l'écriture des métriques: {e}")
+
+    def collecter(self):
+        """Additionne les états de tous les processus ; retourne (compteurs, histogrammes)"""
+        self.ecrire()
+        compteurs, histogrammes = {}, {}
+        with _verrou_dossier(self.dossier):
+            try:
+                self._archiver_processus_arretes()
+            except Exception as e:
+                print(f"Erreur lors de l'archivage des métriques: {e}")
+            for chemin in glob.glob(os.path.join(self.dossier, '*.json')):
+                _cumuler(compteurs, histogrammes, _lire_etat(chemin) or {})
+        return compteurs, histogrammes
+
+    def _archiver_processus_arretes(self):
+        """Ajoute les fichiers des workers arrêtés à l'archive, puis les supprime"""
+        if os.name != 'posix':
+            return
+        archive = _lire_etat(os.path.join(self.dossier, ARCHIVE)) or {}
+        # Fichiers déjà comptés dans l'archive, mais pas supprimés (arrêt pendant l'archivage)
+        deja_archives = set(archive.get('archives', []))
+        compteurs, histogrammes = {}, {}
+        _cumuler(compteurs, histogrammes, archive)
+        archives = []
+        for chemin in glob.glob(os.path.join(self.dossier, '*-*.json')):
+            nom = os.path.basename(chemin)
+            if nom in deja_archives:
+                _supprimer(chemin)
+                continue
+            if _processus_actif(int(nom.split('-')[0])):
+                continue
+            etat = _lire_etat(chemin)
+            if etat is not None:
+                _cumuler(compteurs, histogrammes, etat)
+                archives.append(chemin)
+        if not archives:
+            return
+        _ecrire_etat(self.dossier, ARCHIVE, {
+            'compteurs': [[nom, list(etiquettes), valeur] for (nom, etiquettes), valeur in compteurs.items()],
+            'histogrammes': [[nom, list(etiquettes), seaux] for (nom, etiquettes), seaux in histogrammes.items()],
+            'archives': [os.path.basename(chemin) for chemin in archives],
+        })
+        for chemin in archives:
+            _supprimer(chemin)
+
+
+def _ecrire_etat(dossier, nom, etat):
+    os.makedirs(dossier, exist_ok=True)
+    descripteur, temporaire = tempfile.mkstemp(dir=dossier, suffix='.tmp')
+    with os.fdopen(descripteur, 'w') as sortie:
+        json.dump(etat, sortie)
+    os.replace(temporaire, os.path.join(dossier, nom))
+
+
+def _lire_etat(chemin):
+    try:
+        with open(chemin) as fichier:
+            return json.load(fichier)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Fichier de métriques illisible {chemin}: {e}")
+        return None
+
+
+def _cumuler(compteurs, histogrammes, etat):
+    for nom, etiquettes, valeur in etat.get('compteurs', []):
+        cle = (nom, tuple(tuple(e) for e in etiquettes))
+        compteurs[cle] = compteurs.get(cle, 0) + valeur
+    for nom, etiquettes, seaux in etat.get('histogrammes', []):
+        cle = (nom, tuple(tuple(e) for e in etiquettes))
+        total = histogrammes.setdefault(cle, [0] * len(seaux))
+        for position, valeur in enumerate(seaux):
+            total[position] += valeur
+
+
+def _supprimer(chemin):
+    try:
+        os.remove(chemin)
+    except FileNotFoundError:
+        pass
+
+
+def _processus_actif(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Processus d'un autre utilisateur : il existe
+        return True
+    return True
+
+
+@contextmanager
+def _verrou_dossier(dossier):
+    """Une seule collecte à la fois archive le dossier (verrou fcntl, sans effet hors POSIX)"""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    os.makedirs(dossier, exist_ok=True)
+    with open(os.path.join(dossier, VERROU), 'w') as fichier:
+        fcntl.flock(fichier, fcntl.LOCK_EX)
+        yield
+
+
+def _etiquettes(etiquettes, supplementaires=()):
+    paires = list(etiquettes) + list(supplementaires)
+    if not paires:
+        return ''
+    echapper = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{nom}="{echapper(valeur)}"' for nom, valeur in paires) + '}'
+
+
+def _nombre(valeur):
+    return repr(float(valeur)) if isinstance(valeur, float) else str(valeur)
+
+
+def format_texte(compteurs, histogrammes):
+    """Rend les métriques au format texte d'exposition de Prometheus (version 0.0.4)"""
+    series = {}
+    for (nom, etiquettes), valeur in sorted(compteurs.items()):
+        series.setdefault(nom, []).append(f'{nom}{_etiquettes(etiquettes)} {_nombre(valeur)}')
+    for (nom, etiquettes), seaux in sorted(histogrammes.items()):
+        lignes = series.setdefault(nom, [])
+        cumul = 0
+        for seuil, effectif in zip(SEUILS_DUREE + ('+Inf',), seaux[:-1]):
+            cumul += effectif
+            lignes.append(f'{nom}_bucket{_etiquettes(etiquettes, [("le", seuil)])} {cumul}')
+        lignes.append(f'{nom}_sum{_etiquettes(etiquettes)} {_nombre(seaux[-1])}')
+        lignes.append(f'{nom}_count{_etiquettes(etiquettes)} {cumul}')
+
+    texte = []
+    for nom in sorted(series):
+        type_metrique, aide = DEFINITIONS.get(nom, ('untyped', nom))
+        texte.append(f'# HELP {nom} {aide}')
+        texte.append(f'# TYPE {nom} {type_metrique}')
+        texte.extend(series[nom])
+    return '\n'.join(texte) + '\n'
+
+
+registre = Registre()
+atexit.register(registre.ecrire)
+
+
+def incrementer(nom, valeur=1, **etiquettes):
+    registre.incrementer(nom, valeur, **etiquettes)
+
+
+def observer(nom, valeur, **etiquettes):
+    registre.observer(nom, valeur, **etiquettes)
+
+
+def compter_cache(cache, valeur):
+    """Compte une lecture de cache (hit si une valeur est trouvée) et retourne la valeur"""
+    registre.incrementer('bibliotech_cache_total', cache=cache, resultat='miss' if valeur is None else 'hit')
+    return valeur
+
+
+def compter_auth(operation):
+    """Compte le résultat d'une opération d'authentification ({'success': ...} ou booléen)"""
+    def decorator(methode):
+        @wraps(methode)
+        def _wrapped(*args, **kwargs):
+            resultat = methode(*args, **kwargs)
+            reussi = resultat.get('success') if isinstance(resultat, dict) else bool(resultat)
+            registre.incrementer('bibliotech_auth_total', operation=operation, resultat='succes' if reussi else 'echec')
+            return resultat
+        return _wrapped
+    return decorator
+
+
+def metriques(request):
+    """Expose les métriques de tous les workers ; refusées sans METRIQUES_JETON"""
+    jeton = getattr(settings, 'METRIQUES_JETON', '')
+    # Sans jeton configuré, la vue est fermée : elle révèle les vues, le trafic et les erreurs
+    attendu = f'Bearer {jeton}'.encode('utf-8')
+    if not jeton or not hmac.compare_digest(request.headers.get('Authorization', '').encode('utf-8'), attendu):
+        return HttpResponseForbidden("Accès refusé")
+    return HttpResponse(
+        format_texte(*registre.collecter()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
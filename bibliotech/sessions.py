@@ -0,0 +1,211 @@
+"""
+Moteur de sessions SQLite partagé entre les workers.
+
+Les sessions vivent dans un fichier SQLite (SESSION_FICHIER) : tous les
+processus d'une même machine voient les mêmes sessions, et elles survivent au
+redémarrage des workers. Le journal WAL laisse les lectures concurrentes
+passer pendant une écriture.
+
+Avec SESSION_SAVE_EVERY_REQUEST = False, une session n'est réécrite que si
+elle change, ou si elle expire dans moins de SESSION_RENOUVELLEMENT secondes :
+l'expiration glisse sans écriture à chaque requête.
+
+Les sessions expirées sont purgées par `python manage.py clearsessions`, et
+de temps en temps à la création d'une session.
+
+Le même fichier garde, pour chaque utilisateur, la version de son profil,
+de ses notifications et de ses favoris, ainsi que la génération du
+catalogue, changées à chaque écriture (y compris depuis une commande de
+gestion ou un autre worker) : les workers comparent la version qu'ils
+connaissent à celle-ci pour savoir s'ils doivent relire Supabase.
+"""
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.base import CreateError, SessionBase
+
+# Une création de session sur NETTOYAGE_FREQUENCE purge les sessions expirées
+NETTOYAGE_FREQUENCE = 1000
+
+# Une table de versions par donnée suivie (versions_catalogue : clés CLE_CATALOGUE et CLE_IMPORT)
+TABLES_VERSIONS = ('versions_profils', 'versions_notifications', 'versions_favoris', 'versions_catalogue')
+CLE_CATALOGUE = 'catalogue'
+CLE_IMPORT = 'import'
+
+_local = threading.local()
+
+
+def get_fichier():
+    return str(getattr(settings, 'SESSION_FICHIER', os.path.join(settings.BASE_DIR, 'sessions.sqlite3')))
+
+
+def get_renouvellement():
+    return getattr(settings, 'SESSION_RENOUVELLEMENT', settings.SESSION_COOKIE_AGE // 4)
+
+
+def get_connexion():
+    """Une connexion par thread et par processus (les connexions ne survivent pas à un fork)"""
+    fichier = get_fichier()
+    cle = (os.getpid(), fichier)
+    if getattr(_local, 'cle', None) != cle:
+        connexion = sqlite3.connect(fichier, timeout=5, isolation_level=None)
+        if fichier != ':memory:':
+            connexion.execute('PRAGMA journal_mode=WAL')
+        connexion.execute('PRAGMA synchronous=NORMAL')
+        connexion.execute(
+            'CREATE TABLE IF NOT EXISTS sessions '
+            '(cle TEXT PRIMARY KEY, donnees BLOB NOT NULL, expire REAL NOT NULL)'
+        )
+        connexion.execute('CREATE INDEX IF NOT EXISTS sessions_expire ON sessions (expire)')
+        for table in TABLES_VERSIONS:
+            connexion.execute(
+                f'CREATE TABLE IF NOT EXISTS {table} (user_id TEXT PRIMARY KEY, version INTEGER NOT NULL)'
+            )
+        _local.connexion, _local.cle = connexion, cle
+    return _local.connexion
+
+
+class SessionStore(SessionBase):
+    def load(self):
+        ligne = get_connexion().execute(
+            'SELECT donnees, expire FROM sessions WHERE cle = ? AND expire > ?',
+            (self.session_key, time.time()),
+        ).fetchone() if self.session_key else None
+        if ligne is None:
+            self._session_key = None
+            return {}
+        try:
+            donnees = self.serializer().loads(ligne[0])
+        except Exception as e:
+            print(f"Session illisible, ignorée: {e}")
+            self._session_key = None
+            return {}
+        # Expiration glissante : réécrire (et renvoyer le cookie) seulement près de l'échéance
+        if ligne[1] - time.time() < get_renouvellement():
+            self.modified = True
+        return donnees
+
+    def exists(self, session_key):
+        return get_connexion().execute(
+            'SELECT 1 FROM sessions WHERE cle = ? AND expire > ?', (session_key, time.time())
+        ).fetchone() is not None
+
+    def create(self):
+        if random.randrange(NETTOYAGE_FREQUENCE) == 0:
+            self.clear_expired()
+        while True:
+            self._session_key = self._get_new_session_key()
+            try:
+                self.save(must_create=True)
+            except CreateError:
+                continue
+            self.modified = True
+            return
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        donnees = self.serializer().dumps(self._get_session(no_load=must_create))
+        expire = time.time() + self.get_expiry_age()
+        connexion = get_connexion()
+        if must_create:
+            try:
+                connexion.execute(
+                    'INSERT INTO sessions (cle, donnees, expire) VALUES (?, ?, ?)',
+                    (self._session_key, donnees, expire),
+                )
+            except sqlite3.IntegrityError:
+                raise CreateError
+        else:
+            connexion.execute(
+                'INSERT INTO sessions (cle, donnees, expire) VALUES (?, ?, ?) '
+                'ON CONFLICT (cle) DO UPDATE SET donnees = excluded.donnees, expire = excluded.expire',
+                (self._session_key, donnees, expire),
+            )
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        get_connexion().execute('DELETE FROM sessions WHERE cle = ?', (session_key,))
+
+    @classmethod
+    def clear_expired(cls):
+        get_connexion().execute('DELETE FROM sessions WHERE expire <= ?', (time.time(),))
+
+
+def _lire_version(table, user_id):
+    try:
+        ligne = get_connexion().execute(
+            f'SELECT version FROM {table} WHERE user_id = ?', (user_id,)
+        ).fetchone()
+        return ligne[0] if ligne else 0
+    except Exception as e:
+        print(f"Erreur lors de la lecture de la version ({table}): {e}")
+        return None
+
+
+def _changer_version(table, user_id):
+    try:
+        get_connexion().execute(
+            f'INSERT INTO {table} (user_id, version) VALUES (?, 1) '
+            'ON CONFLICT (user_id) DO UPDATE SET version = version + 1',
+            (user_id,),
+        )
+    except Exception as e:
+        print(f"Erreur lors du changement de version ({table}): {e}")
+
+
+def lire_version_profil(user_id):
+    """Version courante du profil de cet utilisateur (0 s'il n'a jamais changé), None en cas d'erreur"""
+    return _lire_version('versions_profils', user_id)
+
+
+def changer_version_profil(user_id):
+    """Signale à tous les workers que le profil de cet utilisateur a changé"""
+    _changer_version('versions_profils', user_id)
+
+
+def lire_version_notifications(user_id):
+    """Version courante des notifications de cet utilisateur, None en cas d'erreur"""
+    return _lire_version('versions_notifications', user_id)
+
+
+def changer_version_notifications(user_id):
+    """Signale aux workers (et aux flux ouverts) qu'une notification a été ajoutée ou lue"""
+    _changer_version('versions_notifications', user_id)
+
+
+def lire_version_favoris(user_id):
+    """Version courante des favoris de cet utilisateur, None en cas d'erreur"""
+    return _lire_version('versions_favoris', user_id)
+
+
+def changer_version_favoris(user_id):
+    """Signale aux workers que les favoris de cet utilisateur ont changé"""
+    _changer_version('versions_favoris', user_id)
+
+
+def lire_version_catalogue():
+    """Génération courante du catalogue, None en cas d'erreur"""
+    return _lire_version('versions_catalogue', CLE_CATALOGUE)
+
+
+def changer_version_catalogue():
+    """Signale à tous les workers que le catalogue a changé : leurs entrées en cache ne sont plus lues"""
+    _changer_version('versions_catalogue', CLE_CATALOGUE)
+
+
+def lire_version_import():
+    """Version des imports en masse du catalogue, None en cas d'erreur"""
+    return _lire_version('versions_catalogue', CLE_IMPORT)
+
+
+def changer_version_import():
+    """Signale aux workers qu'un import en masse a eu lieu : leurs index en mémoire sont reconstruits"""
+    _changer_version('versions_catalogue', CLE_IMPORT)
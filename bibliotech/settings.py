@@ -9,8 +9,13 @@ https://docs.djangoproject.com/en/5.1/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
+import atexit
 import os
+import shutil
+import sys
+import tempfile
 from pathlib import Path
+from urllib.parse import urlparse
 from django.contrib.messages import constants as messages
 from dotenv import load_dotenv
 
@@ -22,6 +27,24 @@ SUPABASE_URL = os.getenv('SUPABASE_URL', 'https://cfgxxawxmscsrtjsorkp.supabase.
 SUPABASE_KEY = os.getenv('SUPABASE_KEY', '')
 SUPABASE_SERVICE_ROLE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY', '')
 
+# Supabase local sur SQLite, pour les tests et les mesures (voir bibliotech/supabase_local.py) :
+# ':memory:' ou chemin d'un fichier ; latence injectée en ms, fixe ("20") ou aléatoire ("10-40")
+SUPABASE_LOCAL = os.getenv('SUPABASE_LOCAL', '')
+SUPABASE_LOCAL_LATENCE_MS = os.getenv('SUPABASE_LOCAL_LATENCE_MS', '0')
+if SUPABASE_LOCAL:
+    SUPABASE_URL = 'http://supabase.local'
+    SUPABASE_KEY = SUPABASE_KEY or 'local.anon'
+    SUPABASE_SERVICE_ROLE_KEY = SUPABASE_SERVICE_ROLE_KEY or 'local.service'
+
+# Pool de connexions HTTP partagé par les threads d'un worker (voir bibliotech/supabase_client.py)
+SUPABASE_POOL_MAX_CONNEXIONS = int(os.getenv('SUPABASE_POOL_MAX_CONNEXIONS', '20'))
+SUPABASE_POOL_MAX_KEEPALIVE = int(os.getenv('SUPABASE_POOL_MAX_KEEPALIVE', '10'))
+SUPABASE_POOL_DUREE_KEEPALIVE = float(os.getenv('SUPABASE_POOL_DUREE_KEEPALIVE', '60'))
+SUPABASE_HTTP2 = os.getenv('SUPABASE_HTTP2', 'True') == 'True'
+
+# Vues asynchrones (requêtes Supabase en parallèle) : à activer lorsque le projet est servi en ASGI
+VUES_ASYNC = os.getenv('VUES_ASYNC', 'False') == 'True'
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -66,7 +89,9 @@ LOGOUT_REDIRECT_URL = 'connexion'
 
 # Paramètres de session
 SESSION_COOKIE_AGE = 1209600  # 2 semaines en secondes
-SESSION_SAVE_EVERY_REQUEST = True  # La session est renouvelée à chaque requête
+# La session n'est réécrite que si elle change, ou à moins de SESSION_RENOUVELLEMENT secondes de l'expiration
+SESSION_SAVE_EVERY_REQUEST = False
+SESSION_RENOUVELLEMENT = int(os.getenv('SESSION_RENOUVELLEMENT', str(SESSION_COOKIE_AGE // 4)))
 
 
 MIDDLEWARE = [
@@ -76,6 +101,8 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',  # Ajout du middleware de messages
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'comptes.middleware.ContexteRequeteMiddleware',
+    'comptes.middleware.TracesRequeteMiddleware',
     'comptes.middleware.AuthentificationMiddleware',
 ]
 
@@ -94,6 +121,7 @@ TEMPLATES = [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
                 'django.contrib.messages.context_processors.messages',
+                'comptes.context_processors.roles',
             ],
         },
     },
@@ -114,14 +142,53 @@ DATABASES = {
     }
 }
 
-# Configuration des sessions en mémoire
-SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
+# Sessions dans un fichier SQLite partagé par tous les workers (voir bibliotech/sessions.py)
+SESSION_ENGINE = 'bibliotech.sessions'
+SESSION_FICHIER = os.getenv('SESSION_FICHIER', os.path.join(BASE_DIR, 'sessions.sqlite3'))
+
+# Pendant `manage.py test`, les fichiers écrits par l'application vont dans un dossier
+# temporaire, supprimé à la fin des tests, et non dans l'arborescence du projet
+EN_TEST = len(sys.argv) > 1 and sys.argv[1] == 'test'
+if EN_TEST:
+    DOSSIER_TESTS = tempfile.mkdtemp(prefix='bibliotech-tests-')
+    atexit.register(shutil.rmtree, DOSSIER_TESTS, ignore_errors=True)
+    SESSION_FICHIER = os.path.join(DOSSIER_TESTS, 'sessions.sqlite3')
+
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+    },
+    # Cache de lecture du catalogue (catégories, auteurs, livres), éviction LRU au-delà de MAX_ENTRIES.
+    # Chaque worker a sa copie ; une écriture les invalide toutes (génération dans SESSION_FICHIER).
+    # Un backend partagé (Redis, Memcached) évite seulement de relire Supabase une fois par worker.
+    'catalogue': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalogue',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+}
+
+CATALOGUE_CACHE_ALIAS = 'catalogue'
+CATALOGUE_CACHE_TTL = {
+    'categories': 3600,
+    'auteurs': 3600,
+    'livres': 300,
 }
 
+# Cache des profils utilisateurs (par id et par email), mis à jour à chaque update_profile
+PROFIL_CACHE_ALIAS = 'default'
+PROFIL_CACHE_TTL = 600
+
+# Notifications : compteur de non lues en cache et flux Server-Sent Events (voir comptes/notifications.py)
+NOTIFICATIONS_CACHE_TTL = 300
+NOTIFICATIONS_FLUX_INTERVALLE = float(os.getenv('NOTIFICATIONS_FLUX_INTERVALLE', '2'))
+NOTIFICATIONS_FLUX_DUREE = int(os.getenv('NOTIFICATIONS_FLUX_DUREE', '55'))
+# Sans VUES_ASYNC (WSGI), les pages relisent le compteur toutes les NOTIFICATIONS_SONDAGE secondes au lieu d'ouvrir un flux
+NOTIFICATIONS_SONDAGE = int(os.getenv('NOTIFICATIONS_SONDAGE', '60'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -153,9 +220,57 @@ STATICFILES_DIRS = [
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
+# collectstatic ajoute l'empreinte du contenu aux noms et précompresse (.br, .gz)
+# les fichiers texte ; ils sont servis par bibliotech.statiques.servir_statique
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'bibliotech.statiques.StockageStatiqueCompresse'},
+}
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Couvertures de livres (voir bibliotheque/couvertures.py) : 'local' (MEDIA_ROOT) ou 'supabase' (Storage)
+COUVERTURES_STOCKAGE = os.getenv('COUVERTURES_STOCKAGE', 'local')
+COUVERTURES_BUCKET = os.getenv('COUVERTURES_BUCKET', 'couvertures')
+COUVERTURES_MINIATURES = {
+    'liste': (240, 320),
+    'detail': (480, 640),
+}
+
+# Redimensionnement d'images à la demande (voir bibliotheque/images.py)
+IMAGES_HOTES_AUTORISES = [urlparse(SUPABASE_URL).hostname] + [
+    hote.strip() for hote in os.getenv('IMAGES_HOTES_AUTORISES', '').split(',') if hote.strip()
+]
+IMAGES_CACHE_DIR = os.path.join(BASE_DIR, 'cache_images')
+IMAGES_CACHE_TAILLE_MAX = int(os.getenv('IMAGES_CACHE_TAILLE_MAX', str(500 * 1024 * 1024)))
+# Les images distantes (même URL, contenu modifiable) sont relues au plus tard après ce délai
+IMAGES_DISTANTES_DUREE = int(os.getenv('IMAGES_DISTANTES_DUREE', str(24 * 3600)))
+
+# Métriques Prometheus (/metrics, voir bibliotech/metriques.py) : un fichier par worker
+# dans METRIQUES_DOSSIER, à vider au démarrage du service ; la vue est refusée sans METRIQUES_JETON
+METRIQUES_DOSSIER = os.getenv('METRIQUES_DOSSIER', os.path.join(BASE_DIR, 'metriques'))
+if EN_TEST:
+    METRIQUES_DOSSIER = os.path.join(DOSSIER_TESTS, 'metriques')
+METRIQUES_JETON = os.getenv('METRIQUES_JETON', '')
+
+# Une ligne JSON par requête avec ses appels Supabase (voir bibliotech/traces.py) ;
+# TRACES_NIVEAU=WARNING pour les couper
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'bibliotech.traces': {
+            'handlers': ['console'],
+            'level': os.getenv('TRACES_NIVEAU', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -0,0 +1,151 @@
+"""
+Fichiers statiques à noms empreintés et précompressés.
+
+À la collecte (collectstatic), StockageStatiqueCompresse ajoute l'empreinte
+du contenu au nom de chaque fichier (style.3f2a9c1b7d4e.css) puis écrit à
+côté des fichiers texte une version Brotli (.br) et gzip (.gz) lorsqu'elle
+est plus petite.
+
+Un fichier absent du manifeste (collecte pas encore relancée, manifeste
+absent) garde son nom d'origine dans {% static %}, et reste donc servi.
+
+servir_statique sert STATIC_ROOT : il choisit la variante précompressée
+selon Accept-Encoding, répond 304 à If-None-Match et met en cache pour un an
+les fichiers dont le nom contient une empreinte, puisque leur contenu ne
+change jamais.
+"""
+import gzip
+import mimetypes
+import os
+import re
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
+
+# Extensions compressées à la collecte ; les images et polices woff/woff2 le sont déjà
+EXTENSIONS_TEXTE = ('.css', '.js', '.mjs', '.map', '.svg', '.json', '.txt', '.html', '.xml', '.ico', '.ttf', '.eot')
+TAILLE_MIN_COMPRESSION = 512
+
+# Variantes dans l'ordre de préférence : (codage, suffixe)
+VARIANTES = (('br', '.br'), ('gzip', '.gz'))
+
+# Nom produit par ManifestStaticFilesStorage : nom.<12 caractères hexadécimaux>.ext
+_NOM_EMPREINTE = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+
+
+def _compresser_brotli(contenu):
+    try:
+        import brotli
+    except ImportError:
+        # Le paquet Brotli n'est pas installé : seule la variante gzip est produite
+        return None
+    return brotli.compress(contenu, quality=11)
+
+
+def _compresser_gzip(contenu):
+    # mtime fixe : une même entrée produit toujours le même fichier
+    return gzip.compress(contenu, compresslevel=9, mtime=0)
+
+
+class StockageStatiqueCompresse(ManifestStaticFilesStorage):
+    # Un fichier absent du manifeste ne lève pas d'erreur (voir stored_name)
+    manifest_strict = False
+
+    def stored_name(self, name):
+        # Sans entrée au manifeste, ManifestStaticFilesStorage calcule l'empreinte du fichier
+        # de STATIC_ROOT, alors qu'aucune copie empreintée n'y a été écrite : le nom
+        # d'origine, lui, existe tant que STATIC_ROOT contient le fichier
+        if self.hash_key(self.clean_name(urlsplit(unquote(name)).path.strip())) not in self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def hashed_name(self, name, content=None, filename=None):
+        try:
+            return super().hashed_name(name, content, filename)
+        except ValueError:
+            # Référence d'une feuille de style vers un fichier absent (ex. img/background.jpg) :
+            # l'URL est laissée telle quelle plutôt que d'interrompre la collecte
+            if content is not None:
+                raise
+            print(f"Fichier statique référencé introuvable: {name}")
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        for nom in self.hashed_files.values():
+            if nom.endswith(EXTENSIONS_TEXTE):
+                for variante in self._compresser(nom):
+                    yield nom, variante, True
+
+    def _compresser(self, nom):
+        chemin = self.path(nom)
+        with open(chemin, 'rb') as fichier:
+            contenu = fichier.read()
+        if len(contenu) < TAILLE_MIN_COMPRESSION:
+            return
+        for suffixe, compresser in (('.br', _compresser_brotli), ('.gz', _compresser_gzip)):
+            compresse = compresser(contenu)
+            if compresse is not None and len(compresse) < len(contenu):
+                with open(chemin + suffixe, 'wb') as sortie:
+                    sortie.write(compresse)
+                yield nom + suffixe
+
+
+def _codages_acceptes(entete):
+    """Codages d'Accept-Encoding, sans ceux refusés explicitement (q=0)"""
+    codages = set()
+    for partie in (entete or '').split(','):
+        codage, _, parametre = partie.partition(';')
+        nom, _, valeur = parametre.partition('=')
+        if nom.strip() == 'q':
+            try:
+                if float(valeur) <= 0:
+                    continue
+            except ValueError:
+                continue
+        codages.add(codage.strip().lower())
+    return codages
+
+
+def servir_statique(request, chemin):
+    """Sert un fichier de STATIC_ROOT, précompressé si possible"""
+    racine = os.path.realpath(settings.STATIC_ROOT)
+    fichier = os.path.realpath(os.path.join(racine, chemin))
+    if os.path.commonpath([racine, fichier]) != racine or not os.path.isfile(fichier):
+        raise Http404("Fichier statique introuvable")
+
+    type_contenu, _ = mimetypes.guess_type(fichier)
+    codage = None
+    acceptes = _codages_acceptes(request.headers.get('Accept-Encoding'))
+    for nom_codage, suffixe in VARIANTES:
+        if nom_codage in acceptes and os.path.isfile(fichier + suffixe):
+            codage, fichier = nom_codage, fichier + suffixe
+            break
+
+    etat = os.stat(fichier)
+    etag = f'"{etat.st_mtime_ns:x}-{etat.st_size:x}"'
+    etags_client = [e.strip() for e in request.headers.get('If-None-Match', '').split(',')]
+    if etag in etags_client or '*' in etags_client:
+        reponse = HttpResponseNotModified()
+    else:
+        reponse = FileResponse(open(fichier, 'rb'), content_type=type_contenu or 'application/octet-stream')
+        # FileResponse déduit du fichier un Content-Disposition inutile pour une ressource de page
+        del reponse['Content-Disposition']
+        reponse['Content-Length'] = etat.st_size
+        if codage:
+            reponse['Content-Encoding'] = codage
+    reponse['ETag'] = etag
+    reponse['Last-Modified'] = http_date(etat.st_mtime)
+    if _NOM_EMPREINTE.search(chemin):
+        reponse['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        # Nom sans empreinte : le contenu peut changer, le navigateur revalide avec l'ETag
+        reponse['Cache-Control'] = 'public, max-age=0, must-revalidate'
+    patch_vary_headers(reponse, ['Accept-Encoding'])
+    return reponse
@@ -1,5 +1,12 @@
 from django.conf import settings
+import asyncio
+import atexit
 import logging
+import threading
+import time
+import weakref
+
+import httpx
 
 # Configuration du logging
 logger = logging.getLogger(__name__)
@@ -9,33 +16,263 @@ SUPABASE_URL = getattr(settings, 'SUPABASE_URL', None)
 SUPABASE_KEY = getattr(settings, 'SUPABASE_KEY', None)
 SUPABASE_SERVICE_KEY = getattr(settings, 'SUPABASE_SERVICE_ROLE_KEY', None)
 
-# Variables globales pour les clients
+# Paramètres du pool de connexions HTTP partagé par les threads d'un worker
+POOL_MAX_CONNEXIONS = getattr(settings, 'SUPABASE_POOL_MAX_CONNEXIONS', 20)
+POOL_MAX_KEEPALIVE = getattr(settings, 'SUPABASE_POOL_MAX_KEEPALIVE', 10)
+POOL_DUREE_KEEPALIVE = getattr(settings, 'SUPABASE_POOL_DUREE_KEEPALIVE', 60.0)
+SUPABASE_HTTP2 = getattr(settings, 'SUPABASE_HTTP2', True)
+
+# Base SQLite locale à la place du projet Supabase (voir bibliotech/supabase_local.py)
+SUPABASE_LOCAL = getattr(settings, 'SUPABASE_LOCAL', '')
+
+# Intervalle minimal (en secondes) entre deux vérifications de santé, déclenchées par une erreur de connexion
+INTERVALLE_SANTE = getattr(settings, 'SUPABASE_INTERVALLE_SANTE', 30)
+
+# Registre des clients : 'anon' et 'admin', créés à la première utilisation
+_clients = {}
+_verrou = threading.Lock()
+_derniere_verification = {}
+
+# Clients PostgREST asynchrones, par boucle d'événements : une session httpx
+# asynchrone ne peut pas être utilisée depuis une autre boucle que la sienne.
+# Chaque boucle garde aussi le générateur qui ferme ses clients à son arrêt.
+_clients_async = weakref.WeakKeyDictionary()
+_fermetures_async = weakref.WeakKeyDictionary()
+
+# Variables globales conservées pour la compatibilité avec l'ancien code
 supabase = None
 supabase_admin = None
 
-def init_supabase_clients():
-    """Initialise les clients Supabase avec gestion d'erreur"""
+
+class TransportSurveille(httpx.BaseTransport):
+    """Transport qui signale les erreurs de connexion du client `nom` (vérification de santé)"""
+
+    def __init__(self, transport, nom):
+        self.transport = transport
+        self.nom = nom
+
+    def handle_request(self, requete):
+        try:
+            return self.transport.handle_request(requete)
+        except httpx.TransportError:
+            signaler_erreur_connexion(self.nom)
+            raise
+
+    def close(self):
+        self.transport.close()
+
+
+class TransportSurveilleAsync(httpx.AsyncBaseTransport):
+    """Variante asynchrone de TransportSurveille"""
+
+    def __init__(self, transport, nom):
+        self.transport = transport
+        self.nom = nom
+
+    async def handle_async_request(self, requete):
+        try:
+            return await self.transport.handle_async_request(requete)
+        except httpx.TransportError:
+            signaler_erreur_connexion(self.nom)
+            raise
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def _creer_transport(limites, asynchrone=False):
+    """Transport réseau du pool : HTTP/2 si possible, sinon HTTP/1.1 avec keep-alive"""
+    http2 = SUPABASE_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("HTTP/2 indisponible (paquet h2 manquant), utilisation de HTTP/1.1")
+            http2 = False
+    classe = httpx.AsyncHTTPTransport if asynchrone else httpx.HTTPTransport
+    return classe(http2=http2, limits=limites)
+
+
+def _creer_session_pool(ancienne_session, asynchrone=False, transport=None, nom=None):
+    """Crée une session HTTP à pool dimensionné, keep-alive et HTTP/2 à partir de la session d'origine
+
+    Avec `nom` ('anon' ou 'admin'), une erreur de connexion déclenche la
+    vérification de santé de ce client du registre.
+    """
+    from postgrest.utils import AsyncClient, SyncClient
+    from .traces import event_hooks
+
+    if transport is None and SUPABASE_LOCAL:
+        from .supabase_local import transport_local
+        transport = transport_local(asynchrone)
+    if transport is None:
+        limites = httpx.Limits(
+            max_connections=POOL_MAX_CONNEXIONS,
+            max_keepalive_connections=POOL_MAX_KEEPALIVE,
+            keepalive_expiry=POOL_DUREE_KEEPALIVE,
+        )
+        transport = _creer_transport(limites, asynchrone)
+    if nom is not None:
+        transport = (TransportSurveilleAsync if asynchrone else TransportSurveille)(transport, nom)
+    classe = AsyncClient if asynchrone else SyncClient
+    return classe(
+        base_url=ancienne_session.base_url,
+        headers=ancienne_session.headers,
+        timeout=ancienne_session.timeout,
+        transport=transport,
+        # Chaque appel est mesuré et rangé dans la requête en cours (voir bibliotech/traces.py)
+        event_hooks=event_hooks(asynchrone),
+    )
+
+
+def _creer_client(cle, nom):
+    """Crée un client Supabase dont la session PostgREST utilise le pool partagé"""
+    from supabase import create_client
+    from supabase.lib.client_options import ClientOptions
+    from .traces import tracer_session
+
+    # Des options neuves à chaque appel : l'objet par défaut de create_client est partagé
+    client = create_client(SUPABASE_URL, cle, options=ClientOptions())
+
+    ancienne_session = client.postgrest.session
+    client.postgrest.session = _creer_session_pool(ancienne_session, nom=nom)
+    ancienne_session.close()
+    if SUPABASE_LOCAL:
+        from .supabase_local import brancher_auth, transport_local
+        brancher_auth(client, transport_local())
+    # Les appels d'authentification passent par la session httpx propre au client Auth
+    tracer_session(getattr(client.auth, '_http_client', None))
+    return client
+
+
+def get_supabase_client(admin=False):
+    """Retourne le client Supabase du processus, créé à la première utilisation"""
+    nom = 'admin' if admin else 'anon'
+    client = _clients.get(nom)
+    if client is not None:
+        return client
+
+    with _verrou:
+        client = _clients.get(nom)
+        if client is None:
+            if not SUPABASE_URL or not SUPABASE_KEY or not SUPABASE_SERVICE_KEY:
+                logger.error("Les variables SUPABASE_URL, SUPABASE_KEY et SUPABASE_SERVICE_ROLE_KEY doivent être définies dans settings.py")
+                return None
+            try:
+                client = _creer_client(SUPABASE_SERVICE_KEY if admin else SUPABASE_KEY, nom)
+            except Exception as e:
+                logger.error(f"Erreur lors de l'initialisation du client Supabase '{nom}': {e}")
+                return None
+            _clients[nom] = client
+            _publier_globales()
+            logger.info(f"Client Supabase '{nom}' initialisé")
+    return client
+
+
+async def _fermer_a_l_arret(clients):
+    """Ferme les clients d'une boucle lorsqu'elle s'arrête
+
+    asyncio.run (serveur ASGI, async_to_sync) finalise les générateurs
+    asynchrones encore suspendus avant de fermer la boucle : le bloc finally
+    s'exécute alors dans la boucle des clients.
+    """
+    try:
+        yield
+    finally:
+        for client in clients.values():
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"Erreur lors de la fermeture du client PostgREST asynchrone: {e}")
+
+
+def get_async_postgrest_client(admin=False):
+    """Retourne le client PostgREST asynchrone de la boucle d'événements courante"""
+    from postgrest import AsyncPostgrestClient
+
+    boucle = asyncio.get_running_loop()
+    clients = _clients_async.get(boucle)
+    if clients is None:
+        clients = _clients_async[boucle] = {}
+        # Premier pas du générateur dans cette boucle : elle le suit jusqu'à son arrêt
+        fermeture = _fermetures_async[boucle] = _fermer_a_l_arret(clients)
+        asyncio.ensure_future(fermeture.__anext__())
+    nom = 'admin' if admin else 'anon'
+    client = clients.get(nom)
+    if client is None:
+        client_sync = get_supabase_client(admin=admin)
+        if client_sync is None:
+            return None
+        # Mêmes URL et en-têtes d'authentification que le client synchrone
+        session_sync = client_sync.postgrest.session
+        client = AsyncPostgrestClient(str(session_sync.base_url), headers=dict(session_sync.headers))
+        client.session = _creer_session_pool(session_sync, asynchrone=True, nom=nom)
+        clients[nom] = client
+    return client
+
+
+def _publier_globales():
     global supabase, supabase_admin
-    
-    if not SUPABASE_URL or not SUPABASE_KEY or not SUPABASE_SERVICE_KEY:
-        logger.error("Les variables SUPABASE_URL, SUPABASE_KEY et SUPABASE_SERVICE_ROLE_KEY doivent être définies dans settings.py")
+    supabase = _clients.get('anon')
+    supabase_admin = _clients.get('admin')
+
+
+def fermer_clients_supabase():
+    """Ferme les connexions du pool et vide le registre (appelée à l'arrêt du worker, et par les tests)"""
+    with _verrou:
+        for client in _clients.values():
+            try:
+                client.postgrest.session.close()
+            except Exception as e:
+                logger.warning(f"Erreur lors de la fermeture du client Supabase: {e}")
+        _clients.clear()
+        _derniere_verification.clear()
+        _publier_globales()
+
+
+atexit.register(fermer_clients_supabase)
+
+
+def signaler_erreur_connexion(nom):
+    """Erreur de connexion sur un client : vérification en arrière-plan, au plus une par INTERVALLE_SANTE"""
+    maintenant = time.monotonic()
+    with _verrou:
+        if maintenant - _derniere_verification.get(nom, 0) < INTERVALLE_SANTE:
+            return
+        _derniere_verification[nom] = maintenant
+    threading.Thread(
+        target=verifier_sante_supabase, kwargs={'admin': nom == 'admin', 'forcer': True}, daemon=True,
+    ).start()
+
+
+def verifier_sante_supabase(admin=False, forcer=False):
+    """Vérifie que le client répond ; le recrée si la connexion est rompue"""
+    nom = 'admin' if admin else 'anon'
+    maintenant = time.monotonic()
+    if not forcer and maintenant - _derniere_verification.get(nom, 0) < INTERVALLE_SANTE:
+        return nom in _clients
+
+    client = get_supabase_client(admin=admin)
+    if client is None:
         return False
-    
+
+    _derniere_verification[nom] = maintenant
     try:
-        from supabase import create_client, Client
-        
-        # Client Supabase avec clé anonyme (pour les opérations utilisateur)
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-        
-        # Client Supabase avec clé service (pour les opérations admin)
-        supabase_admin = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
-        
-        logger.info("Clients Supabase initialisés avec succès")
-        return True
-        
+        reponse = client.postgrest.session.get('/', timeout=5)
+        return reponse.status_code < 500
     except Exception as e:
-        logger.error(f"Erreur lors de l'initialisation des clients Supabase: {e}")
+        logger.warning(f"Client Supabase '{nom}' injoignable, recréation: {e}")
+        with _verrou:
+            ancien = _clients.pop(nom, None)
+            if ancien is not None:
+                try:
+                    ancien.postgrest.session.close()
+                except Exception:
+                    pass
+            _publier_globales()
         return False
 
-# Initialiser les clients au chargement du module
-init_supabase_clients()
\ No newline at end of file
+
+def init_supabase_clients():
+    """Initialise les clients Supabase avec gestion d'erreur"""
+    return get_supabase_client() is not None and get_supabase_client(admin=True) is not None
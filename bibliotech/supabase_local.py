@@ -0,0 +1,730 @@
+"""
+Supabase local : PostgREST et Auth (GoTrue) simulés sur SQLite.
+
+Un transport httpx remplace le réseau : les clients de
+bibliotech.supabase_client, SupabaseService et AsyncSupabaseService
+fonctionnent sans projet Supabase ni connexion, sur les tables de
+init_supabase_tables.sql. Activé par SUPABASE_LOCAL (':memory:' ou chemin
+d'un fichier SQLite) ; SUPABASE_LOCAL_LATENCE_MS ajoute à chaque appel une
+latence fixe ("20") ou tirée au hasard, de façon reproductible ("10-40").
+
+Sous-ensemble pris en charge, celui qu'utilise l'application :
+- PostgREST : select avec colonnes et ressources imbriquées (clés étrangères
+  dans les deux sens), filtres eq, neq, gt, gte, lt, lte, like, ilike, in,
+  is, not. et or/and imbriqués, order, limit, offset, en-tête Range,
+  Prefer count=exact ; insert, upsert (on_conflict, merge ou ignore),
+  update et delete, avec return=representation ou minimal ;
+- Auth : signup, token (password et refresh_token), user et logout.
+  L'inscription crée aussi le profil, comme la fonction handle_new_user()
+  du projet Supabase.
+
+Écart de schéma : le script nomme utilisateur_id la colonne des favoris que
+le code et la base déployée appellent user_id ; CORRECTIFS_SCHEMA la renomme
+au chargement.
+"""
+import asyncio
+from functools import lru_cache
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+from django.conf import settings
+
+SCHEMA = getattr(settings, 'SUPABASE_LOCAL_SCHEMA', os.path.join(settings.BASE_DIR, 'init_supabase_tables.sql'))
+
+# Table -> {colonne du script: colonne réellement utilisée}
+CORRECTIFS_SCHEMA = {'favoris': {'utilisateur_id': 'user_id'}}
+
+# Types PostgreSQL -> affinité SQLite
+TYPES = {
+    'UUID': 'TEXT', 'VARCHAR': 'TEXT', 'TEXT': 'TEXT', 'DATE': 'TEXT', 'TIME': 'TEXT', 'TIMESTAMP': 'TEXT',
+    'BOOLEAN': 'INTEGER', 'INTEGER': 'INTEGER', 'BIGINT': 'INTEGER', 'NUMERIC': 'REAL',
+}
+
+OPERATEURS = {'eq': '=', 'neq': '!=', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}
+
+# Paramètres de requête PostgREST qui ne sont pas des filtres
+PARAMETRES = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+
+# Nombre maximal de valeurs par IN () (limite de variables de SQLite)
+TAILLE_LOT = 500
+
+DUREE_JETON = 3600
+
+
+class ErreurPostgrest(Exception):
+    def __init__(self, statut, code, message):
+        super().__init__(message)
+        self.statut = statut
+        self.code = code
+        self.message = message
+
+    def reponse(self):
+        return httpx.Response(self.statut, json={
+            'code': self.code, 'message': self.message, 'details': None, 'hint': None,
+        })
+
+
+class Table:
+    def __init__(self, nom):
+        self.nom = nom
+        self.colonnes = []
+        self.booleens = set()
+        self.uuid_auto = set()         # DEFAULT gen_random_uuid()
+        self.horodatage_auto = set()   # DEFAULT NOW()
+        self.references = {}           # colonne -> table référencée
+
+
+def horodatage():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _decouper(texte, separateur=','):
+    """Découpe au premier niveau, hors parenthèses et guillemets"""
+    parties, courant, profondeur, guillemets = [], [], 0, False
+    for caractere in texte:
+        if caractere == '"':
+            guillemets = not guillemets
+        elif not guillemets:
+            if caractere == '(':
+                profondeur += 1
+            elif caractere == ')':
+                profondeur -= 1
+            elif caractere == separateur and profondeur == 0:
+                parties.append(''.join(courant))
+                courant = []
+                continue
+        courant.append(caractere)
+    parties.append(''.join(courant))
+    return [partie.strip() for partie in parties if partie.strip()]
+
+
+def lire_schema(sql):
+    """Traduit les CREATE TABLE et CREATE INDEX du script en SQLite ; retourne (ddl, tables)"""
+    sql = re.sub(r'--[^\n]*', '', sql)
+    ddl, tables = [], {}
+    for nom, corps in re.findall(r'CREATE TABLE IF NOT EXISTS (\w+)\s*\((.*?)\);', sql, re.S):
+        for ancien, nouveau in CORRECTIFS_SCHEMA.get(nom, {}).items():
+            corps = re.sub(rf'\b{ancien}\b', nouveau, corps)
+        table = tables[nom] = Table(nom)
+        definitions = []
+        for element in _decouper(corps):
+            if re.match(r'(UNIQUE|PRIMARY KEY|CHECK|FOREIGN KEY|CONSTRAINT)\b', element, re.I):
+                definitions.append(element)
+                continue
+            colonne, type_sql, reste = re.match(
+                r'(\w+)\s+([A-Za-z]+)(?:\s*\([\d, ]+\))?(?:\s+WITH(?:OUT)?\s+TIME\s+ZONE)?(.*)', element, re.S
+            ).groups()
+            type_sql = type_sql.upper()
+            table.colonnes.append(colonne)
+            if type_sql == 'BOOLEAN':
+                table.booleens.add(colonne)
+            # Valeurs par défaut calculées en Python à l'insertion
+            if re.search(r'DEFAULT\s+gen_random_uuid\(\)', reste, re.I):
+                table.uuid_auto.add(colonne)
+            if re.search(r'DEFAULT\s+NOW\(\)', reste, re.I):
+                table.horodatage_auto.add(colonne)
+            reste = re.sub(r'DEFAULT\s+(gen_random_uuid|NOW)\(\)', '', reste, flags=re.I)
+            reste = re.sub(r'DEFAULT\s+TRUE\b', 'DEFAULT 1', reste, flags=re.I)
+            reste = re.sub(r'DEFAULT\s+FALSE\b', 'DEFAULT 0', reste, flags=re.I)
+            reference = re.search(
+                r'REFERENCES\s+([\w.]+)\s*\(\w+\)(\s+ON\s+(DELETE|UPDATE)\s+(CASCADE|SET NULL|RESTRICT|NO ACTION))*',
+                reste, re.I,
+            )
+            if reference and '.' in reference.group(1):
+                # auth.users n'est pas une table locale : les utilisateurs sont gérés à part
+                reste = reste.replace(reference.group(0), '')
+            elif reference:
+                table.references[colonne] = reference.group(1)
+            definitions.append(f"{colonne} {TYPES.get(type_sql, 'TEXT')} {reste.strip()}".strip())
+        ddl.append(f"CREATE TABLE IF NOT EXISTS {nom} ({', '.join(definitions)})")
+
+    for index in re.findall(r'CREATE INDEX IF NOT EXISTS \w+ ON \w+\s*\([^)]*\)', sql):
+        table = re.search(r' ON (\w+)', index).group(1)
+        for ancien, nouveau in CORRECTIFS_SCHEMA.get(table, {}).items():
+            index = re.sub(rf'\b{ancien}\b', nouveau, index)
+        ddl.append(index)
+    return ddl, tables
+
+
+def lire_selection(texte):
+    """'*, livres(*, auteurs(id, nom))' -> [(nom, ressource, sous-sélection)] ; ressource None pour une colonne"""
+    elements = []
+    for element in _decouper(re.sub(r'\s+', '', texte or '*')):
+        ressource = re.fullmatch(r'(?:(\w+):)?(\w+)(?:!\w+)*\((.*)\)', element, re.S)
+        if ressource:
+            alias, nom, contenu = ressource.groups()
+            elements.append((alias or nom, nom, lire_selection(contenu)))
+        else:
+            elements.append((element, None, None))
+    return elements
+
+
+@lru_cache(maxsize=256)
+def _motif(motif, insensible):
+    expression = ''.join('.*' if c in '%*' else '.' if c == '_' else re.escape(c) for c in motif)
+    return re.compile(expression, re.S | (re.I if insensible else 0))
+
+
+def _correspond(valeur, motif, insensible):
+    return valeur is not None and motif is not None and _motif(motif, bool(insensible)).fullmatch(str(valeur)) is not None
+
+
+def _hacher(mot_de_passe, sel=None):
+    sel = sel or os.urandom(8).hex()
+    empreinte = hashlib.pbkdf2_hmac('sha256', mot_de_passe.encode('utf-8'), sel.encode('ascii'), 1000).hex()
+    return f"{sel}${empreinte}"
+
+
+class BaseLocale:
+    """Base SQLite et traitement des requêtes PostgREST et Auth"""
+
+    def __init__(self, chemin=':memory:', schema=SCHEMA):
+        self._verrou = threading.RLock()
+        self._connexion = sqlite3.connect(chemin, check_same_thread=False)
+        self._connexion.row_factory = sqlite3.Row
+        self._connexion.create_function('correspond', 3, _correspond, deterministic=True)
+        self._connexion.execute('PRAGMA foreign_keys = ON')
+        with open(schema, encoding='utf-8') as fichier:
+            ddl, self.tables = lire_schema(fichier.read())
+        with self._connexion:
+            for instruction in ddl:
+                self._connexion.execute(instruction)
+            self._connexion.execute(
+                'CREATE TABLE IF NOT EXISTS _auth_utilisateurs (id TEXT PRIMARY KEY, email TEXT UNIQUE NOT NULL, '
+                'mot_de_passe TEXT NOT NULL, user_metadata TEXT, created_at TEXT)'
+            )
+        self._jetons = {}           # access_token -> id utilisateur
+        self._jetons_refresh = {}   # refresh_token -> id utilisateur
+
+    def vider(self):
+        """Supprime toutes les lignes et les sessions ; le schéma est conservé"""
+        with self._verrou:
+            self._connexion.execute('PRAGMA foreign_keys = OFF')
+            try:
+                with self._connexion:
+                    for nom in list(self.tables) + ['_auth_utilisateurs']:
+                        self._connexion.execute(f'DELETE FROM {nom}')
+            finally:
+                self._connexion.execute('PRAGMA foreign_keys = ON')
+            self._jetons.clear()
+            self._jetons_refresh.clear()
+
+    def traiter(self, requete):
+        """Répond à une requête httpx adressée à /rest/v1/ ou /auth/v1/"""
+        chemin = requete.url.path
+        with self._verrou:
+            try:
+                if '/auth/v1/' in chemin:
+                    return self._auth(requete, chemin.split('/auth/v1/', 1)[1].strip('/'))
+                if '/rest/v1' in chemin:
+                    return self._rest(requete, chemin.split('/rest/v1', 1)[1].strip('/'))
+                raise ErreurPostgrest(404, 'PGRST000', f"Chemin non pris en charge: {chemin}")
+            except ErreurPostgrest as e:
+                return e.reponse()
+            except sqlite3.IntegrityError as e:
+                return self._erreur_integrite(e).reponse()
+            except sqlite3.OperationalError as e:
+                return ErreurPostgrest(400, '42703', str(e)).reponse()
+
+    # PostgREST
+
+    def _table(self, nom):
+        table = self.tables.get(nom)
+        if table is None:
+            raise ErreurPostgrest(404, '42P01', f'relation "public.{nom}" does not exist')
+        return table
+
+    def _verifier_colonne(self, table, colonne):
+        if colonne not in table.colonnes:
+            raise ErreurPostgrest(400, '42703', f'column {table.nom}.{colonne} does not exist')
+
+    @staticmethod
+    def _erreur_integrite(erreur):
+        message = str(erreur)
+        for debut, statut, code in (
+            ('UNIQUE', 409, '23505'), ('NOT NULL', 400, '23502'),
+            ('FOREIGN KEY', 409, '23503'), ('CHECK', 400, '23514'),
+        ):
+            if message.startswith(debut):
+                return ErreurPostgrest(statut, code, message)
+        return ErreurPostgrest(400, '23000', message)
+
+    def _rest(self, requete, table):
+        if not table:
+            return httpx.Response(200, json={})
+        table = self._table(table)
+        if requete.method in ('GET', 'HEAD'):
+            return self._lire(table, requete)
+        if requete.method == 'POST':
+            return self._inserer(table, requete)
+        if requete.method == 'PATCH':
+            return self._modifier(table, requete)
+        if requete.method == 'DELETE':
+            return self._supprimer(table, requete)
+        raise ErreurPostgrest(405, 'PGRST000', f"Méthode non prise en charge: {requete.method}")
+
+    @staticmethod
+    def _valeur(table, colonne, brut):
+        brut = brut.strip()
+        if len(brut) >= 2 and brut[0] == brut[-1] == '"':
+            brut = brut[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+        if colonne in table.booleens and brut.lower() in ('true', 'false'):
+            return 1 if brut.lower() == 'true' else 0
+        return brut
+
+    def _condition(self, table, colonne, expression):
+        """Traduit 'op.valeur' (éventuellement précédé de not.) en SQL ; retourne (sql, paramètres)"""
+        self._verifier_colonne(table, colonne)
+        negation = expression.startswith('not.')
+        if negation:
+            expression = expression[4:]
+        operateur, _, valeur = expression.partition('.')
+        if operateur in OPERATEURS:
+            sql, parametres = f'{colonne} {OPERATEURS[operateur]} ?', [self._valeur(table, colonne, valeur)]
+        elif operateur in ('like', 'ilike'):
+            sql, parametres = f'correspond({colonne}, ?, ?)', [self._valeur(table, colonne, valeur), operateur == 'ilike']
+        elif operateur == 'in':
+            parametres = [self._valeur(table, colonne, v) for v in _decouper(valeur.strip()[1:-1])]
+            sql = f"{colonne} IN ({', '.join('?' * len(parametres))})" if parametres else '0'
+        elif operateur == 'is' and valeur.lower() in ('null', 'true', 'false'):
+            sql, parametres = f"{colonne} IS {dict(null='NULL', true='1', false='0')[valeur.lower()]}", []
+        else:
+            raise ErreurPostgrest(400, 'PGRST100', f"Opérateur non pris en charge: {operateur}")
+        return (f'NOT ({sql})' if negation else sql), parametres
+
+    def _logique(self, table, operateur, contenu):
+        """Traduit le contenu de or=(...) ou and=(...), conditions imbriquées comprises"""
+        morceaux, parametres = [], []
+        for element in _decouper(contenu):
+            groupe = re.fullmatch(r'(not\.)?(and|or)\((.*)\)', element, re.S)
+            if groupe:
+                sql, valeurs = self._logique(table, groupe.group(2), groupe.group(3))
+                if groupe.group(1):
+                    sql = f'NOT {sql}'
+            else:
+                colonne, _, expression = element.partition('.')
+                sql, valeurs = self._condition(table, colonne, expression)
+            morceaux.append(sql)
+            parametres += valeurs
+        return '(' + f' {operateur.upper()} '.join(morceaux) + ')', parametres
+
+    def _filtres(self, table, requete):
+        conditions, parametres = [], []
+        for nom, valeur in requete.url.params.multi_items():
+            if nom in PARAMETRES:
+                continue
+            logique = re.fullmatch(r'(not\.)?(and|or)', nom)
+            if logique:
+                sql, valeurs = self._logique(table, logique.group(2), valeur.strip()[1:-1])
+                if logique.group(1):
+                    sql = f'NOT {sql}'
+            elif '.' in nom:
+                raise ErreurPostgrest(400, 'PGRST100', f"Filtre sur une ressource imbriquée non pris en charge: {nom}")
+            else:
+                sql, valeurs = self._condition(table, nom, valeur)
+            conditions.append(sql)
+            parametres += valeurs
+        return (' AND '.join(conditions) or '1'), parametres
+
+    def _tri(self, table, requete):
+        termes = []
+        for valeur in requete.url.params.get_list('order'):
+            for terme in _decouper(valeur):
+                colonne, *options = terme.split('.')
+                self._verifier_colonne(table, colonne)
+                sens = 'DESC' if 'desc' in options else 'ASC'
+                # Ordre des NULL de PostgreSQL : en dernier en ASC, en premier en DESC
+                nulls = 'FIRST' if 'nullsfirst' in options or (sens == 'DESC' and 'nullslast' not in options) else 'LAST'
+                termes.append(f'{colonne} {sens} NULLS {nulls}')
+        return ' ORDER BY ' + ', '.join(termes) if termes else ''
+
+    def _ligne(self, table, ligne):
+        ligne = dict(ligne)
+        for colonne in table.booleens:
+            if ligne.get(colonne) is not None:
+                ligne[colonne] = bool(ligne[colonne])
+        return ligne
+
+    def _lignes_par(self, table, colonne, valeurs):
+        """Lignes d'une table dont la colonne vaut l'une des valeurs, par lots"""
+        valeurs = list(dict.fromkeys(v for v in valeurs if v is not None))
+        lignes = []
+        for debut in range(0, len(valeurs), TAILLE_LOT):
+            lot = valeurs[debut:debut + TAILLE_LOT]
+            curseur = self._connexion.execute(
+                f"SELECT * FROM {table.nom} WHERE {colonne} IN ({', '.join('?' * len(lot))}) ORDER BY rowid", lot
+            )
+            lignes += [self._ligne(table, ligne) for ligne in curseur]
+        return lignes
+
+    def _projeter(self, table, lignes, selection):
+        """Applique une sélection (colonnes et ressources imbriquées) à des lignes"""
+        resultats = [{} for _ in lignes]
+        for nom, ressource, sous_selection in selection:
+            if ressource is None:
+                if nom == '*':
+                    for resultat, ligne in zip(resultats, lignes):
+                        resultat.update(ligne)
+                    continue
+                alias, _, colonne = nom.rpartition(':')
+                colonne = colonne.split('::')[0]
+                self._verifier_colonne(table, colonne)
+                for resultat, ligne in zip(resultats, lignes):
+                    resultat[alias or colonne] = ligne.get(colonne)
+                continue
+
+            cible = self._table(ressource)
+            # Plusieurs-à-un : la table courante référence la ressource (livres.auteur_id -> auteurs)
+            colonne = next((c for c, t in table.references.items() if t == ressource), None)
+            if colonne:
+                enfants = {enfant['id']: enfant for enfant in self._lignes_par(cible, 'id', (l.get(colonne) for l in lignes))}
+                projetes = dict(zip(enfants, self._projeter(cible, list(enfants.values()), sous_selection)))
+                for resultat, ligne in zip(resultats, lignes):
+                    resultat[nom] = projetes.get(ligne.get(colonne))
+                continue
+            # Un-à-plusieurs : la ressource référence la table courante (livres.categorie_id -> categories)
+            colonne = next((c for c, t in cible.references.items() if t == table.nom), None)
+            if colonne:
+                enfants = self._lignes_par(cible, colonne, (l.get('id') for l in lignes))
+                groupes = {}
+                for enfant, projete in zip(enfants, self._projeter(cible, enfants, sous_selection)):
+                    groupes.setdefault(enfant[colonne], []).append(projete)
+                for resultat, ligne in zip(resultats, lignes):
+                    resultat[nom] = groupes.get(ligne.get('id'), [])
+                continue
+            raise ErreurPostgrest(
+                400, 'PGRST200', f"Could not find a relationship between '{table.nom}' and '{ressource}' in the schema cache"
+            )
+        return resultats
+
+    @staticmethod
+    def _plage(debut, nombre, total=None):
+        total = '*' if total is None else total
+        return f'{debut}-{debut + nombre - 1}/{total}' if nombre else f'*/{total}'
+
+    def _reponse(self, requete, statut, lignes, debut=0, total=None):
+        entetes = {'Content-Range': self._plage(debut, len(lignes), total)}
+        if 'vnd.pgrst.object' in requete.headers.get('accept', ''):
+            if len(lignes) != 1:
+                raise ErreurPostgrest(406, 'PGRST116', f"JSON object requested, multiple (or no) rows returned ({len(lignes)})")
+            return httpx.Response(statut, json=lignes[0], headers=entetes)
+        if requete.method == 'HEAD':
+            return httpx.Response(statut, headers=entetes)
+        return httpx.Response(statut, json=lignes, headers=entetes)
+
+    def _lire(self, table, requete):
+        selection = lire_selection(requete.url.params.get('select', '*'))
+        conditions, parametres = self._filtres(table, requete)
+
+        debut = int(requete.url.params.get('offset', 0))
+        limite = requete.url.params.get('limit')
+        plage = re.fullmatch(r'(\d+)-(\d*)', requete.headers.get('range', ''))
+        if plage:
+            debut = int(plage.group(1))
+            if plage.group(2):
+                limite = int(plage.group(2)) - debut + 1
+        sql = f'SELECT * FROM {table.nom} WHERE {conditions}{self._tri(table, requete)}'
+        sql += f' LIMIT {int(limite) if limite is not None else -1} OFFSET {debut}'
+        lignes = [self._ligne(table, ligne) for ligne in self._connexion.execute(sql, parametres)]
+
+        total = None
+        if 'count=' in requete.headers.get('prefer', ''):
+            total = self._connexion.execute(f'SELECT COUNT(*) FROM {table.nom} WHERE {conditions}', parametres).fetchone()[0]
+        return self._reponse(requete, 200, self._projeter(table, lignes, selection), debut, total)
+
+    def _preparer(self, table, ligne):
+        """Vérifie les colonnes et complète les valeurs par défaut calculées"""
+        if not isinstance(ligne, dict):
+            raise ErreurPostgrest(400, 'PGRST102', "Corps JSON invalide")
+        ligne = dict(ligne)
+        for colonne, valeur in ligne.items():
+            self._verifier_colonne(table, colonne)
+            if isinstance(valeur, (dict, list)):
+                ligne[colonne] = json.dumps(valeur)
+        fournies = set(ligne)
+        for colonne in table.uuid_auto:
+            ligne.setdefault(colonne, str(uuid.uuid4()))
+        maintenant = horodatage()
+        for colonne in table.horodatage_auto:
+            ligne.setdefault(colonne, maintenant)
+        return ligne, fournies
+
+    def _representation(self, requete, statut, table, lignes):
+        if 'return=representation' not in requete.headers.get('prefer', ''):
+            return httpx.Response(204 if statut == 200 else statut)
+        lignes = [self._ligne(table, ligne) for ligne in lignes]
+        selection = lire_selection(requete.url.params.get('select', '*'))
+        return self._reponse(requete, statut, self._projeter(table, lignes, selection))
+
+    def _inserer(self, table, requete):
+        corps = json.loads(requete.content or b'null')
+        lignes = corps if isinstance(corps, list) else [corps]
+        resolution = re.search(r'resolution=(merge|ignore)-duplicates', requete.headers.get('prefer', ''))
+        cibles = [c.strip() for c in requete.url.params.get('on_conflict', 'id').split(',')]
+        for colonne in cibles:
+            self._verifier_colonne(table, colonne)
+
+        inserees = []
+        with self._connexion:
+            for ligne in lignes:
+                ligne, fournies = self._preparer(table, ligne)
+                colonnes = list(ligne)
+                sql = f"INSERT INTO {table.nom} ({', '.join(colonnes)}) VALUES ({', '.join('?' * len(colonnes))})"
+                if resolution:
+                    a_modifier = [c for c in colonnes if c in fournies and c not in cibles]
+                    if resolution.group(1) == 'merge' and a_modifier:
+                        sql += f" ON CONFLICT ({', '.join(cibles)}) DO UPDATE SET "
+                        sql += ', '.join(f'{c} = excluded.{c}' for c in a_modifier)
+                    else:
+                        sql += f" ON CONFLICT ({', '.join(cibles)}) DO NOTHING"
+                inserees += self._connexion.execute(sql + ' RETURNING *', list(ligne.values())).fetchall()
+        return self._representation(requete, 201, table, inserees)
+
+    def _modifier(self, table, requete):
+        valeurs, _ = self._preparer(self._sans_defauts(table), json.loads(requete.content or b'{}'))
+        # Équivalent du déclencheur update_updated_at_column()
+        if 'updated_at' in table.colonnes and 'updated_at' not in valeurs:
+            valeurs['updated_at'] = horodatage()
+        if not valeurs:
+            raise ErreurPostgrest(400, 'PGRST102', "Aucune colonne à modifier")
+        conditions, parametres = self._filtres(table, requete)
+        affectations = ', '.join(f'{c} = ?' for c in valeurs)
+        with self._connexion:
+            lignes = self._connexion.execute(
+                f'UPDATE {table.nom} SET {affectations} WHERE {conditions} RETURNING *',
+                list(valeurs.values()) + parametres,
+            ).fetchall()
+        return self._representation(requete, 200, table, lignes)
+
+    @staticmethod
+    def _sans_defauts(table):
+        """Table sans valeurs par défaut calculées : une modification ne les applique pas"""
+        copie = Table(table.nom)
+        copie.colonnes, copie.booleens, copie.references = table.colonnes, table.booleens, table.references
+        return copie
+
+    def _supprimer(self, table, requete):
+        conditions, parametres = self._filtres(table, requete)
+        with self._connexion:
+            lignes = self._connexion.execute(
+                f'DELETE FROM {table.nom} WHERE {conditions} RETURNING *', parametres
+            ).fetchall()
+        return self._representation(requete, 200, table, lignes)
+
+    # Auth
+
+    def _auth(self, requete, action):
+        if action == 'signup' and requete.method == 'POST':
+            return self._inscrire(json.loads(requete.content or b'{}'))
+        if action == 'token' and requete.method == 'POST':
+            corps = json.loads(requete.content or b'{}')
+            if requete.url.params.get('grant_type') == 'refresh_token':
+                user_id = self._jetons_refresh.pop(corps.get('refresh_token'), None)
+                if user_id is None:
+                    return httpx.Response(400, json={'error': 'invalid_grant', 'error_description': 'Invalid Refresh Token'})
+                return httpx.Response(200, json=self._session(self._utilisateur(user_id)))
+            return self._connecter(corps.get('email') or '', corps.get('password') or '')
+        if action == 'user' and requete.method == 'GET':
+            user_id = self._jetons.get(requete.headers.get('authorization', '').removeprefix('Bearer '))
+            if user_id is None:
+                return httpx.Response(401, json={'code': 401, 'msg': 'Invalid JWT'})
+            return httpx.Response(200, json=self._utilisateur(user_id))
+        if action == 'logout':
+            user_id = self._jetons.pop(requete.headers.get('authorization', '').removeprefix('Bearer '), None)
+            self._jetons_refresh = {jeton: u for jeton, u in self._jetons_refresh.items() if u != user_id}
+            return httpx.Response(204)
+        return httpx.Response(404, json={'code': 404, 'msg': f"Point d'accès Auth non pris en charge: {action}"})
+
+    def _utilisateur(self, user_id):
+        ligne = self._connexion.execute('SELECT * FROM _auth_utilisateurs WHERE id = ?', [user_id]).fetchone()
+        if ligne is None:
+            return None
+        return {
+            'id': ligne['id'],
+            'aud': 'authenticated',
+            'role': 'authenticated',
+            'email': ligne['email'],
+            'app_metadata': {'provider': 'email', 'providers': ['email']},
+            'user_metadata': json.loads(ligne['user_metadata'] or '{}'),
+            'created_at': ligne['created_at'],
+            'updated_at': ligne['created_at'],
+            'confirmed_at': ligne['created_at'],
+            'email_confirmed_at': ligne['created_at'],
+            'identities': [{
+                'id': ligne['id'],
+                'user_id': ligne['id'],
+                'identity_data': {'sub': ligne['id'], 'email': ligne['email']},
+                'provider': 'email',
+                'created_at': ligne['created_at'],
+            }],
+        }
+
+    def _session(self, utilisateur):
+        jeton, jeton_refresh = f'local.{uuid.uuid4().hex}', uuid.uuid4().hex
+        self._jetons[jeton] = utilisateur['id']
+        self._jetons_refresh[jeton_refresh] = utilisateur['id']
+        return {
+            'access_token': jeton,
+            'refresh_token': jeton_refresh,
+            'expires_in': DUREE_JETON,
+            'token_type': 'bearer',
+            'user': utilisateur,
+        }
+
+    def _inscrire(self, corps):
+        email = (corps.get('email') or '').strip().lower()
+        mot_de_passe = corps.get('password') or ''
+        if not email or len(mot_de_passe) < 6:
+            return httpx.Response(422, json={'code': 422, 'msg': 'Signup requires a valid email and password of at least 6 characters'})
+        if self._connexion.execute('SELECT 1 FROM _auth_utilisateurs WHERE email = ?', [email]).fetchone():
+            return httpx.Response(400, json={'code': 400, 'msg': 'User already registered'})
+
+        donnees = corps.get('data') or {}
+        user_id = str(uuid.uuid4())
+        with self._connexion:
+            self._connexion.execute(
+                'INSERT INTO _auth_utilisateurs (id, email, mot_de_passe, user_metadata, created_at) VALUES (?, ?, ?, ?, ?)',
+                [user_id, email, _hacher(mot_de_passe), json.dumps(donnees), horodatage()],
+            )
+            # Équivalent de handle_new_user() : le profil reprend les métadonnées de l'inscription
+            profils = self.tables.get('profiles')
+            if profils is not None:
+                profil = {c: v for c, v in donnees.items() if c in profils.colonnes and c not in ('id', 'email')}
+                profil.update(id=user_id, email=email)
+                profil.setdefault('nom', '')
+                profil.setdefault('prenom', '')
+                profil, _ = self._preparer(profils, profil)
+                self._connexion.execute(
+                    f"INSERT INTO profiles ({', '.join(profil)}) VALUES ({', '.join('?' * len(profil))})",
+                    list(profil.values()),
+                )
+        return httpx.Response(200, json=self._session(self._utilisateur(user_id)))
+
+    def _connecter(self, email, mot_de_passe):
+        ligne = self._connexion.execute(
+            'SELECT id, mot_de_passe FROM _auth_utilisateurs WHERE email = ?', [email.strip().lower()]
+        ).fetchone()
+        if ligne is None or _hacher(mot_de_passe, ligne['mot_de_passe'].split('$')[0]) != ligne['mot_de_passe']:
+            return httpx.Response(400, json={'error': 'invalid_grant', 'error_description': 'Invalid login credentials'})
+        return httpx.Response(200, json=self._session(self._utilisateur(ligne['id'])))
+
+
+def lire_latence(reglage):
+    """'20' -> 0.02 ; '10-40' -> (0.01, 0.04) ; en millisecondes"""
+    reglage = str(reglage or '0').strip()
+    if '-' in reglage:
+        minimum, maximum = reglage.split('-', 1)
+        return float(minimum) / 1000, float(maximum) / 1000
+    return float(reglage) / 1000
+
+
+class _Latence:
+    def __init__(self, latence=0, graine=0):
+        self.latence = latence
+        self._hasard = random.Random(graine)
+
+    def tirer(self):
+        if isinstance(self.latence, tuple):
+            return self._hasard.uniform(*self.latence)
+        return self.latence
+
+
+class TransportLocal(httpx.BaseTransport):
+    """Transport httpx synchrone servi par une BaseLocale, avec latence injectée"""
+
+    def __init__(self, base, latence=0, graine=0):
+        self.base = base
+        self.latence = _Latence(latence, graine)
+
+    def handle_request(self, requete):
+        requete.read()
+        delai = self.latence.tirer()
+        if delai:
+            time.sleep(delai)
+        return self.base.traiter(requete)
+
+
+class TransportLocalAsync(httpx.AsyncBaseTransport):
+    """Transport httpx asynchrone servi par une BaseLocale, avec latence injectée"""
+
+    def __init__(self, base, latence=0, graine=0):
+        self.base = base
+        self.latence = _Latence(latence, graine)
+
+    async def handle_async_request(self, requete):
+        await requete.aread()
+        delai = self.latence.tirer()
+        if delai:
+            await asyncio.sleep(delai)
+        return self.base.traiter(requete)
+
+
+_base = None
+_verrou_base = threading.Lock()
+
+
+def get_base_locale():
+    """Base du processus, ouverte selon SUPABASE_LOCAL à la première utilisation"""
+    global _base
+    with _verrou_base:
+        if _base is None:
+            _base = BaseLocale(getattr(settings, 'SUPABASE_LOCAL', '') or ':memory:')
+    return _base
+
+
+def transport_local(asynchrone=False, base=None, latence=None):
+    base = base or get_base_locale()
+    if latence is None:
+        latence = lire_latence(getattr(settings, 'SUPABASE_LOCAL_LATENCE_MS', '0'))
+    classe = TransportLocalAsync if asynchrone else TransportLocal
+    return classe(base, latence)
+
+
+def brancher_auth(client, transport):
+    """Fait passer les appels Auth d'un client supabase-py par le transport local"""
+    from gotrue.http_clients import SyncClient
+
+    session = SyncClient(transport=transport)
+    client.auth._http_client = session
+    client.auth.admin._http_client = session
+    # Pas de minuterie de rafraîchissement : elle garderait le processus en vie
+    client.auth._auto_refresh_token = False
+
+
+def creer_client(base=None, latence=0, cle='local.anon'):
+    """Client supabase-py branché sur une base locale (tests, mesures)"""
+    from supabase import create_client
+    from supabase.lib.client_options import ClientOptions
+    from .supabase_client import _creer_session_pool
+    from .traces import tracer_session
+
+    base = base or get_base_locale()
+    client = create_client('http://supabase.local', cle, options=ClientOptions())
+    ancienne_session = client.postgrest.session
+    client.postgrest.session = _creer_session_pool(ancienne_session, transport=TransportLocal(base, latence))
+    ancienne_session.close()
+    brancher_auth(client, TransportLocal(base, latence))
+    tracer_session(client.auth._http_client)
+    return client
+
+
+def creer_client_async(client, base=None, latence=0):
+    """Client PostgREST asynchrone avec les mêmes en-têtes qu'un client de creer_client()"""
+    from postgrest import AsyncPostgrestClient
+    from .supabase_client import _creer_session_pool
+
+    session_sync = client.postgrest.session
+    client_async = AsyncPostgrestClient(str(session_sync.base_url), headers=dict(session_sync.headers))
+    client_async.session = _creer_session_pool(
+        session_sync, asynchrone=True, transport=TransportLocalAsync(base or get_base_locale(), latence),
+    )
+    return client_async
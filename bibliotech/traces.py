@@ -0,0 +1,140 @@
+"""
+Traces des appels HTTP vers Supabase.
+
+Les sessions httpx des clients Supabase (PostgREST et Auth) reçoivent des
+event hooks qui mesurent chaque appel : table, opération, filtres, nombre de
+lignes, taille de la réponse et durée. Les appels sont rangés dans la mémoire
+de la requête en cours (voir comptes.contexte) ; TracesRequeteMiddleware les
+résume ensuite dans une ligne de journal JSON et un en-tête Server-Timing.
+Hors requête, les appels ne sont pas conservés.
+
+Les filtres sont enregistrés sans leurs valeurs (email=eq, titre=ilike) :
+les journaux ne contiennent ni adresses ni saisies des utilisateurs.
+"""
+import re
+import time
+
+from comptes.contexte import memo_requete
+
+from .metriques import incrementer, observer
+
+# Paramètres PostgREST qui ne sont pas des filtres
+PARAMETRES_NON_FILTRES = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+
+# Méthode HTTP -> opération PostgREST
+OPERATIONS = {'GET': 'select', 'HEAD': 'select', 'POST': 'insert', 'PATCH': 'update', 'DELETE': 'delete'}
+
+_CLE_DEBUT = 'trace_debut'
+
+# Identifiants dans les chemins Auth (admin/users/<uuid>) : remplacés pour borner les étiquettes
+_UUID = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+
+def appels_requete():
+    """Appels Supabase de la requête en cours (une liste jetable hors requête)"""
+    return memo_requete('appels_supabase', list)
+
+
+def _table_et_operation(requete):
+    chemin = requete.url.path
+    if '/rest/v1/' in chemin:
+        table = chemin.split('/rest/v1/', 1)[1].strip('/') or '/'
+        operation = OPERATIONS.get(requete.method, requete.method.lower())
+        if operation == 'insert' and 'resolution=' in requete.headers.get('prefer', ''):
+            operation = 'upsert'
+        if table.startswith('rpc/'):
+            table, operation = table[4:], 'rpc'
+        return table, operation
+    # Auth, Storage : le chemin tient lieu de table
+    for prefixe in ('/auth/v1/', '/storage/v1/'):
+        if prefixe in chemin:
+            service = prefixe.strip('/').split('/')[0]
+            return _UUID.sub(':id', f"{service}/{chemin.split(prefixe, 1)[1].strip('/')}"), requete.method.lower()
+    return chemin, requete.method.lower()
+
+
+def _filtres(requete):
+    filtres = []
+    for nom, valeur in requete.url.params.multi_items():
+        if nom in PARAMETRES_NON_FILTRES:
+            continue
+        # or=(titre.ilike.*x*,...) : seules les colonnes et opérateurs sont gardés
+        if nom in ('or', 'and'):
+            conditions = valeur.strip('()').split(',')
+            filtres.append(f"{nom}({','.join('.'.join(c.split('.')[:2]) for c in conditions)})")
+        else:
+            filtres.append(f"{nom}={valeur.split('.', 1)[0]}")
+    return filtres
+
+
+def _lignes(reponse):
+    """Nombre de lignes d'après Content-Range (0-24/* ou */0), sinon None"""
+    plage = reponse.headers.get('content-range', '').split('/', 1)[0]
+    if plage == '*':
+        return 0
+    debut, _, fin = plage.partition('-')
+    if debut.isdigit() and fin.isdigit():
+        return int(fin) - int(debut) + 1
+    return None
+
+
+def _debut(requete):
+    requete.extensions[_CLE_DEBUT] = time.perf_counter()
+
+
+def _enregistrer(reponse):
+    requete = reponse.request
+    debut = requete.extensions.get(_CLE_DEBUT)
+    if debut is None:
+        return
+    duree = time.perf_counter() - debut
+    table, operation = _table_et_operation(requete)
+    appels_requete().append({
+        'table': table,
+        'operation': operation,
+        'filtres': _filtres(requete),
+        'statut': reponse.status_code,
+        'lignes': _lignes(reponse),
+        'octets': len(reponse.content),
+        'duree_ms': round(duree * 1000, 1),
+    })
+    incrementer('bibliotech_supabase_appels_total', table=table, operation=operation, statut=reponse.status_code)
+    observer('bibliotech_supabase_duree_secondes', duree, table=table, operation=operation)
+
+
+def _fin(reponse):
+    # Le hook est appelé à la réception des en-têtes : le corps est lu ici pour
+    # que la durée et la taille couvrent toute la réponse (httpx le garde pour l'appelant)
+    reponse.read()
+    _enregistrer(reponse)
+
+
+async def _adebut(requete):
+    _debut(requete)
+
+
+async def _afin(reponse):
+    await reponse.aread()
+    _enregistrer(reponse)
+
+
+def event_hooks(asynchrone=False):
+    """Event hooks httpx à passer à la création d'une session"""
+    if asynchrone:
+        return {'request': [_adebut], 'response': [_afin]}
+    return {'request': [_debut], 'response': [_fin]}
+
+
+def tracer_session(session, asynchrone=False):
+    """Ajoute les hooks de trace à une session httpx existante"""
+    if session is None:
+        return
+    hooks = session.event_hooks
+    for evenement, fonctions in event_hooks(asynchrone).items():
+        hooks[evenement] = [f for f in hooks.get(evenement, []) if f not in fonctions] + fonctions
+    session.event_hooks = hooks
+
+
+def resumer(appels):
+    """Nombre d'appels et temps cumulé passé à attendre Supabase (ms)"""
+    return len(appels), round(sum(appel['duree_ms'] for appel in appels), 1)
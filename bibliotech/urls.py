@@ -1,10 +1,14 @@
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
 from bibliotheque import views as bibliotheque_views
+from bibliotech.metriques import metriques
+from bibliotech.statiques import servir_statique
 
 urlpatterns = [
     path('', bibliotheque_views.accueil, name='accueil'),
     path('bibliotheque/', include('bibliotheque.urls')),
     path('comptes/', include('comptes.urls')),
+    path('metrics', metriques, name='metriques'),
+    re_path(rf"^{settings.STATIC_URL.lstrip('/')}(?P<chemin>.+)$", servir_statique, name='statique'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
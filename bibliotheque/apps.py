@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class BibliothequeConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bibliotheque'
+
+    def ready(self):
+        # Connexion des récepteurs de signaux (index de recherche, autocomplétion)
+        from . import signals  # noqa: F401
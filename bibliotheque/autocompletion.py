@@ -0,0 +1,180 @@
+"""
+Autocomplétion en mémoire sur les titres, les auteurs et les catégories.
+
+Chaque libellé est enregistré une fois par mot, sous la forme normalisée
+du texte qui commence à ce mot ("la monnaie au maroc", "monnaie au maroc",
+"au maroc", "maroc") : une recherche par préfixe avec bisect dans ce tableau
+trié retrouve donc aussi les libellés dont un mot intérieur commence par la
+saisie. Les suggestions sont classées par popularité (nombre de livres d'un
+auteur ou d'une catégorie), en privilégiant les libellés qui commencent par
+la saisie.
+
+Un préfixe court couvre des milliers de clés : le tableau est découpé en blocs
+de TAILLE_BLOC clés dont on garde, par type, les MEILLEURS_PAR_BLOC libellés.
+Une saisie ne parcourt que les deux blocs partiels aux bords de l'intervalle
+et classe les meilleurs libellés des blocs intermédiaires.
+"""
+from bisect import bisect_left
+import heapq
+import time
+
+from django.conf import settings
+
+from .index_recherche import decouper
+from .reconstruction import Reconstruction
+
+TAILLE_BLOC = 256
+
+# Au-delà de ce nombre de suggestions demandées, l'intervalle est parcouru en entier
+MEILLEURS_PAR_BLOC = 20
+
+# Supérieur à tout caractère : [préfixe, préfixe + FIN_PREFIXE) contient les clés qui commencent par le préfixe
+FIN_PREFIXE = '\U0010ffff'
+
+# Durée (en secondes) après laquelle les données sont rechargées depuis Supabase
+AUTOCOMPLETION_TTL = getattr(settings, 'AUTOCOMPLETION_TTL', 900)
+
+
+def _rang(libelle, poids, premier_mot):
+    """Clé de classement : début de libellé, puis popularité, puis libellés courts"""
+    return (not premier_mot, -poids, len(libelle), libelle)
+
+
+class Autocompletion:
+    """Tableaux triés de clés normalisées, interrogés par préfixe"""
+
+    def __init__(self):
+        # (clés triées, n° de libellé de chaque clé, vrai si la clé commence au premier mot,
+        #  libellés (libellé, type, poids), meilleurs libellés de chaque bloc par type) :
+        #  remplacés d'un bloc à chaque construction
+        self._donnees = ([], [], [], [], [])
+        self.construit_le = None
+        self.perime = False
+
+    def construire(self, livres, categories):
+        """Construit l'autocomplétion à partir des livres (avec auteur) et des catégories"""
+        poids_auteurs = {}
+        poids_categories = {}
+        for livre in livres:
+            auteur = livre.get('auteur')
+            if auteur:
+                nom = f"{auteur.get('prenom') or ''} {auteur.get('nom') or ''}".strip()
+                if nom:
+                    poids_auteurs[nom] = poids_auteurs.get(nom, 0) + 1
+            if livre.get('categorie_id'):
+                poids_categories[livre['categorie_id']] = poids_categories.get(livre['categorie_id'], 0) + 1
+
+        libelles = {}
+        for livre in livres:
+            if livre.get('titre'):
+                libelles.setdefault((livre['titre'], 'livre'), 1)
+        for nom, poids in poids_auteurs.items():
+            libelles[(nom, 'auteur')] = poids
+        for categorie in categories:
+            if categorie.get('nom'):
+                libelles[(categorie['nom'], 'categorie')] = poids_categories.get(categorie['id'], 0)
+
+        entrees = []
+        liste_libelles = []
+        for numero, ((libelle, type_libelle), poids) in enumerate(libelles.items()):
+            liste_libelles.append((libelle, type_libelle, poids))
+            mots = decouper(libelle)
+            for position in range(len(mots)):
+                entrees.append((' '.join(mots[position:]), numero, position == 0))
+        entrees.sort()
+
+        blocs = []
+        for depart in range(0, len(entrees), TAILLE_BLOC):
+            par_type = {}
+            for _, numero, premier_mot in entrees[depart:depart + TAILLE_BLOC]:
+                libelle, type_libelle, poids = liste_libelles[numero]
+                rang = _rang(libelle, poids, premier_mot)
+                meilleurs = par_type.setdefault(type_libelle, {})
+                if numero not in meilleurs or rang < meilleurs[numero]:
+                    meilleurs[numero] = rang
+            blocs.append({
+                type_libelle: heapq.nsmallest(MEILLEURS_PAR_BLOC, ((rang, numero) for numero, rang in meilleurs.items()))
+                for type_libelle, meilleurs in par_type.items()
+            })
+
+        # Remplacement en bloc : les lectures en cours gardent l'ancienne version
+        self._donnees = (
+            [e[0] for e in entrees], [e[1] for e in entrees], [e[2] for e in entrees], liste_libelles, blocs
+        )
+        self.construit_le = time.monotonic()
+        self.perime = False
+
+    def suggerer(self, saisie, limite=10, types=None):
+        """Retourne les libellés dont un mot commence par la saisie, les plus populaires d'abord"""
+        prefixe = ' '.join(decouper(saisie))
+        if not prefixe:
+            return []
+        cles, numeros, debuts, libelles, blocs = self._donnees
+
+        # Clés commençant par le préfixe : un intervalle du tableau trié
+        debut = bisect_left(cles, prefixe)
+        fin = bisect_left(cles, prefixe + FIN_PREFIXE, debut)
+
+        meilleurs = {}
+        def examiner(premiere, derniere):
+            for position in range(premiere, derniere):
+                numero = numeros[position]
+                libelle, type_libelle, poids = libelles[numero]
+                if types is None or type_libelle in types:
+                    rang = _rang(libelle, poids, debuts[position])
+                    if numero not in meilleurs or rang < meilleurs[numero]:
+                        meilleurs[numero] = rang
+
+        premier_bloc = -(-debut // TAILLE_BLOC)
+        dernier_bloc = fin // TAILLE_BLOC
+        if limite > MEILLEURS_PAR_BLOC or premier_bloc >= dernier_bloc:
+            examiner(debut, fin)
+        else:
+            # Blocs entièrement dans l'intervalle : leurs meilleurs libellés suffisent
+            examiner(debut, premier_bloc * TAILLE_BLOC)
+            for bloc in blocs[premier_bloc:dernier_bloc]:
+                for type_libelle, classement_bloc in bloc.items():
+                    if types is None or type_libelle in types:
+                        for rang, numero in classement_bloc:
+                            if numero not in meilleurs or rang < meilleurs[numero]:
+                                meilleurs[numero] = rang
+            examiner(dernier_bloc * TAILLE_BLOC, fin)
+
+        classement = sorted(meilleurs.items(), key=lambda item: item[1])
+        suggestions = []
+        for numero, _ in classement:
+            libelle = libelles[numero][0]
+            if libelle not in suggestions:
+                suggestions.append(libelle)
+            if len(suggestions) >= limite:
+                break
+        return suggestions
+
+    def marquer_perime(self):
+        self.perime = True
+
+    def est_perime(self):
+        return self.perime or self.construit_le is None or time.monotonic() - self.construit_le > AUTOCOMPLETION_TTL
+
+
+def _charger(autocompletion):
+    from comptes.supabase_service import SupabaseService
+    supabase_service = SupabaseService()
+    # Parcours par pages : un select('*') unique serait tronqué par PostgREST (max-rows)
+    livres = list(supabase_service.parcourir_livres())
+    if livres:
+        autocompletion.construire(livres, supabase_service.get_all_categories())
+
+
+# Autocomplétion partagée par les threads du worker
+_reconstruction = Reconstruction(Autocompletion(), _charger, "l'autocomplétion")
+
+
+def get_autocompletion():
+    """Retourne l'autocomplétion construite, ou None si elle n'a pas pu l'être"""
+    return _reconstruction.obtenir()
+
+
+def marquer_perimee():
+    """Demande un rechargement après une modification du catalogue"""
+    _reconstruction.appliquer(_reconstruction.structure.marquer_perime)
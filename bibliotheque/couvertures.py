@@ -0,0 +1,155 @@
+"""
+Enregistrement des couvertures de livres.
+
+Chaque fichier est adressé par l'empreinte SHA-256 de son contenu
+(couvertures/ab/abcd….jpg) : une image déjà envoyée n'est stockée qu'une
+fois, quel que soit son nom. À l'enregistrement, des miniatures WebP de
+taille fixe sont dérivées de l'original (couvertures/ab/abcd…_liste.webp) ;
+les pages de listes les affichent à la place de l'original grâce au filtre
+miniature (voir templatetags/bibliotheque_extras.py).
+
+Deux stockages : le système de fichiers local (MEDIA_ROOT) pour le
+développement, Supabase Storage en production (COUVERTURES_STOCKAGE).
+"""
+import hashlib
+import io
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+DOSSIER = 'couvertures'
+
+# Nom -> (largeur, hauteur) des miniatures dérivées de chaque couverture
+TAILLES_MINIATURES = getattr(settings, 'COUVERTURES_MINIATURES', {
+    'liste': (240, 320),
+    'detail': (480, 640),
+})
+QUALITE_WEBP = getattr(settings, 'COUVERTURES_QUALITE_WEBP', 80)
+
+# Extension de l'original selon le format détecté par Pillow (sinon le nom du format)
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+
+_CHEMIN_COUVERTURE = re.compile(rf'{DOSSIER}/[0-9a-f]{{2}}/([0-9a-f]{{64}})\.[a-z]+$')
+
+
+class StockageLocal:
+    """Fichiers enregistrés sous MEDIA_ROOT et servis depuis MEDIA_URL"""
+
+    def __init__(self, racine=None, url=None):
+        self.racine = racine or settings.MEDIA_ROOT
+        self.url_base = url or settings.MEDIA_URL
+
+    def _chemin(self, nom):
+        return os.path.join(self.racine, *nom.split('/'))
+
+    def existe(self, nom):
+        return os.path.exists(self._chemin(nom))
+
+    def enregistrer(self, nom, fichier, type_contenu):
+        chemin = self._chemin(nom)
+        os.makedirs(os.path.dirname(chemin), exist_ok=True)
+        # Écriture dans un fichier temporaire puis renommage : jamais de fichier à moitié écrit
+        descripteur, temporaire = tempfile.mkstemp(dir=os.path.dirname(chemin))
+        with os.fdopen(descripteur, 'wb') as sortie:
+            for morceau in _morceaux(fichier):
+                sortie.write(morceau)
+        os.replace(temporaire, chemin)
+
+    def url(self, nom):
+        return f"{self.url_base.rstrip('/')}/{nom}"
+
+
+class StockageSupabase:
+    """Fichiers enregistrés dans un bucket public de Supabase Storage"""
+
+    def __init__(self, bucket=None):
+        from bibliotech.supabase_client import get_supabase_client
+        self.bucket = bucket or getattr(settings, 'COUVERTURES_BUCKET', 'couvertures')
+        client = get_supabase_client(admin=True)
+        if client is None:
+            raise RuntimeError("Client Supabase non initialisé")
+        self.fichiers = client.storage.from_(self.bucket)
+
+    def existe(self, nom):
+        dossier, _, fichier = nom.rpartition('/')
+        return any(objet.get('name') == fichier for objet in self.fichiers.list(dossier, {'search': fichier}))
+
+    def enregistrer(self, nom, fichier, type_contenu):
+        # storage3 envoie le contenu en un seul bloc
+        contenu = b''.join(_morceaux(fichier))
+        self.fichiers.upload(nom, contenu, {'content-type': type_contenu, 'cache-control': 'max-age=31536000'})
+
+    def url(self, nom):
+        return self.fichiers.get_public_url(nom).rstrip('?')
+
+
+def _morceaux(fichier):
+    if hasattr(fichier, 'chunks'):
+        yield from fichier.chunks()
+        return
+    fichier.seek(0)
+    while True:
+        morceau = fichier.read(64 * 1024)
+        if not morceau:
+            break
+        yield morceau
+
+
+def get_stockage():
+    """Retourne le stockage configuré par COUVERTURES_STOCKAGE ('local' ou 'supabase')"""
+    if getattr(settings, 'COUVERTURES_STOCKAGE', 'local') == 'supabase':
+        return StockageSupabase()
+    return StockageLocal()
+
+
+def nom_miniature(nom, taille):
+    return f"{nom.rsplit('.', 1)[0]}_{taille}.webp"
+
+
+def _miniature(image, dimensions):
+    """Recadre l'image au centre aux dimensions exactes et l'encode en WebP"""
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or image.mode == 'P' else 'RGB')
+    miniature = ImageOps.fit(image, dimensions, Image.LANCZOS)
+    tampon = io.BytesIO()
+    miniature.save(tampon, 'WEBP', quality=QUALITE_WEBP, method=6)
+    tampon.seek(0)
+    return tampon
+
+
+def enregistrer_couverture(fichier, stockage=None):
+    """Enregistre une couverture et ses miniatures ; retourne l'URL de l'original"""
+    stockage = stockage or get_stockage()
+
+    # Empreinte calculée morceau par morceau, sans charger le fichier en mémoire
+    empreinte = hashlib.sha256()
+    for morceau in _morceaux(fichier):
+        empreinte.update(morceau)
+    empreinte = empreinte.hexdigest()
+
+    fichier.seek(0)
+    image = Image.open(fichier)
+    extension = EXTENSIONS.get(image.format, (image.format or 'bin').lower())
+    nom = f"{DOSSIER}/{empreinte[:2]}/{empreinte}.{extension}"
+
+    if not stockage.existe(nom):
+        image = ImageOps.exif_transpose(image)
+        for taille, dimensions in TAILLES_MINIATURES.items():
+            stockage.enregistrer(nom_miniature(nom, taille), _miniature(image, dimensions), 'image/webp')
+        # L'original en dernier : sa présence signifie que les miniatures existent
+        stockage.enregistrer(nom, fichier, Image.MIME.get(image.format, 'application/octet-stream'))
+
+    return stockage.url(nom)
+
+
+def url_miniature(url, taille):
+    """URL de la miniature d'une couverture enregistrée par enregistrer_couverture, sinon l'URL reçue"""
+    if not url or taille not in TAILLES_MINIATURES:
+        return url
+    url_sans_requete = str(url).split('?', 1)[0]
+    if not _CHEMIN_COUVERTURE.search(url_sans_requete):
+        return url
+    return nom_miniature(url_sans_requete, taille)
@@ -0,0 +1,108 @@
+"""
+Exports CSV et JSONL du catalogue et des rendez-vous, en flux.
+
+Les lignes sont lues page par page (SupabaseService.parcourir_*), mises en
+forme puis regroupées en morceaux d'environ TAILLE_MORCEAU octets : la
+mémoire utilisée ne dépend pas du nombre de lignes et les premiers octets
+partent dès la première page lue. La compression gzip se fait au fil de
+l'eau, morceau par morceau.
+"""
+import csv
+from datetime import date
+import io
+import json
+import zlib
+
+from django.http import StreamingHttpResponse
+
+TAILLE_MORCEAU = 64 * 1024
+
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'jsonl': ('application/x-ndjson; charset=utf-8', 'jsonl'),
+}
+
+COLONNES_LIVRES = [
+    'id', 'titre', 'auteur', 'categorie', 'numero_inventaire', 'ancien_code',
+    'date_publication', 'description', 'image', 'created_at', 'updated_at',
+]
+
+COLONNES_RENDEZ_VOUS = [
+    'id', 'statut', 'date_souhaitee', 'heure_entree', 'heure_sortie', 'nom', 'prenom', 'telephone', 'email',
+    'type_utilisateur', 'livre_id', 'titre_ouvrage', 'auteur_ouvrage', 'numero_inventaire', 'ancien_code',
+    'raison', 'message', 'utilisateur_id', 'date_creation',
+]
+
+
+def ligne_livre(livre):
+    """Aplatit un livre de parcourir_livres() : auteur et catégorie deviennent des noms"""
+    auteur = livre.get('auteur') or {}
+    categorie = livre.get('categorie') or {}
+    ligne = {colonne: livre.get(colonne) for colonne in COLONNES_LIVRES}
+    ligne['auteur'] = f"{auteur.get('prenom') or ''} {auteur.get('nom') or ''}".strip()
+    ligne['categorie'] = categorie.get('nom') or ''
+    return ligne
+
+
+def ligne_rendez_vous(rendez_vous):
+    return {colonne: rendez_vous.get(colonne) for colonne in COLONNES_RENDEZ_VOUS}
+
+
+def morceaux_csv(lignes, colonnes):
+    """Produit le CSV par morceaux (BOM UTF-8 en tête pour les tableurs)"""
+    tampon = io.StringIO()
+    ecrivain = csv.DictWriter(tampon, fieldnames=colonnes, extrasaction='ignore')
+    tampon.write('\ufeff')
+    ecrivain.writeheader()
+    for ligne in lignes:
+        ecrivain.writerow(ligne)
+        if tampon.tell() >= TAILLE_MORCEAU:
+            yield tampon.getvalue().encode('utf-8')
+            tampon.seek(0)
+            tampon.truncate()
+    if tampon.tell():
+        yield tampon.getvalue().encode('utf-8')
+
+
+def morceaux_jsonl(lignes, colonnes=None):
+    """Produit un objet JSON par ligne, par morceaux"""
+    tampon = []
+    taille = 0
+    for ligne in lignes:
+        texte = json.dumps(ligne, ensure_ascii=False, default=str) + '\n'
+        tampon.append(texte)
+        taille += len(texte)
+        if taille >= TAILLE_MORCEAU:
+            yield ''.join(tampon).encode('utf-8')
+            tampon, taille = [], 0
+    if tampon:
+        yield ''.join(tampon).encode('utf-8')
+
+
+def compresser(morceaux):
+    """Compresse au format gzip au fil de l'eau"""
+    compresseur = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for morceau in morceaux:
+        compresse = compresseur.compress(morceau)
+        if compresse:
+            yield compresse
+    yield compresseur.flush()
+
+
+def morceaux_export(lignes, colonnes, format_export='csv', gzip=False):
+    morceaux = (morceaux_jsonl if format_export == 'jsonl' else morceaux_csv)(lignes, colonnes)
+    return compresser(morceaux) if gzip else morceaux
+
+
+def reponse_export(lignes, colonnes, nom, format_export='csv', gzip=False):
+    """Réponse HTTP en flux, téléchargée sous le nom <nom>-<date>.<format>[.gz]"""
+    type_contenu, extension = FORMATS[format_export]
+    nom_fichier = f"{nom}-{date.today():%Y%m%d}.{extension}"
+    if gzip:
+        type_contenu, nom_fichier = 'application/gzip', nom_fichier + '.gz'
+    response = StreamingHttpResponse(morceaux_export(lignes, colonnes, format_export, gzip), content_type=type_contenu)
+    response['Content-Disposition'] = f'attachment; filename="{nom_fichier}"'
+    response['Cache-Control'] = 'no-store'
+    # Pas de mise en mémoire tampon par un proxy nginx : les octets partent tout de suite
+    response['X-Accel-Buffering'] = 'no'
+    return response
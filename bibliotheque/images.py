@@ -0,0 +1,231 @@
+"""
+Redimensionnement d'images à la demande, avec cache disque des dérivés.
+
+La source est un fichier sous MEDIA_ROOT ou une URL http(s) d'un hôte
+autorisé (IMAGES_HOTES_AUTORISES). Le dérivé est produit avec Pillow à une
+largeur arrondie à la valeur autorisée suivante (IMAGES_LARGEURS) et dans le
+meilleur format accepté par le navigateur (AVIF, WebP, sinon JPEG), puis
+conservé sur disque sous l'empreinte de la source et des paramètres. Le
+cache est borné en taille : au-delà de IMAGES_CACHE_TAILLE_MAX, les dérivés
+les moins récemment servis sont supprimés.
+
+Une image distante peut changer sans que son URL change : sa version change
+toutes les IMAGES_DISTANTES_DUREE secondes, ce qui la fait relire.
+"""
+from bisect import bisect_left
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+from django.conf import settings
+from PIL import Image, ImageOps, features
+
+LARGEURS = tuple(sorted(getattr(settings, 'IMAGES_LARGEURS', (120, 240, 320, 480, 640, 960, 1280))))
+HOTES_AUTORISES = set(getattr(settings, 'IMAGES_HOTES_AUTORISES', ()))
+DOSSIER_CACHE = getattr(settings, 'IMAGES_CACHE_DIR', os.path.join(settings.BASE_DIR, 'cache_images'))
+TAILLE_CACHE_MAX = getattr(settings, 'IMAGES_CACHE_TAILLE_MAX', 500 * 1024 * 1024)
+DUREE_DISTANTES = getattr(settings, 'IMAGES_DISTANTES_DUREE', 24 * 3600)
+
+# Taille maximale d'une image distante téléchargée
+TAILLE_SOURCE_MAX = 15 * 1024 * 1024
+
+# Formats de sortie, du plus compact au plus compatible
+FORMATS = [
+    (nom, type_contenu, options)
+    for nom, type_contenu, options, disponible in (
+        ('avif', 'image/avif', {'quality': 55}, features.check('avif')),
+        ('webp', 'image/webp', {'quality': 80, 'method': 6}, features.check('webp')),
+        ('jpeg', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}, True),
+    )
+    if disponible
+]
+TYPES_CONTENU = {nom: type_contenu for nom, type_contenu, _ in FORMATS}
+
+
+class SourceInvalide(Exception):
+    """Source absente, hors de MEDIA_ROOT, d'un hôte non autorisé ou illisible"""
+
+
+def est_distante(source):
+    return source.startswith(('http://', 'https://'))
+
+
+def est_source_autorisee(source):
+    """Vérifie sans lecture qu'une source peut être servie par le redimensionnement"""
+    if not source:
+        return False
+    if est_distante(source):
+        return urlparse(source).hostname in HOTES_AUTORISES
+    return True
+
+
+def choisir_largeur(largeur):
+    """Arrondit à la largeur autorisée suivante, pour borner le nombre de dérivés"""
+    position = bisect_left(LARGEURS, largeur)
+    return LARGEURS[min(position, len(LARGEURS) - 1)]
+
+
+def choisir_format(accept, demande=None):
+    """Format demandé explicitement s'il est disponible, sinon le meilleur accepté"""
+    if demande in TYPES_CONTENU:
+        return demande
+    accept = accept or ''
+    for nom, type_contenu, _ in FORMATS:
+        if type_contenu in accept:
+            return nom
+    return 'jpeg'
+
+
+def _chemin_local(source):
+    """Chemin absolu d'une source locale, refusé s'il sort de MEDIA_ROOT"""
+    relatif = source
+    if relatif.startswith(settings.MEDIA_URL):
+        relatif = relatif[len(settings.MEDIA_URL):]
+    racine = os.path.realpath(settings.MEDIA_ROOT)
+    chemin = os.path.realpath(os.path.join(racine, relatif.lstrip('/')))
+    if os.path.commonpath([racine, chemin]) != racine or not os.path.isfile(chemin):
+        raise SourceInvalide(source)
+    return chemin
+
+
+def version_source(source):
+    """Identifiant de version : un fichier local modifié produit de nouveaux dérivés"""
+    if est_distante(source):
+        # Période décalée selon l'URL, pour que les images distantes ne soient pas toutes relues ensemble
+        decalage = int(hashlib.sha256(source.encode('utf-8')).hexdigest()[:8], 16) % DUREE_DISTANTES
+        return f"{source}|{(int(time.time()) + decalage) // DUREE_DISTANTES}"
+    chemin = _chemin_local(source)
+    etat = os.stat(chemin)
+    return f"{chemin}|{etat.st_mtime_ns}|{etat.st_size}"
+
+
+def _lire_source(source):
+    if not est_distante(source):
+        with open(_chemin_local(source), 'rb') as fichier:
+            return fichier.read()
+
+    import httpx
+    with httpx.stream('GET', source, timeout=10, follow_redirects=False) as reponse:
+        if reponse.status_code != 200 or not reponse.headers.get('content-type', '').startswith('image/'):
+            raise SourceInvalide(source)
+        contenu = bytearray()
+        for morceau in reponse.iter_bytes():
+            contenu.extend(morceau)
+            if len(contenu) > TAILLE_SOURCE_MAX:
+                raise SourceInvalide(source)
+        return bytes(contenu)
+
+
+def _produire(contenu, largeur, format_sortie):
+    options = next(opts for nom, _, opts in FORMATS if nom == format_sortie)
+    with Image.open(io.BytesIO(contenu)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.width > largeur:
+            image = image.resize((largeur, max(1, round(image.height * largeur / image.width))), Image.LANCZOS)
+        if format_sortie == 'jpeg' or image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGB' if format_sortie == 'jpeg' else 'RGBA')
+        tampon = io.BytesIO()
+        image.save(tampon, format_sortie.upper(), **options)
+        return tampon.getvalue()
+
+
+class CacheDerives:
+    """Dérivés sur disque ; la date de modification sert de date de dernier accès"""
+
+    def __init__(self, dossier=DOSSIER_CACHE, taille_max=TAILLE_CACHE_MAX):
+        self.dossier = dossier
+        self.taille_max = taille_max
+        self._verrou = threading.Lock()
+        self._taille = None
+
+    def chemin(self, cle):
+        return os.path.join(self.dossier, cle[:2], cle)
+
+    def lire(self, cle):
+        """Ouvre le dérivé, ou None s'il est absent ; ouvert, il reste lisible même s'il est élagué"""
+        chemin = self.chemin(cle)
+        try:
+            fichier = open(chemin, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(chemin)
+        except OSError:
+            pass
+        return fichier
+
+    def ecrire(self, cle, contenu):
+        chemin = self.chemin(cle)
+        os.makedirs(os.path.dirname(chemin), exist_ok=True)
+        descripteur, temporaire = tempfile.mkstemp(dir=os.path.dirname(chemin))
+        with os.fdopen(descripteur, 'wb') as sortie:
+            sortie.write(contenu)
+        os.replace(temporaire, chemin)
+
+        with self._verrou:
+            if self._taille is None:
+                self._taille = self._mesurer()
+            else:
+                self._taille += len(contenu)
+            if self._taille > self.taille_max:
+                self._elaguer()
+        return chemin
+
+    def _fichiers(self):
+        for dossier, _, fichiers in os.walk(self.dossier):
+            for nom in fichiers:
+                chemin = os.path.join(dossier, nom)
+                try:
+                    etat = os.stat(chemin)
+                except FileNotFoundError:
+                    continue
+                yield chemin, etat.st_mtime, etat.st_size
+
+    def _mesurer(self):
+        return sum(taille for _, _, taille in self._fichiers())
+
+    def _elaguer(self):
+        """Supprime les dérivés les moins récemment servis jusqu'à 90 % de la taille maximale"""
+        fichiers = sorted(self._fichiers(), key=lambda f: f[1])
+        taille = sum(f[2] for f in fichiers)
+        for chemin, _, taille_fichier in fichiers:
+            if taille <= self.taille_max * 0.9:
+                break
+            try:
+                os.remove(chemin)
+                taille -= taille_fichier
+            except OSError:
+                # Déjà supprimé, ou ouvert par une réponse en cours (Windows)
+                pass
+        self._taille = taille
+
+
+_cache = CacheDerives()
+
+
+def obtenir_derive(source, largeur, format_sortie, cache=None):
+    """Retourne (fichier ouvert, type de contenu, clé) du dérivé, produit s'il n'est pas en cache"""
+    cache = cache or _cache
+    if not est_source_autorisee(source):
+        raise SourceInvalide(source)
+
+    largeur = choisir_largeur(largeur)
+    cle = hashlib.sha256(f"{version_source(source)}|{largeur}|{format_sortie}".encode('utf-8')).hexdigest()
+    cle = f"{cle}.{format_sortie}"
+
+    fichier = cache.lire(cle)
+    if fichier is None:
+        try:
+            contenu = _produire(_lire_source(source), largeur, format_sortie)
+        except SourceInvalide:
+            raise
+        except Exception as e:
+            raise SourceInvalide(f"{source}: {e}")
+        cache.ecrire(cle, contenu)
+        # Servi depuis la mémoire : un élagage concurrent peut déjà l'avoir supprimé du disque
+        fichier = io.BytesIO(contenu)
+    return fichier, TYPES_CONTENU[format_sortie], cle
@@ -0,0 +1,253 @@
+"""
+Index de recherche plein texte en mémoire pour les livres.
+
+Les champs indexés (titre, description, nom et prénom de l'auteur, numéro
+d'inventaire, ancien code) sont normalisés (minuscules, accents retirés) puis
+découpés en mots. Chaque mot pointe vers les livres qui le contiennent, avec un
+poids dépendant du champ. Le vocabulaire est trié pour trouver les mots par
+préfixe avec bisect : "hist" trouve "histoire" et "historique".
+"""
+from bisect import bisect_left
+import heapq
+import re
+import threading
+import time
+import unicodedata
+
+from django.conf import settings
+
+from .reconstruction import Reconstruction
+
+# Poids de chaque champ dans le score d'un livre
+POIDS_CHAMPS = {
+    'titre': 5,
+    'numero_inventaire': 5,
+    'ancien_code': 5,
+    'auteur': 3,
+    'description': 1,
+}
+
+# Bonus lorsque le mot recherché est complet et non un simple préfixe
+BONUS_MOT_EXACT = 2
+
+# Durée (en secondes) après laquelle l'index est reconstruit depuis Supabase,
+# pour intégrer les écritures faites par les autres workers
+INDEX_RECHERCHE_TTL = getattr(settings, 'INDEX_RECHERCHE_TTL', 900)
+
+# Champ embarqué dans les livres, et ses colonnes, pour chaque table liée
+CHAMPS_LIES = {
+    'auteurs': ('auteur', ('id', 'nom', 'prenom')),
+    'categories': ('categorie', ('id', 'nom', 'image')),
+}
+
+_MOTS = re.compile(r'\w+')
+
+
+def normaliser(texte):
+    """Met un texte en minuscules et retire les accents"""
+    if not texte:
+        return ''
+    decompose = unicodedata.normalize('NFKD', str(texte))
+    return ''.join(c for c in decompose if not unicodedata.combining(c)).lower()
+
+
+def decouper(texte):
+    """Découpe un texte normalisé en mots"""
+    return _MOTS.findall(normaliser(texte))
+
+
+def _champs_livre(livre):
+    auteur = livre.get('auteur') or {}
+    return {
+        'titre': livre.get('titre'),
+        'numero_inventaire': livre.get('numero_inventaire'),
+        'ancien_code': livre.get('ancien_code'),
+        'auteur': f"{auteur.get('prenom') or ''} {auteur.get('nom') or ''}",
+        'description': livre.get('description'),
+    }
+
+
+class IndexRecherche:
+    """Index inversé des livres, mis à jour livre par livre"""
+
+    def __init__(self):
+        self._verrou = threading.RLock()
+        self.livres = {}        # id -> livre
+        self._postings = {}     # mot -> {id: poids}
+        self._mots_livre = {}   # id -> mots indexés pour ce livre
+        self._vocabulaire = []  # mots triés, pour la recherche par préfixe
+        self._cles_titre = {}   # id -> titre normalisé, pour départager les ex aequo
+        self.construit_le = None
+        self.perime = False
+
+    def construire(self, livres):
+        """Reconstruit l'index à partir d'une liste complète de livres"""
+        postings = {}
+        mots_livre = {}
+        index_livres = {}
+        cles_titre = {}
+        for livre in livres:
+            index_livres[livre['id']] = livre
+            mots_livre[livre['id']] = self._indexer(livre, postings)
+            cles_titre[livre['id']] = normaliser(livre.get('titre'))
+        with self._verrou:
+            self.livres = index_livres
+            self._postings = postings
+            self._mots_livre = mots_livre
+            self._cles_titre = cles_titre
+            self._vocabulaire = sorted(postings)
+            self.construit_le = time.monotonic()
+            self.perime = False
+
+    @staticmethod
+    def _indexer(livre, postings):
+        mots = set()
+        for champ, texte in _champs_livre(livre).items():
+            for mot in decouper(texte):
+                poids = postings.setdefault(mot, {})
+                poids[livre['id']] = poids.get(livre['id'], 0) + POIDS_CHAMPS[champ]
+                mots.add(mot)
+        return mots
+
+    def ajouter(self, livre):
+        """Ajoute ou remplace un livre dans l'index"""
+        with self._verrou:
+            self.retirer(livre['id'])
+            nouveaux = {}
+            mots = self._indexer(livre, nouveaux)
+            for mot, poids in nouveaux.items():
+                if mot not in self._postings:
+                    self._postings[mot] = {}
+                    self._vocabulaire.insert(bisect_left(self._vocabulaire, mot), mot)
+                self._postings[mot].update(poids)
+            self.livres[livre['id']] = livre
+            self._mots_livre[livre['id']] = mots
+            self._cles_titre[livre['id']] = normaliser(livre.get('titre'))
+
+    def retirer(self, livre_id):
+        """Retire un livre de l'index"""
+        with self._verrou:
+            self.livres.pop(livre_id, None)
+            self._cles_titre.pop(livre_id, None)
+            for mot in self._mots_livre.pop(livre_id, ()):
+                poids = self._postings.get(mot)
+                if poids is None:
+                    continue
+                poids.pop(livre_id, None)
+                if not poids:
+                    del self._postings[mot]
+                    position = bisect_left(self._vocabulaire, mot)
+                    if position < len(self._vocabulaire) and self._vocabulaire[position] == mot:
+                        del self._vocabulaire[position]
+
+    def modifier_lien(self, champ, identifiant, valeur):
+        """Remplace l'auteur ou la catégorie embarqué dans les livres qui y renvoient (None : supprimé)"""
+        with self._verrou:
+            for livre in [l for l in self.livres.values() if l.get(f'{champ}_id') == identifiant]:
+                livre = dict(livre, **{champ: valeur})
+                if valeur is None:
+                    # ON DELETE SET NULL
+                    livre[f'{champ}_id'] = None
+                self.ajouter(livre)
+
+    def _mots_prefixe(self, prefixe):
+        position = bisect_left(self._vocabulaire, prefixe)
+        while position < len(self._vocabulaire) and self._vocabulaire[position].startswith(prefixe):
+            yield self._vocabulaire[position]
+            position += 1
+
+    def rechercher(self, requete, limite=None):
+        """Retourne les livres contenant tous les mots de la requête, du plus pertinent au moins pertinent"""
+        return self.rechercher_avec_total(requete, limite)[0]
+
+    def rechercher_avec_total(self, requete, limite=None):
+        """Comme rechercher, avec le nombre total de livres trouvés : seuls les `limite` premiers sont classés"""
+        termes = decouper(requete)
+        if not termes:
+            return [], 0
+
+        with self._verrou:
+            scores = None
+            for terme in termes:
+                scores_terme = {}
+                for mot in self._mots_prefixe(terme):
+                    bonus = BONUS_MOT_EXACT if mot == terme else 0
+                    for livre_id, poids in self._postings[mot].items():
+                        score = poids + bonus
+                        if score > scores_terme.get(livre_id, 0):
+                            scores_terme[livre_id] = score
+                if scores is None:
+                    scores = scores_terme
+                else:
+                    scores = {livre_id: score + scores_terme[livre_id]
+                              for livre_id, score in scores.items() if livre_id in scores_terme}
+                if not scores:
+                    return [], 0
+
+            cle = lambda item: (-item[1], self._cles_titre[item[0]])
+            if limite is not None:
+                classement = heapq.nsmallest(limite, scores.items(), key=cle)
+            else:
+                classement = sorted(scores.items(), key=cle)
+            return [self.livres[livre_id] for livre_id, _ in classement], len(scores)
+
+    def marquer_perime(self):
+        self.perime = True
+
+    def est_perime(self):
+        return self.perime or self.construit_le is None or time.monotonic() - self.construit_le > INDEX_RECHERCHE_TTL
+
+
+def _charger(index):
+    from comptes.supabase_service import SupabaseService
+    # Parcours par pages : un select('*') unique serait tronqué par PostgREST (max-rows)
+    livres = list(SupabaseService().parcourir_livres())
+    if livres:
+        index.construire(livres)
+
+
+# Index partagé par les threads du worker
+_reconstruction = Reconstruction(IndexRecherche(), _charger, "l'index de recherche")
+
+
+def get_index():
+    """Retourne l'index construit, ou None s'il n'a pas pu être construit"""
+    return _reconstruction.obtenir()
+
+
+def mettre_a_jour_livre(livre_id, supprime=False):
+    """Répercute l'écriture d'un livre dans l'index s'il est construit (ou en construction)"""
+    if not _reconstruction.suit_les_ecritures():
+        return
+    index = _reconstruction.structure
+    if not livre_id:
+        # Écriture en masse (import) : reconstruction complète
+        _reconstruction.appliquer(index.marquer_perime)
+        return
+    if supprime:
+        _reconstruction.appliquer(lambda: index.retirer(livre_id))
+        return
+    from comptes.supabase_service import SupabaseService
+    livre = SupabaseService().get_livre_by_id(livre_id)
+    if livre:
+        _reconstruction.appliquer(lambda: index.ajouter(livre))
+
+
+def mettre_a_jour_lien(table, identifiant, ligne=None, supprime=False):
+    """Répercute l'écriture d'un auteur ou d'une catégorie dans les livres indexés qui y renvoient"""
+    if not identifiant or not _reconstruction.suit_les_ecritures():
+        return
+    index = _reconstruction.structure
+    champ, colonnes = CHAMPS_LIES[table]
+    if supprime:
+        _reconstruction.appliquer(lambda: index.modifier_lien(champ, identifiant, None))
+        return
+    if ligne is None and table == 'categories':
+        from comptes.supabase_service import SupabaseService
+        ligne = SupabaseService().get_categorie_by_id(identifiant)
+    if ligne is None:
+        # Ligne introuvable : elle sera relue à la prochaine reconstruction
+        _reconstruction.appliquer(index.marquer_perime)
+        return
+    valeur = {colonne: ligne.get(colonne) for colonne in colonnes}
+    _reconstruction.appliquer(lambda: index.modifier_lien(champ, identifiant, valeur))
@@ -0,0 +1 @@
+# Package pour les commandes de gestion Django
@@ -0,0 +1,55 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from comptes.supabase_service import SupabaseService, TAILLE_LOT_EXPORT
+
+from bibliotheque.exports import (
+    COLONNES_LIVRES, COLONNES_RENDEZ_VOUS, FORMATS, ligne_livre, ligne_rendez_vous, morceaux_export,
+)
+
+
+class Command(BaseCommand):
+    help = 'Exporter le catalogue ou les rendez-vous en CSV ou JSONL, en flux (mémoire constante)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('donnees', choices=['livres', 'rendez-vous'], help='Données à exporter')
+        parser.add_argument('--format', choices=list(FORMATS), default='csv', help='Format du fichier')
+        parser.add_argument('--sortie', type=str, help='Fichier de sortie (sortie standard par défaut)')
+        parser.add_argument('--gzip', action='store_true', help='Compresser au format gzip')
+        parser.add_argument('--lot', type=int, default=TAILLE_LOT_EXPORT, help='Lignes lues par requête Supabase')
+
+    def handle(self, *args, **options):
+        service = SupabaseService()
+        if not service.client:
+            raise CommandError("Client Supabase indisponible")
+
+        if options['donnees'] == 'livres':
+            colonnes = COLONNES_LIVRES
+            lignes = (ligne_livre(livre) for livre in service.parcourir_livres(options['lot']))
+        else:
+            colonnes = COLONNES_RENDEZ_VOUS
+            lignes = (ligne_rendez_vous(rdv) for rdv in service.parcourir_rendez_vous(options['lot']))
+
+        compteur = {'lignes': 0}
+        def compter(lignes):
+            for ligne in lignes:
+                compteur['lignes'] += 1
+                yield ligne
+
+        debut = time.perf_counter()
+        sortie = open(options['sortie'], 'wb') if options['sortie'] else sys.stdout.buffer
+        try:
+            for morceau in morceaux_export(compter(lignes), colonnes, options['format'], options['gzip']):
+                sortie.write(morceau)
+        except Exception as e:
+            raise CommandError(f"Export interrompu après {compteur['lignes']} lignes: {e}")
+        finally:
+            if options['sortie']:
+                sortie.close()
+
+        if options['sortie']:
+            self.stdout.write(self.style.SUCCESS(
+                f"{compteur['lignes']} lignes exportées dans {options['sortie']} en {time.perf_counter() - debut:.1f} s"
+            ))
@@ -0,0 +1,368 @@
+"""
+Import en masse du catalogue depuis des fichiers CSV, JSONL ou MARC.
+
+Les fichiers sont lus ligne à ligne. Auteurs et catégories sont résolus par
+un index des noms en mémoire, chargé une fois au départ : les nouveaux sont
+créés en une insertion par lot, puis les livres sont insérés par lots (une
+requête par lot) en upsert sur numero_inventaire. Réimporter un fichier met
+donc les livres à jour au lieu de les dupliquer.
+
+Une ligne illisible est comptée comme rejetée. À la fin (même interrompu),
+l'import invalide le cache du catalogue de tous les workers et leur fait
+reconstruire leurs index de recherche et d'autocomplétion.
+
+Colonnes reconnues (CSV et JSONL) : titre, auteur (« Nom, Prénom » ou texte
+libre) ou auteur_nom / auteur_prenom, categorie, numero_inventaire,
+ancien_code, date_publication (AAAA, AAAA-MM-JJ ou JJ/MM/AAAA), description,
+image. Le format MARC (ISO 2709) nécessite le paquet pymarc.
+
+Exemple :
+    python manage.py importer_catalogue livres.csv --lot 2000
+"""
+import csv
+import json
+import os
+import re
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bibliotech.sessions import changer_version_import
+from bibliotech.supabase_client import get_supabase_client
+from comptes.cache import invalider_catalogue
+from comptes.signals import catalogue_modifie
+
+from bibliotheque.index_recherche import decouper, normaliser
+
+TAILLE_LOT = 1000
+
+# Lecture des tables existantes par pages (limite max-rows de PostgREST)
+TAILLE_PAGE_LECTURE = 1000
+
+# Nom de colonne du fichier (sans accents ni majuscules) -> champ
+ALIAS_COLONNES = {
+    'titre': 'titre', 'title': 'titre',
+    'auteur': 'auteur', 'author': 'auteur',
+    'auteur_nom': 'auteur_nom', 'auteur_prenom': 'auteur_prenom',
+    'categorie': 'categorie', 'category': 'categorie',
+    'numero_inventaire': 'numero_inventaire', 'inventaire': 'numero_inventaire', 'n_inventaire': 'numero_inventaire',
+    'ancien_code': 'ancien_code', 'cote': 'ancien_code',
+    'date_publication': 'date_publication', 'annee': 'date_publication', 'year': 'date_publication',
+    'description': 'description', 'resume': 'description',
+    'image': 'image',
+}
+
+COLONNES_LIVRE = ['titre', 'numero_inventaire', 'ancien_code', 'date_publication', 'description', 'image']
+
+
+class LigneInvalide(ValueError):
+    pass
+
+
+def cle_auteur(nom, prenom=''):
+    """Clé de l'index des auteurs : « Hugo, Victor », « Victor Hugo » et nom/prénom séparés se confondent"""
+    return ' '.join(sorted(decouper(f"{prenom or ''} {nom or ''}")))
+
+
+def cle_categorie(nom):
+    return ' '.join(decouper(nom))
+
+
+def lire_date(valeur):
+    valeur = (valeur or '').strip()
+    if re.fullmatch(r'\d{4}', valeur):
+        return f'{valeur}-01-01'
+    if re.fullmatch(r'\d{4}-\d{2}-\d{2}', valeur):
+        return valeur
+    correspondance = re.fullmatch(r'(\d{1,2})/(\d{1,2})/(\d{4})', valeur)
+    if correspondance:
+        jour, mois, annee = correspondance.groups()
+        return f'{annee}-{int(mois):02d}-{int(jour):02d}'
+    # Années MARC du type « c1998. » ou « [1975] »
+    annee = re.search(r'\b(1[5-9]\d{2}|20\d{2})\b', valeur)
+    if annee:
+        return f'{annee.group(1)}-01-01'
+    raise LigneInvalide(f"date de publication illisible: {valeur!r}")
+
+
+def normaliser_ligne(brute):
+    """Champs d'un livre à partir d'une ligne du fichier ; lève LigneInvalide"""
+    if isinstance(brute, LigneInvalide):
+        # Ligne que le lecteur n'a pas pu décoder
+        raise brute
+    if not isinstance(brute, dict):
+        raise LigneInvalide(f"objet attendu, {type(brute).__name__} trouvé")
+    ligne = {}
+    for colonne, valeur in brute.items():
+        champ = ALIAS_COLONNES.get(normaliser(colonne).strip().replace(' ', '_'))
+        if champ and valeur not in (None, ''):
+            ligne[champ] = str(valeur).strip()
+
+    if not ligne.get('titre'):
+        raise LigneInvalide("titre manquant")
+    if not ligne.get('numero_inventaire'):
+        raise LigneInvalide("numéro d'inventaire manquant")
+    ligne['date_publication'] = lire_date(ligne.get('date_publication'))
+
+    nom, prenom = ligne.pop('auteur_nom', ''), ligne.pop('auteur_prenom', '')
+    auteur = ligne.pop('auteur', '')
+    if not nom and auteur:
+        # Convention des notices : « Nom, Prénom » ; sinon le texte entier est le nom, comme à la saisie
+        nom, _, prenom = auteur.partition(',') if ',' in auteur else (auteur, '', '')
+    ligne['auteur'] = (nom.strip(), prenom.strip()) if nom.strip() else None
+    return ligne
+
+
+def lire_csv(chemin, delimiteur=None, encodage='utf-8-sig'):
+    with open(chemin, newline='', encoding=encodage) as fichier:
+        if delimiteur is None:
+            debut = fichier.read(4096)
+            fichier.seek(0)
+            try:
+                delimiteur = csv.Sniffer().sniff(debut, delimiters=',;\t|').delimiter
+            except csv.Error:
+                delimiteur = ','
+        for numero, ligne in enumerate(csv.DictReader(fichier, delimiter=delimiteur), start=2):
+            yield numero, ligne
+
+
+def lire_jsonl(chemin, encodage='utf-8-sig'):
+    with open(chemin, encoding=encodage) as fichier:
+        for numero, ligne in enumerate(fichier, start=1):
+            if ligne.strip():
+                try:
+                    yield numero, json.loads(ligne)
+                except json.JSONDecodeError as e:
+                    yield numero, LigneInvalide(f"JSON illisible: {e.msg} (colonne {e.colno})")
+
+
+def _sous_champ(notice, etiquette, code):
+    for champ in notice.get_fields(etiquette):
+        valeurs = champ.get_subfields(code)
+        if valeurs:
+            return valeurs[0]
+    return None
+
+
+def lire_marc(chemin):
+    try:
+        from pymarc import MARCReader
+    except ImportError:
+        raise CommandError("Le format MARC nécessite le paquet pymarc (pip install pymarc)")
+
+    with open(chemin, 'rb') as fichier:
+        for numero, notice in enumerate(MARCReader(fichier, to_unicode=True, force_utf8=True), start=1):
+            if notice is None:
+                continue
+            titre = (_sous_champ(notice, '245', 'a') or '').rstrip(' /:;.')
+            sous_titre = (_sous_champ(notice, '245', 'b') or '').rstrip(' /:;.')
+            yield numero, {
+                'titre': f'{titre} : {sous_titre}' if sous_titre else titre,
+                'auteur': (_sous_champ(notice, '100', 'a') or _sous_champ(notice, '110', 'a') or '').rstrip(' ,.'),
+                'categorie': (_sous_champ(notice, '650', 'a') or '').rstrip(' .'),
+                # Code-barres de l'exemplaire (852/952 $p), sinon numéro de notice
+                'numero_inventaire': _sous_champ(notice, '852', 'p') or _sous_champ(notice, '952', 'p')
+                                     or (notice['001'].data if notice['001'] else None),
+                'ancien_code': _sous_champ(notice, '852', 'h') or _sous_champ(notice, '952', 'o'),
+                'date_publication': _sous_champ(notice, '264', 'c') or _sous_champ(notice, '260', 'c'),
+                'description': _sous_champ(notice, '520', 'a'),
+            }
+
+
+def detecter_format(chemin):
+    extension = os.path.splitext(chemin)[1].lower()
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    if extension in ('.mrc', '.marc'):
+        return 'marc'
+    return 'csv'
+
+
+def _lire_tout(client, table, colonnes):
+    lignes, debut = [], 0
+    while True:
+        page = client.table(table).select(colonnes).order('id').range(debut, debut + TAILLE_PAGE_LECTURE - 1).execute().data
+        lignes += page
+        if len(page) < TAILLE_PAGE_LECTURE:
+            return lignes
+        debut += TAILLE_PAGE_LECTURE
+
+
+class Importateur:
+    """Résout auteurs et catégories en mémoire et écrit les livres par lots"""
+
+    def __init__(self, client, taille_lot=TAILLE_LOT, simulation=False):
+        self.client = client
+        self.taille_lot = taille_lot
+        self.simulation = simulation
+        self.auteurs = {cle_auteur(a['nom'], a.get('prenom')): a['id'] for a in _lire_tout(client, 'auteurs', 'id, nom, prenom')}
+        self.categories = {cle_categorie(c['nom']): c['id'] for c in _lire_tout(client, 'categories', 'id, nom')}
+        self.lues = self.importees = self.rejetees = self.auteurs_crees = self.categories_creees = 0
+        self.erreurs = []
+        self._lot = []
+
+    def ajouter(self, origine, brute):
+        """Ajoute une ligne du fichier au lot courant ; envoie le lot lorsqu'il est plein"""
+        self.lues += 1
+        try:
+            self._lot.append(normaliser_ligne(brute))
+        except LigneInvalide as e:
+            self.rejetees += 1
+            self.erreurs.append(f"{origine}: {e}")
+            return
+        if len(self._lot) >= self.taille_lot:
+            self.envoyer()
+
+    def _creer_manquants(self, table, index, manquants):
+        """Crée en une requête les auteurs ou catégories absents de l'index"""
+        if not manquants:
+            return
+        # Identifiants attribués ici : inutile de relire les lignes créées
+        for ligne in manquants.values():
+            ligne['id'] = str(uuid.uuid4())
+        if not self.simulation:
+            self.client.table(table).insert(list(manquants.values()), returning='minimal').execute()
+        for cle, ligne in manquants.items():
+            index[cle] = ligne['id']
+
+    def envoyer(self):
+        lot, self._lot = self._lot, []
+        if not lot:
+            return
+
+        auteurs, categories = {}, {}
+        for ligne in lot:
+            if ligne['auteur']:
+                cle = cle_auteur(*ligne['auteur'])
+                if cle not in self.auteurs:
+                    auteurs.setdefault(cle, {'nom': ligne['auteur'][0], 'prenom': ligne['auteur'][1]})
+            if ligne.get('categorie'):
+                cle = cle_categorie(ligne['categorie'])
+                if cle not in self.categories:
+                    categories.setdefault(cle, {'nom': ligne['categorie']})
+        try:
+            self._creer_manquants('auteurs', self.auteurs, auteurs)
+            self._creer_manquants('categories', self.categories, categories)
+        except Exception as e:
+            self.rejetees += len(lot)
+            self.erreurs.append(f"Lot rejeté (auteurs ou catégories): {e}")
+            return
+        self.auteurs_crees += len(auteurs)
+        self.categories_creees += len(categories)
+
+        # Un même numéro deux fois dans un upsert est refusé par PostgreSQL : la dernière ligne l'emporte
+        livres = {}
+        nombre_lignes = {}
+        for ligne in lot:
+            livre = {colonne: ligne[colonne] for colonne in COLONNES_LIVRE if ligne.get(colonne)}
+            if ligne['auteur']:
+                livre['auteur_id'] = self.auteurs[cle_auteur(*ligne['auteur'])]
+            if ligne.get('categorie'):
+                livre['categorie_id'] = self.categories[cle_categorie(ligne['categorie'])]
+            livres[livre['numero_inventaire']] = livre
+            nombre_lignes[livre['numero_inventaire']] = nombre_lignes.get(livre['numero_inventaire'], 0) + 1
+
+        # Toutes les lignes d'une insertion groupée ont les mêmes colonnes : les compléter avec
+        # None effacerait, sur un numéro déjà importé, les valeurs absentes du fichier. Une
+        # insertion par jeu de colonnes.
+        groupes = {}
+        for livre in livres.values():
+            groupes.setdefault(frozenset(livre), []).append(livre)
+        for groupe in groupes.values():
+            lignes = sum(nombre_lignes[livre['numero_inventaire']] for livre in groupe)
+            if not self.simulation:
+                try:
+                    self.client.table('livres').upsert(groupe, on_conflict='numero_inventaire', returning='minimal').execute()
+                except Exception as e:
+                    self.rejetees += lignes
+                    self.erreurs.append(f"Lot rejeté: {e}")
+                    continue
+            self.importees += lignes
+
+    def terminer(self):
+        self.envoyer()
+        if self.importees and not self.simulation:
+            # Versions partagées : les autres processus (serveur) voient aussi l'import
+            invalider_catalogue()
+            changer_version_import()
+            try:
+                catalogue_modifie.send(sender=self.__class__, table='livres', action='import', identifiant=None, ligne=None)
+            except Exception as e:
+                print(f"Erreur lors de la notification de modification du catalogue: {e}")
+
+
+class Command(BaseCommand):
+    help = 'Importer des livres en masse depuis des fichiers CSV, JSONL ou MARC'
+
+    def add_arguments(self, parser):
+        parser.add_argument('fichiers', nargs='+', help='Fichiers à importer')
+        parser.add_argument('--format', choices=['csv', 'jsonl', 'marc'], help="Format (déduit de l'extension par défaut)")
+        parser.add_argument('--lot', type=int, default=TAILLE_LOT, help='Livres par requête d\'insertion')
+        parser.add_argument('--delimiteur', type=str, help='Séparateur CSV (détecté par défaut)')
+        parser.add_argument('--encodage', type=str, default='utf-8-sig', help='Encodage des fichiers CSV et JSONL')
+        parser.add_argument('--simulation', action='store_true', help='Lire et valider sans rien écrire')
+
+    def handle(self, *args, **options):
+        client = get_supabase_client(admin=True)
+        if client is None:
+            raise CommandError("Client Supabase indisponible")
+        for chemin in options['fichiers']:
+            if not os.path.isfile(chemin):
+                raise CommandError(f"Fichier introuvable: {chemin}")
+
+        debut = time.perf_counter()
+        importateur = Importateur(client, max(1, options['lot']), options['simulation'])
+        self.stdout.write(f"{len(importateur.auteurs)} auteurs et {len(importateur.categories)} catégories existants")
+
+        interruption = None
+        try:
+            for chemin in options['fichiers']:
+                try:
+                    self._importer_fichier(importateur, chemin, options, debut)
+                except CommandError as e:
+                    interruption = e
+                    break
+        finally:
+            # Les lots déjà écrits restent écrits : le cache est invalidé dans tous les cas
+            importateur.terminer()
+
+        for erreur in importateur.erreurs[:20]:
+            self.stdout.write(self.style.WARNING(erreur))
+        if len(importateur.erreurs) > 20:
+            self.stdout.write(self.style.WARNING(f"... et {len(importateur.erreurs) - 20} autres"))
+        self._progression(importateur, debut)
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Simulation terminée' if importateur.simulation else 'Import terminé'} : "
+            f"{importateur.importees} livres, {importateur.auteurs_crees} auteurs et "
+            f"{importateur.categories_creees} catégories créés, {importateur.rejetees} lignes rejetées"
+        ))
+        if interruption:
+            raise interruption
+
+    def _importer_fichier(self, importateur, chemin, options, debut):
+        format_fichier = options['format'] or detecter_format(chemin)
+        if format_fichier == 'marc':
+            lignes = lire_marc(chemin)
+        elif format_fichier == 'jsonl':
+            lignes = lire_jsonl(chemin, options['encodage'])
+        else:
+            lignes = lire_csv(chemin, options['delimiteur'], options['encodage'])
+
+        nom = os.path.basename(chemin)
+        prochain_rapport = importateur.taille_lot * 10
+        try:
+            for numero, brute in lignes:
+                importateur.ajouter(f"{nom}:{numero}", brute)
+                if importateur.lues >= prochain_rapport:
+                    prochain_rapport += importateur.taille_lot * 10
+                    self._progression(importateur, debut)
+        except (UnicodeDecodeError, ValueError, csv.Error) as e:
+            raise CommandError(f"Lecture de {chemin} interrompue: {e}")
+
+    def _progression(self, importateur, debut):
+        duree = time.perf_counter() - debut
+        self.stdout.write(
+            f"{importateur.lues} lignes lues, {importateur.importees} importées, {importateur.rejetees} rejetées "
+            f"en {duree:.1f} s ({importateur.lues / duree if duree else 0:.0f} lignes/s)"
+        )
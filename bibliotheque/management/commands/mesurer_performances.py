@@ -0,0 +1,297 @@
+"""
+Banc de mesure des vues principales sur des catalogues synthétiques.
+
+Pour chaque échelle (nombre de livres), la base Supabase locale est vidée
+puis peuplée (catégories, milliers d'auteurs, livres, lecteurs avec des
+centaines de favoris et de rendez-vous, un bibliothécaire). Chaque vue est
+ensuite appelée par le client de test de Django : latence p50/p95/p99,
+nombre d'appels Supabase (en-tête Server-Timing), pic de mémoire alloué
+pendant une requête (tracemalloc). Les résultats sont écrits en JSON pour
+être comparés d'un commit à l'autre (--comparer).
+
+Exemple :
+    SUPABASE_LOCAL=:memory: SUPABASE_LOCAL_LATENCE_MS=5-15 \\
+        python manage.py mesurer_performances --echelles 1000 10000
+"""
+from datetime import date, datetime, timedelta
+import json
+import logging
+import os
+import platform
+import random
+import re
+import resource
+import subprocess
+import time
+import tracemalloc
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from bibliotech.supabase_client import get_supabase_client
+from bibliotech.supabase_local import get_base_locale
+from bibliotheque import autocompletion, index_recherche
+
+ECHELLES = [1000, 10000, 100000]
+NOMBRE_CATEGORIES = 20
+TAILLE_LOT = 1000
+MOT_DE_PASSE = 'mesure-performances'
+
+MOTS = [
+    'histoire', 'maroc', 'droit', 'économie', 'société', 'politique', 'science', 'culture', 'méditerranée',
+    'littérature', 'philosophie', 'géographie', 'commerce', 'mémoire', 'voyage', 'musique', 'architecture',
+    'éducation', 'santé', 'environnement', 'agriculture', 'patrimoine', 'langue', 'religion', 'médecine',
+]
+NOMS = ['Alaoui', 'Bennani', 'Chraibi', 'Daoudi', 'El Fassi', 'Filali', 'Guessous', 'Haddad', 'Idrissi', 'Jettou']
+PRENOMS = ['Amina', 'Driss', 'Fatima', 'Hassan', 'Khadija', 'Mehdi', 'Nadia', 'Omar', 'Salma', 'Youssef']
+
+VUES = ['home', 'details_categorie', 'detail_livre', 'recherche', 'autocomplete', 'mes_favoris', 'gestion_rdv_bibliothecaire']
+
+_APPELS = re.compile(r'desc="(\d+) appels"')
+
+
+def centile(valeurs, p):
+    """Centile par interpolation linéaire entre les rangs (valeurs déjà triées)"""
+    if not valeurs:
+        return None
+    rang = (len(valeurs) - 1) * p / 100
+    bas = int(rang)
+    haut = min(bas + 1, len(valeurs) - 1)
+    return valeurs[bas] + (valeurs[haut] - valeurs[bas]) * (rang - bas)
+
+
+def _inserer(client, table, lignes):
+    for debut in range(0, len(lignes), TAILLE_LOT):
+        client.table(table).insert(lignes[debut:debut + TAILLE_LOT], returning='minimal').execute()
+
+
+def _inscrire(client, email, nom, prenom):
+    reponse = client.auth.sign_up({'email': email, 'password': MOT_DE_PASSE, 'options': {'data': {'nom': nom, 'prenom': prenom}}})
+    return reponse.user.id
+
+
+def peupler(client, nombre_livres, nombre_lecteurs, nombre_favoris, nombre_rdv, graine=0):
+    """Remplit la base avec un catalogue synthétique reproductible ; retourne les identifiants utiles"""
+    hasard = random.Random(graine)
+    categories = [{'id': str(uuid.uuid4()), 'nom': f'{MOTS[i % len(MOTS)].capitalize()} {i}'} for i in range(NOMBRE_CATEGORIES)]
+    auteurs = [
+        {'id': str(uuid.uuid4()), 'nom': f'{hasard.choice(NOMS)} {i}', 'prenom': hasard.choice(PRENOMS)}
+        for i in range(max(100, nombre_livres // 10))
+    ]
+    livres = [
+        {
+            'id': str(uuid.uuid4()),
+            'titre': ' '.join(hasard.sample(MOTS, 3)).capitalize() + f' {i}',
+            'auteur_id': hasard.choice(auteurs)['id'],
+            'categorie_id': hasard.choice(categories)['id'],
+            'numero_inventaire': f'INV-{i:06d}',
+            'date_publication': f'{hasard.randint(1950, 2024)}-01-01',
+        }
+        for i in range(nombre_livres)
+    ]
+    _inserer(client, 'categories', categories)
+    _inserer(client, 'auteurs', auteurs)
+    _inserer(client, 'livres', livres)
+
+    lecteurs = [
+        _inscrire(client, f'lecteur{i}@mesure.local', hasard.choice(NOMS), hasard.choice(PRENOMS))
+        for i in range(nombre_lecteurs)
+    ]
+    bibliothecaire = _inscrire(client, 'bibliothecaire@mesure.local', 'Bibliothécaire', 'Mesure')
+    client.table('profiles').update({'is_librarian': True}).eq('id', bibliothecaire).execute()
+
+    favoris, rendez_vous = [], []
+    aujourd_hui = date.today()
+    for user_id in lecteurs:
+        for livre in hasard.sample(livres, min(nombre_favoris, len(livres))):
+            favoris.append({'user_id': user_id, 'livre_id': livre['id']})
+        for _ in range(nombre_rdv):
+            livre = hasard.choice(livres)
+            rendez_vous.append({
+                'utilisateur_id': user_id, 'nom': 'Lecteur', 'prenom': 'Mesure', 'telephone': '0600000000',
+                'email': 'lecteur@mesure.local', 'type_utilisateur': 'etudiant', 'livre_id': livre['id'],
+                'titre_ouvrage': livre['titre'], 'raison': 'Consultation',
+                'date_souhaitee': (aujourd_hui + timedelta(days=hasard.randint(-30, 30))).isoformat(),
+            })
+    _inserer(client, 'favoris', favoris)
+    _inserer(client, 'rendezvous', rendez_vous)
+    return {'categories': categories, 'livres': livres}
+
+
+def _connecter(email):
+    client = Client()
+    reponse = client.post(reverse('connexion'), {'email': email, 'mot_de_passe': MOT_DE_PASSE})
+    if reponse.status_code != 302:
+        raise CommandError(f"Connexion impossible pour {email}")
+    return client
+
+
+def mesurer(client, urls, iterations):
+    """Appelle les URL à tour de rôle ; retourne les statistiques de la vue"""
+    debut = time.perf_counter()
+    client.get(urls[0])
+    premiere = (time.perf_counter() - debut) * 1000
+
+    durees, appels, statuts = [], [], {}
+    for i in range(iterations):
+        debut = time.perf_counter()
+        reponse = client.get(urls[i % len(urls)])
+        durees.append((time.perf_counter() - debut) * 1000)
+        statuts[str(reponse.status_code)] = statuts.get(str(reponse.status_code), 0) + 1
+        nombre = _APPELS.search(reponse.get('Server-Timing', ''))
+        appels.append(int(nombre.group(1)) if nombre else 0)
+
+    # Pic de mémoire mesuré à part : tracemalloc ralentit fortement les allocations
+    tracemalloc.start()
+    try:
+        client.get(urls[0])
+        _, pic = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    durees.sort()
+    return {
+        'premiere_ms': round(premiere, 2),
+        'p50_ms': round(centile(durees, 50), 2),
+        'p95_ms': round(centile(durees, 95), 2),
+        'p99_ms': round(centile(durees, 99), 2),
+        'moyenne_ms': round(sum(durees) / len(durees), 2),
+        'appels_supabase': round(sum(appels) / len(appels), 2),
+        'memoire_pic_ko': round(pic / 1024, 1),
+        'statuts': statuts,
+    }
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Mesurer les performances des vues principales sur des catalogues synthétiques (Supabase local)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--echelles', type=int, nargs='+', default=ECHELLES, help='Nombres de livres à générer')
+        parser.add_argument('--iterations', type=int, default=50, help='Requêtes mesurées par vue')
+        parser.add_argument('--lecteurs', type=int, default=20, help='Nombre de lecteurs inscrits')
+        parser.add_argument('--favoris', type=int, default=300, help='Favoris par lecteur')
+        parser.add_argument('--rendez-vous', type=int, default=25, help='Rendez-vous par lecteur')
+        parser.add_argument('--graine', type=int, default=0, help='Graine du générateur de données')
+        parser.add_argument('--sortie', type=str, help='Fichier JSON des résultats')
+        parser.add_argument('--comparer', type=str, help='Résultats précédents à comparer (fichier JSON)')
+
+    def handle(self, *args, **options):
+        # Le peuplement vide la base : jamais sur un vrai projet Supabase
+        if not getattr(settings, 'SUPABASE_LOCAL', ''):
+            raise CommandError("Définissez SUPABASE_LOCAL (':memory:' ou un fichier SQLite) pour lancer les mesures")
+        client_admin = get_supabase_client(admin=True)
+        if client_admin is None:
+            raise CommandError("Client Supabase local indisponible")
+
+        resultats = {
+            'commit': _commit(),
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'latence_ms': getattr(settings, 'SUPABASE_LOCAL_LATENCE_MS', '0'),
+            'iterations': options['iterations'],
+            'echelles': {},
+        }
+
+        # Une ligne de journal par requête fausserait les mesures
+        journal = logging.getLogger('bibliotech.traces')
+        niveau = journal.level
+        journal.setLevel(logging.WARNING)
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                for echelle in options['echelles']:
+                    resultats['echelles'][str(echelle)] = self._mesurer_echelle(client_admin, echelle, options)
+        finally:
+            journal.setLevel(niveau)
+        resultats['rss_max_ko'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        sortie = options['sortie'] or os.path.join(
+            settings.BASE_DIR, 'mesures', f"{datetime.now():%Y%m%d-%H%M%S}-{resultats['commit'] or 'inconnu'}.json"
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(sortie)), exist_ok=True)
+        with open(sortie, 'w', encoding='utf-8') as fichier:
+            json.dump(resultats, fichier, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Résultats enregistrés dans {sortie}"))
+
+        if options['comparer']:
+            self._comparer(options['comparer'], resultats)
+
+    def _mesurer_echelle(self, client_admin, echelle, options):
+        self.stdout.write(f"Peuplement : {echelle} livres...")
+        get_base_locale().vider()
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        debut = time.perf_counter()
+        donnees = peupler(
+            client_admin, echelle, options['lecteurs'], options['favoris'], options['rendez_vous'], options['graine'],
+        )
+        peuplement = time.perf_counter() - debut
+
+        # Index en mémoire reconstruits maintenant : ils ne sont pas comptés dans les vues
+        debut = time.perf_counter()
+        index_recherche._reconstruction.reconstruire()
+        autocompletion._reconstruction.reconstruire()
+        construction = time.perf_counter() - debut
+
+        anonyme = Client()
+        lecteur = _connecter('lecteur0@mesure.local')
+        bibliothecaire = _connecter('bibliothecaire@mesure.local')
+        hasard = random.Random(options['graine'])
+        livres = hasard.sample(donnees['livres'], min(20, len(donnees['livres'])))
+        urls = {
+            'home': (anonyme, [reverse('catalogue')]),
+            'details_categorie': (anonyme, [
+                reverse('details_categorie', args=[categorie['id']]) for categorie in donnees['categories']
+            ]),
+            'detail_livre': (lecteur, [
+                reverse('detail_livre', args=[livre['categorie_id'], livre['id']]) for livre in livres
+            ]),
+            'recherche': (anonyme, [f"{reverse('recherche')}?q={mot}" for mot in MOTS]),
+            'autocomplete': (anonyme, [f"{reverse('autocomplete')}?term={mot[:3]}" for mot in MOTS]),
+            'mes_favoris': (lecteur, [reverse('mes_favoris')]),
+            'gestion_rdv_bibliothecaire': (bibliothecaire, [reverse('gestion_rdv_bibliothecaire')]),
+        }
+
+        vues = {}
+        for vue in VUES:
+            client, adresses = urls[vue]
+            vues[vue] = mesurer(client, adresses, options['iterations'])
+            self.stdout.write(
+                f"  {vue:<28} p50 {vues[vue]['p50_ms']:>9} ms  p95 {vues[vue]['p95_ms']:>9} ms  "
+                f"p99 {vues[vue]['p99_ms']:>9} ms  {vues[vue]['appels_supabase']:>5} appels  "
+                f"{vues[vue]['memoire_pic_ko']:>9} Ko"
+            )
+        return {'peuplement_s': round(peuplement, 2), 'construction_index_s': round(construction, 2), 'vues': vues}
+
+    def _comparer(self, chemin, resultats):
+        try:
+            with open(chemin, encoding='utf-8') as fichier:
+                precedents = json.load(fichier)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Résultats illisibles {chemin}: {e}")
+
+        self.stdout.write(f"Comparaison avec {precedents.get('commit')} ({precedents.get('date')}) :")
+        for echelle, mesures in resultats['echelles'].items():
+            anciennes = precedents.get('echelles', {}).get(echelle, {}).get('vues', {})
+            for vue, valeurs in mesures['vues'].items():
+                ancien = anciennes.get(vue)
+                if not ancien or not ancien.get('p95_ms'):
+                    continue
+                ecart = (valeurs['p95_ms'] - ancien['p95_ms']) / ancien['p95_ms'] * 100
+                style = self.style.ERROR if ecart > 10 else self.style.SUCCESS if ecart < -10 else str
+                self.stdout.write(style(
+                    f"  {echelle:>7} {vue:<28} p95 {ancien['p95_ms']} -> {valeurs['p95_ms']} ms ({ecart:+.1f} %)"
+                ))
@@ -0,0 +1,90 @@
+"""
+Cycle de vie des structures en mémoire construites depuis Supabase (index de
+recherche, autocomplétion).
+
+La première construction est synchrone. Ensuite, une structure périmée reste
+servie pendant qu'un thread la reconstruit. Les écritures reçues pendant une
+reconstruction sont appliquées tout de suite à la structure servie, puis
+rejouées après le remplacement : l'instantané lu depuis Supabase peut leur
+être antérieur.
+
+Un import en masse (commande importer_catalogue, souvent dans un autre
+processus) change la version d'import partagée : chaque worker reconstruit
+alors sa structure, sans attendre qu'elle soit périmée.
+"""
+import threading
+
+from bibliotech.sessions import lire_version_import
+
+
+class Reconstruction:
+    """Structure partagée par les threads du worker et fonction qui la recharge"""
+
+    def __init__(self, structure, charger, nom):
+        self.structure = structure
+        self.charger = charger  # charger(structure) : lit Supabase puis appelle structure.construire(...)
+        self.nom = nom
+        self._verrou_construction = threading.Lock()
+        self._verrou_ecritures = threading.Lock()
+        self._en_attente = None  # écritures à rejouer, pendant une reconstruction
+        self.version_import = None  # version d'import lue avant le dernier chargement
+
+    def reconstruire(self):
+        """Recharge la structure puis rejoue les écritures reçues pendant le chargement"""
+        with self._verrou_ecritures:
+            self._en_attente = []
+        version_import = lire_version_import()
+        try:
+            self.charger(self.structure)
+            self.version_import = version_import
+        finally:
+            with self._verrou_ecritures:
+                if self.structure.construit_le is not None:
+                    for ecriture in self._en_attente:
+                        ecriture()
+                self._en_attente = None
+
+    def suit_les_ecritures(self):
+        """Vrai si la structure est construite ou en cours de construction"""
+        return self.structure.construit_le is not None or self._en_attente is not None
+
+    def appliquer(self, ecriture):
+        """Applique une écriture (fonction sans argument) à la structure, si elle est construite"""
+        with self._verrou_ecritures:
+            if self.structure.construit_le is not None:
+                ecriture()
+            if self._en_attente is not None:
+                self._en_attente.append(ecriture)
+
+    def _import_depuis_chargement(self):
+        version = lire_version_import()
+        return version is not None and version != self.version_import
+
+    def _reconstruire_en_arriere_plan(self):
+        if not self._verrou_construction.acquire(blocking=False):
+            return
+        def tache():
+            try:
+                self.reconstruire()
+            except Exception as e:
+                print(f"Erreur lors de la reconstruction de {self.nom}: {e}")
+            finally:
+                self._verrou_construction.release()
+        threading.Thread(target=tache, daemon=True).start()
+
+    def obtenir(self):
+        """Retourne la structure construite, ou None si elle n'a pas pu l'être"""
+        if self.structure.construit_le is None:
+            # Première construction : synchrone, une seule à la fois
+            with self._verrou_construction:
+                if self.structure.construit_le is None:
+                    try:
+                        self.reconstruire()
+                    except Exception as e:
+                        print(f"Erreur lors de la construction de {self.nom}: {e}")
+            if self.structure.construit_le is None:
+                return None
+        elif self.structure.est_perime() or self._import_depuis_chargement():
+            # L'ancienne version reste servie pendant la reconstruction
+            self._reconstruire_en_arriere_plan()
+        return self.structure
@@ -0,0 +1,16 @@
+from django.dispatch import receiver
+from comptes.signals import catalogue_modifie
+from . import autocompletion, index_recherche
+
+@receiver(catalogue_modifie)
+def mettre_a_jour_index_recherche(sender, table, action, identifiant=None, ligne=None, **kwargs):
+    """Répercute les écritures sur les livres, les auteurs et les catégories dans l'index de recherche"""
+    if table == 'livres':
+        index_recherche.mettre_a_jour_livre(identifiant, supprime=(action == 'suppression'))
+    elif table in index_recherche.CHAMPS_LIES and action != 'creation':
+        index_recherche.mettre_a_jour_lien(table, identifiant, ligne, supprime=(action == 'suppression'))
+
+@receiver(catalogue_modifie)
+def rafraichir_autocompletion(sender, **kwargs):
+    """Recharge les suggestions après toute modification du catalogue"""
+    autocompletion.marquer_perimee()
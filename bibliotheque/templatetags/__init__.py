@@ -0,0 +1 @@
+# Package pour les tags de template personnalisés
@@ -0,0 +1,31 @@
+import hashlib
+from urllib.parse import urlencode
+
+from django import template
+from django.urls import reverse
+from bibliotheque.couvertures import url_miniature
+from bibliotheque.images import SourceInvalide, version_source, est_source_autorisee
+
+register = template.Library()
+
+@register.filter
+def miniature(url, taille='liste'):
+    """
+    Retourne l'URL de la miniature WebP d'une couverture (l'URL d'origine pour les anciennes images)
+    """
+    return url_miniature(url, taille)
+
+@register.filter
+def redimensionner(source, largeur=480):
+    """
+    Retourne l'URL de l'image redimensionnée à la demande (la source telle quelle si elle n'est pas autorisée)
+    """
+    if not source or not est_source_autorisee(str(source)):
+        return source
+    try:
+        # La version change avec le fichier local : l'URL aussi, malgré la mise en cache longue
+        version = hashlib.md5(version_source(str(source)).encode('utf-8')).hexdigest()[:10]
+    except (SourceInvalide, OSError):
+        return source
+    parametres = urlencode({'source': source, 'l': largeur, 'v': version})
+    return f"{reverse('image_redimensionnee')}?{parametres}"
@@ -1,3 +1,481 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import os
+import tempfile
 
-# Create your tests here.
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.http import Http404, HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from PIL import Image
+
+from bibliotech.sessions import changer_version_import, lire_version_import
+from bibliotech.statiques import StockageStatiqueCompresse, servir_statique
+from bibliotech.supabase_local import BaseLocale, creer_client
+from comptes.supabase_service import SupabaseService
+from comptes.session import ROLES
+
+from .autocompletion import Autocompletion
+from .couvertures import StockageLocal, enregistrer_couverture, url_miniature
+from .exports import COLONNES_LIVRES, ligne_livre, morceaux_export
+from .images import DUREE_DISTANTES, CacheDerives, SourceInvalide, choisir_format, obtenir_derive, version_source
+from .index_recherche import IndexRecherche, normaliser
+from .reconstruction import Reconstruction
+from .management.commands.importer_catalogue import Importateur, lire_csv
+from .management.commands.mesurer_performances import centile, mesurer, peupler
+from .views import exporter_livres, image_redimensionnee, recherche
+
+
+def livre(identifiant, titre, nom='', prenom='', **champs):
+    return dict(id=identifiant, titre=titre, auteur={'nom': nom, 'prenom': prenom}, **champs)
+
+
+class IndexRechercheTests(SimpleTestCase):
+    def setUp(self):
+        self.index = IndexRecherche()
+        self.index.construire([
+            livre('1', "Histoire économique du Maroc", 'Ayache', 'Germain', numero_inventaire='INV-001'),
+            livre('2', "La monnaie au Maroc", 'Lahlou', description="Histoire de la monnaie"),
+            livre('3', "Économie allemande", 'Müller', 'Hans', ancien_code='ECO-77'),
+        ])
+
+    def titres(self, requete):
+        return [l['titre'] for l in self.index.rechercher(requete)]
+
+    def test_normalisation(self):
+        self.assertEqual(normaliser("Économie Française"), "economie francaise")
+
+    def test_accents_et_prefixes(self):
+        self.assertEqual(self.titres("econ"), ["Économie allemande", "Histoire économique du Maroc"])
+        self.assertEqual(self.titres("muller"), ["Économie allemande"])
+
+    def test_classement_titre_avant_description(self):
+        self.assertEqual(self.titres("histoire"), ["Histoire économique du Maroc", "La monnaie au Maroc"])
+
+    def test_tous_les_mots_requis(self):
+        self.assertEqual(self.titres("maroc monnaie"), ["La monnaie au Maroc"])
+        self.assertEqual(self.titres("maroc hans"), [])
+
+    def test_codes(self):
+        self.assertEqual(self.titres("inv-001"), ["Histoire économique du Maroc"])
+        self.assertEqual(self.titres("eco 77"), ["Économie allemande"])
+
+    def test_mise_a_jour_incrementale(self):
+        self.index.ajouter(livre('2', "Les salaires", 'Lahlou'))
+        self.assertEqual(self.titres("monnaie"), [])
+        self.assertEqual(self.titres("salaires"), ["Les salaires"])
+        self.index.retirer('3')
+        self.assertEqual(self.titres("allemande"), [])
+        self.assertNotIn('allemande', self.index._vocabulaire)
+
+    def test_page_de_resultats_avec_total(self):
+        self.index.construire([livre(str(i), f"Atlas {i:03}") for i in range(60)])
+        requete = RequestFactory().get('/bibliotheque/recherche/', {'q': 'atlas', 'curseur': '24'})
+        requete.session = {}
+        with mock.patch('bibliotheque.views.get_index', return_value=self.index), \
+                mock.patch.object(self.index, 'rechercher_avec_total', wraps=self.index.rechercher_avec_total) as rechercher, \
+                mock.patch('bibliotheque.views.render', side_effect=lambda request, gabarit, contexte: contexte):
+            contexte = recherche(requete)
+        # Classement limité à la fin de la page demandée
+        rechercher.assert_called_once_with('atlas', limite=48)
+        self.assertEqual([l['titre'] for l in contexte['livres']], [f"Atlas {i:03}" for i in range(24, 48)])
+        self.assertEqual((contexte['nombre_resultats'], contexte['curseur_suivant']), (60, '48'))
+        self.assertTrue(contexte['total_exact'])
+
+    def test_auteur_et_categorie_modifies(self):
+        self.index.ajouter(livre('4', "Le Maroc colonial", 'Rivet', 'Daniel', auteur_id='a1', categorie_id='c1',
+                                 categorie={'id': 'c1', 'nom': 'Histoire', 'image': None}))
+        self.index.modifier_lien('auteur', 'a1', {'id': 'a1', 'nom': 'Rivet', 'prenom': 'Danielle'})
+        self.assertEqual(self.titres("danielle"), ["Le Maroc colonial"])
+        self.index.modifier_lien('categorie', 'c1', None)
+        self.assertIsNone(self.index.livres['4']['categorie'])
+        self.assertIsNone(self.index.livres['4']['categorie_id'])
+
+    def test_ecritures_rejouees_apres_reconstruction(self):
+        instantane = list(self.index.livres.values())
+        def charger(index):
+            # Écriture reçue pendant la lecture d'un instantané qui ne la contient pas
+            reconstruction.appliquer(lambda: index.ajouter(livre('4', "Les salaires", 'Lahlou')))
+            index.construire(instantane)
+        reconstruction = Reconstruction(self.index, charger, "l'index de recherche")
+        reconstruction.reconstruire()
+        self.assertEqual(self.titres("salaires"), ["Les salaires"])
+
+    def test_reconstruction_apres_un_import_d_un_autre_processus(self):
+        charger = mock.Mock(side_effect=lambda index: index.construire(list(index.livres.values())))
+        reconstruction = Reconstruction(self.index, charger, "l'index de recherche")
+        reconstruction.reconstruire()
+        with mock.patch.object(reconstruction, '_reconstruire_en_arriere_plan') as en_arriere_plan:
+            self.assertIs(reconstruction.obtenir(), self.index)
+            en_arriere_plan.assert_not_called()
+            changer_version_import()
+            self.assertIs(reconstruction.obtenir(), self.index)
+            en_arriere_plan.assert_called_once()
+
+
+class AutocompletionTests(SimpleTestCase):
+    def setUp(self):
+        self.autocompletion = Autocompletion()
+        self.autocompletion.construire(
+            [
+                livre('1', "Histoire du Maroc", 'Ayache', 'Germain', categorie_id='c1'),
+                livre('2', "La monnaie au Maroc", 'Ayache', 'Germain', categorie_id='c2'),
+                livre('3', "Maroc moderne", 'Lahlou', categorie_id='c2'),
+            ],
+            [{'id': 'c1', 'nom': 'Histoire'}, {'id': 'c2', 'nom': 'Économie marocaine'}],
+        )
+
+    def test_debut_de_libelle_avant_mot_interieur(self):
+        self.assertEqual(
+            self.autocompletion.suggerer("mar"),
+            ["Maroc moderne", "Économie marocaine", "Histoire du Maroc", "La monnaie au Maroc"],
+        )
+
+    def test_popularite(self):
+        self.assertEqual(self.autocompletion.suggerer("ayache"), ["Germain Ayache"])
+        self.assertEqual(self.autocompletion.suggerer("hist"), ["Histoire", "Histoire du Maroc"])
+
+    def test_filtre_par_type(self):
+        self.assertEqual(self.autocompletion.suggerer("econ", types={'livre'}), [])
+        self.assertEqual(self.autocompletion.suggerer("econ"), ["Économie marocaine"])
+
+    def test_popularite_sur_un_grand_intervalle(self):
+        livres = [livre(str(i), f"Manuel {i:05}", 'Abbas', categorie_id='c1') for i in range(5000)]
+        livres += [livre(f'z{i}', f"Zellige {i}", 'Mzoughi', 'Zineb') for i in range(3)]
+        self.autocompletion.construire(livres, [{'id': 'c1', 'nom': 'Manuels'}])
+        suggestions = self.autocompletion.suggerer("m")
+        self.assertEqual(suggestions[:2], ["Manuels", "Manuel 00000"])
+        self.assertEqual(self.autocompletion.suggerer("m", limite=50)[:10], suggestions)
+        self.assertEqual(self.autocompletion.suggerer("mzou"), ["Zineb Mzoughi"])
+        self.assertEqual(self.autocompletion.suggerer("z")[0], "Zineb Mzoughi")
+
+
+class CouverturesTests(SimpleTestCase):
+    def setUp(self):
+        dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(dossier.cleanup)
+        self.racine = dossier.name
+        self.stockage = StockageLocal(self.racine, '/media/')
+
+    def fichier(self, nom, couleur='red', format='JPEG'):
+        tampon = io.BytesIO()
+        Image.new('RGB', (900, 600), couleur).save(tampon, format)
+        return SimpleUploadedFile(nom, tampon.getvalue(), content_type='image/jpeg')
+
+    def fichiers_stockes(self):
+        return sorted(os.path.relpath(os.path.join(d, f), self.racine) for d, _, fs in os.walk(self.racine) for f in fs)
+
+    def test_doublons_stockes_une_fois(self):
+        url = enregistrer_couverture(self.fichier('Maroc_ks8LeZY.jpeg'), self.stockage)
+        self.assertEqual(enregistrer_couverture(self.fichier('Maroc_qtMdWBX.jpeg'), self.stockage), url)
+        self.assertNotEqual(enregistrer_couverture(self.fichier('Autre.jpeg', 'blue'), self.stockage), url)
+        self.assertEqual(len(self.fichiers_stockes()), 6)
+        self.assertRegex(url, r'^/media/couvertures/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+
+    def test_miniatures_webp_de_taille_fixe(self):
+        url = enregistrer_couverture(self.fichier('Maroc.png', format='PNG'), self.stockage)
+        self.assertTrue(url.endswith('.png'))
+        miniature = url_miniature(url, 'liste')
+        with Image.open(os.path.join(self.racine, miniature[len('/media/'):])) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (240, 320)))
+
+    def test_anciennes_images_inchangees(self):
+        self.assertEqual(url_miniature('https://exemple.com/maroc.jpg', 'liste'), 'https://exemple.com/maroc.jpg')
+        self.assertEqual(url_miniature('', 'liste'), '')
+
+
+class ImagesTests(SimpleTestCase):
+    def setUp(self):
+        dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(dossier.cleanup)
+        self.media = os.path.join(dossier.name, 'media')
+        os.makedirs(os.path.join(self.media, 'categorie_images'))
+        Image.new('RGB', (1000, 500), 'green').save(os.path.join(self.media, 'categorie_images', 'Maroc.png'))
+        self.cache = CacheDerives(os.path.join(dossier.name, 'cache'), taille_max=10 ** 9)
+        reglages = override_settings(MEDIA_ROOT=self.media)
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+
+    def test_negociation_du_format(self):
+        self.assertEqual(choisir_format('image/avif,image/webp,*/*'), 'avif')
+        self.assertEqual(choisir_format('image/webp,*/*'), 'webp')
+        self.assertEqual(choisir_format('*/*'), 'jpeg')
+        self.assertEqual(choisir_format('image/avif', 'jpeg'), 'jpeg')
+
+    def test_derive_produit_puis_servi_depuis_le_cache(self):
+        fichier, type_contenu, cle = obtenir_derive('/media/categorie_images/Maroc.png', 300, 'webp', self.cache)
+        self.assertEqual(type_contenu, 'image/webp')
+        with fichier, Image.open(fichier) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (320, 160)))
+        with mock.patch('bibliotheque.images._produire') as produire:
+            fichier, _, cle_en_cache = obtenir_derive('categorie_images/Maroc.png', 320, 'webp', self.cache)
+        with fichier:
+            self.assertEqual((fichier.name, cle_en_cache), (self.cache.chemin(cle), cle))
+        produire.assert_not_called()
+
+    def test_derive_servi_malgre_un_elagage_concurrent(self):
+        fichier, _, cle = obtenir_derive('categorie_images/Maroc.png', 240, 'jpeg', self.cache)
+        fichier.close()
+        fichier = self.cache.lire(cle)
+        os.remove(self.cache.chemin(cle))
+        with fichier, Image.open(fichier) as image:
+            self.assertEqual(image.size, (240, 120))
+
+    def test_images_distantes_relues_periodiquement(self):
+        source = 'https://exemple.supabase.co/storage/maroc.jpg'
+        with mock.patch('bibliotheque.images.time.time', return_value=10 ** 9):
+            version = version_source(source)
+            self.assertEqual(version_source(source), version)
+        with mock.patch('bibliotheque.images.time.time', return_value=10 ** 9 + DUREE_DISTANTES):
+            self.assertNotEqual(version_source(source), version)
+
+    def test_sources_refusees(self):
+        for source in ('../../etc/passwd', 'categorie_images/absente.png', 'https://inconnu.example/image.jpg'):
+            with self.assertRaises(SourceInvalide):
+                obtenir_derive(source, 240, 'jpeg', self.cache)
+
+    def test_elagage_des_moins_recemment_servis(self):
+        cles = [f'{i:02d}' + 'a' * 62 for i in range(3)]
+        for age, cle in enumerate(cles):
+            self.cache.ecrire(cle, b'x' * 100)
+            os.utime(self.cache.chemin(cle), (1000 + age, 1000 + age))
+        self.cache.taille_max = 350
+        def servir(cle):
+            fichier = self.cache.lire(cle)
+            if fichier is not None:
+                fichier.close()
+            return fichier is not None
+        servir(cles[0])
+        self.cache.ecrire('03' + 'a' * 62, b'x' * 100)
+        self.assertEqual([servir(cle) for cle in cles], [True, False, True])
+
+    def test_vue_en_cache_longue_et_negociee(self):
+        def requete(**entetes):
+            return RequestFactory().get('/bibliotheque/image/', {'source': 'categorie_images/Maroc.png', 'l': 240},
+                                        HTTP_ACCEPT='image/webp,*/*', **entetes)
+        with mock.patch('bibliotheque.images._cache', self.cache):
+            reponse = image_redimensionnee(requete())
+            self.assertEqual(reponse['Content-Type'], 'image/webp')
+            self.assertIn('immutable', reponse['Cache-Control'])
+            self.assertEqual(reponse['Vary'], 'Accept')
+            reponse.close()
+            self.assertEqual(image_redimensionnee(requete(HTTP_IF_NONE_MATCH=reponse['ETag'])).status_code, 304)
+            with self.assertRaises(Http404):
+                image_redimensionnee(RequestFactory().get('/bibliotheque/image/', {'source': '../secret.png'}))
+
+
+class StatiquesTests(SimpleTestCase):
+    def setUp(self):
+        dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(dossier.cleanup)
+        sources = os.path.join(dossier.name, 'sources')
+        os.makedirs(os.path.join(sources, 'css'))
+        with open(os.path.join(sources, 'css', 'style.css'), 'w') as fichier:
+            fichier.write('body { color: #333; }\n' * 200)
+        self.racine = os.path.join(dossier.name, 'staticfiles')
+        reglages = override_settings(STATIC_ROOT=self.racine, STATICFILES_DIRS=[sources], INSTALLED_APPS=[
+            'django.contrib.contenttypes', 'django.contrib.auth', 'django.contrib.staticfiles',
+        ])
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        self.nom = next(nom for nom in os.listdir(os.path.join(self.racine, 'css')) if nom.endswith('.css') and nom != 'style.css')
+
+    def requete(self, chemin, **entetes):
+        return servir_statique(RequestFactory().get(f'/static/{chemin}', **entetes), chemin)
+
+    def test_noms_empreintes_et_variantes_compressees(self):
+        fichiers = set(os.listdir(os.path.join(self.racine, 'css')))
+        self.assertRegex(self.nom, r'^style\.[0-9a-f]{12}\.css$')
+        self.assertTrue({self.nom + '.br', self.nom + '.gz'} <= fichiers)
+
+    def test_variante_choisie_selon_accept_encoding(self):
+        for accept, codage in (('gzip, deflate, br', 'br'), ('gzip', 'gzip'), ('br;q=0, gzip', 'gzip'), ('', None)):
+            reponse = self.requete(f'css/{self.nom}', HTTP_ACCEPT_ENCODING=accept)
+            self.assertEqual(reponse.get('Content-Encoding'), codage)
+            self.assertEqual(reponse['Content-Type'], 'text/css')
+            self.assertEqual(reponse['Vary'], 'Accept-Encoding')
+            reponse.close()
+
+    def test_cache_immuable_et_revalidation(self):
+        reponse = self.requete(f'css/{self.nom}', HTTP_ACCEPT_ENCODING='br')
+        reponse.close()
+        self.assertEqual(reponse['Cache-Control'], 'public, max-age=31536000, immutable')
+        revalidee = self.requete(f'css/{self.nom}', HTTP_ACCEPT_ENCODING='br', HTTP_IF_NONE_MATCH=reponse['ETag'])
+        self.assertEqual(revalidee.status_code, 304)
+        sans_empreinte = self.requete('css/style.css')
+        sans_empreinte.close()
+        self.assertIn('must-revalidate', sans_empreinte['Cache-Control'])
+        self.assertNotIn('Content-Disposition', sans_empreinte)
+        with self.assertRaises(Http404):
+            self.requete('../sources/css/style.css')
+
+    def test_nom_d_origine_hors_du_manifeste(self):
+        self.assertEqual(StockageStatiqueCompresse().url('css/style.css'), f'/static/css/{self.nom}')
+        os.remove(os.path.join(self.racine, 'staticfiles.json'))
+        # STATIC_ROOT sans manifeste (collecte non relancée) : le fichier d'origine est servi
+        self.assertEqual(StockageStatiqueCompresse().url('css/style.css'), '/static/css/style.css')
+
+
+class MesurePerformancesTests(SimpleTestCase):
+    def test_centiles(self):
+        valeurs = list(range(101))
+        self.assertEqual((centile(valeurs, 50), centile(valeurs, 95), centile(valeurs, 99)), (50, 95, 99))
+        self.assertEqual(centile([10, 20], 50), 15)
+        self.assertIsNone(centile([], 50))
+
+    def test_peuplement(self):
+        client = creer_client(BaseLocale())
+        donnees = peupler(client, 50, nombre_lecteurs=2, nombre_favoris=5, nombre_rdv=3)
+        self.assertEqual(len(donnees['livres']), 50)
+        compter = lambda table: client.table(table).select('id', count='exact').execute().count
+        self.assertEqual((compter('auteurs'), compter('favoris'), compter('rendezvous')), (100, 10, 6))
+        bibliothecaires = client.table('profiles').select('email').eq('is_librarian', True).execute().data
+        self.assertEqual(bibliothecaires, [{'email': 'bibliothecaire@mesure.local'}])
+
+    def test_mesure_d_une_vue(self):
+        class FauxClient:
+            def get(self, url):
+                reponse = HttpResponse('ok')
+                reponse['Server-Timing'] = 'supabase;dur=1.5;desc="2 appels", total;dur=3.0'
+                return reponse
+        mesures = mesurer(FauxClient(), ['/catalogue/'], 5)
+        self.assertEqual(mesures['statuts'], {'200': 5})
+        self.assertEqual(mesures['appels_supabase'], 2)
+        self.assertLessEqual(mesures['p50_ms'], mesures['p99_ms'])
+
+
+class ImportCatalogueTests(SimpleTestCase):
+    def setUp(self):
+        self.client_supabase = creer_client(BaseLocale())
+        self.client_supabase.table('auteurs').insert({'nom': 'Ayache', 'prenom': 'Germain'}).execute()
+
+    def importer(self, contenu, taille_lot=2):
+        with tempfile.TemporaryDirectory() as dossier:
+            chemin = os.path.join(dossier, 'livres.csv')
+            with open(chemin, 'w', encoding='utf-8') as fichier:
+                fichier.write(contenu)
+            importateur = Importateur(self.client_supabase, taille_lot)
+            for numero, ligne in lire_csv(chemin):
+                importateur.ajouter(numero, ligne)
+            importateur.terminer()
+        return importateur
+
+    def lire(self, table, colonnes='*'):
+        return self.client_supabase.table(table).select(colonnes).order('numero_inventaire' if table == 'livres' else 'nom').execute().data
+
+    def test_import_par_lots_avec_auteurs_dedoublonnes(self):
+        importateur = self.importer(
+            "Titre;Auteur;Catégorie;Inventaire;Année\n"
+            "Histoire du Maroc;Ayache, Germain;Histoire;INV-1;1956\n"
+            "Histoire économique;GERMAIN AYACHE;histoire;INV-2;01/05/1961\n"
+            "L'Aventurier;Laroui, Fouad;Roman;INV-3;2010\n"
+            "Sans date;Laroui, Fouad;Roman;INV-4;\n"
+        )
+        self.assertEqual((importateur.importees, importateur.rejetees, importateur.auteurs_crees), (3, 1, 1))
+        self.assertEqual([a['nom'] for a in self.lire('auteurs', 'nom')], ['Ayache', 'Laroui'])
+        self.assertEqual(len(self.lire('categories')), 2)
+        livres = self.lire('livres', 'numero_inventaire, date_publication, auteurs(nom)')
+        self.assertEqual(livres[1], {'numero_inventaire': 'INV-2', 'date_publication': '1961-05-01', 'auteurs': {'nom': 'Ayache'}})
+
+    def test_reimport_met_a_jour_sur_numero_inventaire(self):
+        self.importer("titre,numero_inventaire,date_publication\nPremière édition,INV-1,1956\n")
+        self.importer("titre,numero_inventaire,date_publication\nSeconde édition,INV-1,1960\nSeconde édition bis,INV-1,1961\n")
+        self.assertEqual(self.lire('livres', 'titre, date_publication'), [{'titre': 'Seconde édition bis', 'date_publication': '1961-01-01'}])
+
+    def test_reimport_sans_effacer_les_colonnes_absentes(self):
+        self.importer("titre,numero_inventaire,date_publication,description\nHistoire du Maroc,INV-1,1956,Synthèse\n")
+        importateur = self.importer(
+            "titre,numero_inventaire,date_publication,description\n"
+            "Histoire du Maroc (2e éd.),INV-1,1960,\nNouveau,INV-2,2001,Inédit\n"
+        )
+        self.assertEqual((importateur.importees, importateur.rejetees), (2, 0))
+        self.assertEqual(self.lire('livres', 'numero_inventaire, titre, description'), [
+            {'numero_inventaire': 'INV-1', 'titre': 'Histoire du Maroc (2e éd.)', 'description': 'Synthèse'},
+            {'numero_inventaire': 'INV-2', 'titre': 'Nouveau', 'description': 'Inédit'},
+        ])
+
+    def test_lignes_jsonl_illisibles_rejetees(self):
+        version = lire_version_import()
+        sortie = io.StringIO()
+        with tempfile.TemporaryDirectory() as dossier:
+            chemin = os.path.join(dossier, 'livres.jsonl')
+            with open(chemin, 'w', encoding='utf-8') as fichier:
+                fichier.write(
+                    '{"titre": "Histoire du Maroc", "inventaire": "INV-1", "annee": 1956}\n'
+                    '{"titre": "Tronquée", "inventaire"\n'
+                    '["pas", "un", "objet"]\n'
+                    '{"titre": "Nouveau", "inventaire": "INV-2", "annee": 2001}\n'
+                )
+            with mock.patch('bibliotheque.management.commands.importer_catalogue.get_supabase_client',
+                            return_value=self.client_supabase):
+                call_command('importer_catalogue', chemin, stdout=sortie)
+        self.assertIn('livres.jsonl:2: JSON illisible', sortie.getvalue())
+        self.assertIn('livres.jsonl:3: objet attendu, list trouvé', sortie.getvalue())
+        self.assertIn('2 livres', sortie.getvalue())
+        self.assertIn('2 lignes rejetées', sortie.getvalue())
+        self.assertEqual([l['numero_inventaire'] for l in self.lire('livres', 'numero_inventaire')], ['INV-1', 'INV-2'])
+        # Les workers du serveur reconstruiront leurs index
+        self.assertEqual(lire_version_import(), version + 1)
+
+    def test_import_interrompu_termine_les_lots_lus(self):
+        version = lire_version_import()
+        with tempfile.TemporaryDirectory() as dossier:
+            chemin = os.path.join(dossier, 'livres.csv')
+            with open(chemin, 'wb') as fichier:
+                fichier.write(b'titre,numero_inventaire,date_publication\n')
+                fichier.write(b''.join(f'Livre {i},INV-{i:04},2001\n'.encode() for i in range(1000)))
+                # Octet invalide en UTF-8, bien après le premier bloc décodé
+                fichier.write(b'Fin \xe9,INV-X,2001\n')
+            with mock.patch('bibliotheque.management.commands.importer_catalogue.get_supabase_client',
+                            return_value=self.client_supabase):
+                with self.assertRaisesMessage(CommandError, 'interrompue'):
+                    call_command('importer_catalogue', chemin, '--lot', '300', stdout=io.StringIO())
+        # Le lot partiel lu avant l'erreur est aussi envoyé ; cache et index invalidés
+        self.assertGreater(len(self.lire('livres', 'numero_inventaire')), 600)
+        self.assertEqual(lire_version_import(), version + 1)
+
+
+class ExportsTests(SimpleTestCase):
+    def setUp(self):
+        self.service = SupabaseService.__new__(SupabaseService)
+        self.service.client = self.service.admin_client = creer_client(BaseLocale())
+        auteur = self.service.create_auteur({'nom': 'Laroui', 'prenom': 'Fouad'})
+        self.service.client.table('livres').insert([
+            {'titre': f'Livre, "{i}"', 'auteur_id': auteur['id'], 'numero_inventaire': f'INV-{i}', 'date_publication': '2001-01-01'}
+            for i in range(25)
+        ]).execute()
+
+    def test_parcours_par_cles(self):
+        livres = list(self.service.parcourir_livres(taille=10))
+        self.assertEqual(len({livre['id'] for livre in livres}), 25)
+        self.assertEqual(livres[0]['auteur']['nom'], 'Laroui')
+
+    def test_csv_compresse_au_fil_de_l_eau(self):
+        lignes = (ligne_livre(livre) for livre in self.service.parcourir_livres(taille=10))
+        texte = gzip.decompress(b''.join(morceaux_export(lignes, COLONNES_LIVRES, 'csv', gzip=True))).decode('utf-8-sig')
+        lignes = list(csv.DictReader(io.StringIO(texte)))
+        self.assertEqual(len(lignes), 25)
+        self.assertEqual(lignes[0]['auteur'], 'Fouad Laroui')
+        self.assertTrue(lignes[0]['titre'].startswith('Livre, "'))
+
+    def test_vue_en_flux_reservee_aux_bibliothecaires(self):
+        requete = RequestFactory().get('/bibliotheque/export/livres.jsonl')
+        requete.session = {'utilisateur_id': 'u1', 'utilisateur_roles': 0}
+        self.assertEqual(exporter_livres(requete, 'jsonl').status_code, 403)
+
+        # L'utilisateur est construit une fois par requête : nouvelle requête, nouveaux rôles
+        requete = RequestFactory().get('/bibliotheque/export/livres.jsonl')
+        requete.session = {'utilisateur_id': 'u1', 'utilisateur_roles': ROLES['is_librarian']}
+        with mock.patch('bibliotheque.views.SupabaseService', return_value=self.service):
+            reponse = exporter_livres(requete, 'jsonl')
+            self.assertTrue(reponse.streaming)
+            lignes = b''.join(reponse.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(len(lignes), 25)
+        self.assertIn('attachment; filename="livres-', reponse['Content-Disposition'])
+        self.assertEqual(reponse['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        with self.assertRaises(Http404):
+            exporter_livres(requete, 'xlsx')
@@ -1,11 +1,15 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, views_async
+
+# En ASGI, les vues les plus fréquentées existent en version asynchrone
+vues = views_async if getattr(settings, 'VUES_ASYNC', False) else views
 
 urlpatterns = [
-    path('catalogue/', views.home, name='catalogue'),
+    path('catalogue/', vues.home, name='catalogue'),
     path('presentation/', views.presentation_bibliotheque, name='presentation_bibliotheque'),
-    path('categorie/<str:categorie_id>/', views.details_categorie, name='details_categorie'),
-    path('categorie/<str:categorie_id>/livre/<str:livre_id>/', views.detail_livre, name='detail_livre'),
+    path('categorie/<str:categorie_id>/', vues.details_categorie, name='details_categorie'),
+    path('categorie/<str:categorie_id>/livre/<str:livre_id>/', vues.detail_livre, name='detail_livre'),
     path('categorie/<str:categorie_id>/livre/<str:livre_id>/connexion/', views.demander_connexion_detail, name='demander_connexion_detail'),
     path('ajouter-favori/<str:livre_id>/', views.ajouter_favori, name='ajouter_favori'),
     path('supprimer-favori/<str:livre_id>/', views.supprimer_favori, name='supprimer_favori'),
@@ -15,8 +19,11 @@ urlpatterns = [
     path('ajouter-livre/<str:categorie_id>/', views.ajouter_livre, name='ajouter_livre'),
     path('modifier-livre/<str:livre_id>/', views.modifier_livre, name='modifier_livre'),
     path('supprimer-livre/<str:livre_id>/', views.supprimer_livre, name='supprimer_livre'),
-    path('mes-favoris/', views.mes_favoris, name='mes_favoris'),
+    path('mes-favoris/', vues.mes_favoris, name='mes_favoris'),
     path('recherche/', views.recherche, name='recherche'),
-    path('recherche-suggestions/', views.recherche_suggestions, name='recherche_suggestions'),
+    path('recherche-suggestions/', vues.recherche_suggestions, name='recherche_suggestions'),
     path('autocomplete/', views.autocomplete, name='autocomplete'),
+    path('image/', views.image_redimensionnee, name='image_redimensionnee'),
+    path('export/livres.<str:format_export>', views.exporter_livres, name='exporter_livres'),
+    path('export/rendez-vous.<str:format_export>', views.exporter_rendez_vous, name='exporter_rendez_vous'),
 ]
\ No newline at end of file
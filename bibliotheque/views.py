@@ -1,11 +1,18 @@
 from django.shortcuts import render, redirect
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import FileResponse, Http404, HttpResponseBadRequest, HttpResponseNotModified, JsonResponse
 from django.urls import reverse
-from django.views.decorators.http import require_POST
-from comptes.supabase_service import SupabaseService
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import require_GET, require_POST
+from comptes.supabase_service import SupabaseService, TAILLE_PAGE
 from comptes.middleware import login_requis, permission_requise
+from comptes.session import roles_session
 from .forms import CategorieForm, LivreForm
+from .autocompletion import get_autocompletion
+from .couvertures import enregistrer_couverture
+from .exports import COLONNES_LIVRES, COLONNES_RENDEZ_VOUS, FORMATS, ligne_livre, ligne_rendez_vous, reponse_export
+from .images import DUREE_DISTANTES, TYPES_CONTENU, SourceInvalide, choisir_format, est_distante, obtenir_derive
+from .index_recherche import get_index
 
 def home(request):
     """
@@ -15,18 +22,13 @@ def home(request):
         # Utiliser Supabase pour récupérer les données
         supabase_service = SupabaseService()
         
-        # Récupérer les catégories depuis Supabase
-        list_categories = supabase_service.get_all_categories()
+        # Récupérer les catégories et leurs livres en une seule requête
+        catalogue = supabase_service.get_catalogue()
+        list_categories = catalogue['categories']
         categories_existent = len(list_categories) > 0
         
-        # Pour chaque catégorie, récupérer ses livres
-        for categorie in list_categories:
-            livres_categorie = supabase_service.get_livres_by_categorie(categorie['id'])
-            categorie['livres'] = livres_categorie
-            categorie['nombre_livres'] = len(livres_categorie)
-        
-        # Récupérer tous les livres pour les statistiques
-        list_livres = supabase_service.get_all_livres()
+        # Les statistiques sont calculées à partir des mêmes données
+        list_livres = catalogue['livres']
         livres_existent = len(list_livres) > 0
         
     except Exception as e:
@@ -69,8 +71,10 @@ def details_categorie(request, categorie_id):
             messages.error(request, "Catégorie non trouvée.")
             return redirect('accueil')
         
-        # Récupérer les livres de cette catégorie
-        livres = supabase_service.get_livres_by_categorie(categorie_id)
+        # Récupérer une page de livres de cette catégorie
+        page = supabase_service.get_livres_page(categorie_id=categorie_id, curseur=request.GET.get('curseur'))
+        livres = page['livres']
+        curseur_suivant = page['curseur_suivant']
         livres_existent = len(livres) > 0
         
     except Exception as e:
@@ -88,7 +92,9 @@ def details_categorie(request, categorie_id):
         "categorie": categorie,
         "livres": livres,
         "est_bibliothecaire": est_bibliothecaire,
-        "livres_existent": livres_existent
+        "livres_existent": livres_existent,
+        "curseur_suivant": curseur_suivant,
+        "page_suivante": bool(request.GET.get('curseur')),
     })
 
 def demander_connexion_detail(request, categorie_id, livre_id):
@@ -102,7 +108,7 @@ def detail_livre(request, categorie_id, livre_id):
     """Vue pour afficher les détails d'un livre"""
     
     # Vérification de l'authentification
-    if not request.session.get('utilisateur_profile'):
+    if not request.session.get('utilisateur_id'):
         return demander_connexion_detail(request, categorie_id, livre_id)
     
     try:
@@ -125,8 +131,7 @@ def detail_livre(request, categorie_id, livre_id):
         est_favori = False
         if user_id:
             try:
-                favoris = supabase_service.get_favoris_utilisateur(user_id)
-                est_favori = any(f['livre_id'] == livre_id for f in favoris)
+                est_favori = supabase_service.is_favori(user_id, livre_id)
             except Exception as e:
                 print(f"Erreur lors de la vérification des favoris: {e}")
         
@@ -151,7 +156,7 @@ def detail_livre(request, categorie_id, livre_id):
 @require_POST
 def ajouter_favori(request, livre_id):
     """Vue pour ajouter un livre aux favoris"""
-    if not request.session.get('utilisateur_profile'):
+    if not request.session.get('utilisateur_id'):
         if request.headers.get('x-requested-with') == 'XMLHttpRequest':
             return JsonResponse({'success': False, 'message': 'Vous devez être connecté pour ajouter des favoris.'})
         try:
@@ -184,36 +189,25 @@ def ajouter_favori(request, livre_id):
                 print("Livre non trouvé.")
             return redirect('accueil')
         
-        # Vérifier si le livre est déjà en favori
-        favoris = supabase_service.get_favoris_utilisateur(user_id)
-        est_deja_favori = any(f['livre_id'] == livre_id for f in favoris)
+        # Ajouter le livre aux favoris : l'upsert ignore un favori déjà présent, sans
+        # vérification préalable sur un ensemble en cache qui peut être périmé
+        result = supabase_service.ajouter_favori(user_id, livre_id)
         
-        if est_deja_favori:
+        if result:
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                return JsonResponse({'success': False, 'message': 'Livre déjà dans les favoris'})
+                return JsonResponse({'success': True, 'message': 'Ajouté'})
             try:
-                messages.info(request, "Livre déjà dans les favoris")
+                messages.success(request, "Livre ajouté aux favoris !")
             except:
-                print("Livre déjà dans les favoris")
+                print("Livre ajouté aux favoris !")
         else:
-            # Ajouter le livre aux favoris
-            result = supabase_service.ajouter_favori(user_id, livre_id)
-            
-            if result:
-                if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                    return JsonResponse({'success': True, 'message': 'Ajouté'})
-                try:
-                    messages.success(request, "Livre ajouté aux favoris !")
-                except:
-                    print("Livre ajouté aux favoris !")
-            else:
-                if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                    return JsonResponse({'success': False, 'message': 'Erreur lors de l\'ajout aux favoris.'})
-                try:
-                    messages.error(request, "Erreur lors de l'ajout aux favoris.")
-                except:
-                    print("Erreur lors de l'ajout aux favoris.")
-            
+            if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+                return JsonResponse({'success': False, 'message': 'Erreur lors de l\'ajout aux favoris.'})
+            try:
+                messages.error(request, "Erreur lors de l'ajout aux favoris.")
+            except:
+                print("Erreur lors de l'ajout aux favoris.")
+        
     except Exception as e:
         print(f"Erreur lors de l'ajout aux favoris: {e}")
         if request.headers.get('x-requested-with') == 'XMLHttpRequest':
@@ -229,7 +223,7 @@ def ajouter_favori(request, livre_id):
 @require_POST
 def supprimer_favori(request, livre_id):
     """Vue pour supprimer un livre des favoris"""
-    if not request.session.get('utilisateur_profile'):
+    if not request.session.get('utilisateur_id'):
         if request.headers.get('x-requested-with') == 'XMLHttpRequest':
             return JsonResponse({'success': False, 'message': 'Vous devez être connecté pour gérer vos favoris.'})
         try:
@@ -262,36 +256,25 @@ def supprimer_favori(request, livre_id):
                 print("Livre non trouvé.")
             return redirect('accueil')
         
-        # Vérifier si le livre est en favori
-        favoris = supabase_service.get_favoris_utilisateur(user_id)
-        est_en_favori = any(f['livre_id'] == livre_id for f in favoris)
+        # Supprimer le livre des favoris : sans effet s'il n'y est pas, sans vérification
+        # préalable sur un ensemble en cache qui peut être périmé
+        result = supabase_service.supprimer_favori(user_id, livre_id)
         
-        if not est_en_favori:
+        if result:
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                return JsonResponse({'success': False, 'message': 'Livre non présent dans les favoris'})
+                return JsonResponse({'success': True, 'message': 'Supprimé'})
             try:
-                messages.info(request, "Livre non présent dans les favoris")
+                messages.success(request, "Livre supprimé des favoris !")
             except:
-                print("Livre non présent dans les favoris")
+                print("Livre supprimé des favoris !")
         else:
-            # Supprimer le livre des favoris
-            result = supabase_service.supprimer_favori(user_id, livre_id)
-            
-            if result:
-                if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                    return JsonResponse({'success': True, 'message': 'Supprimé'})
-                try:
-                    messages.success(request, "Livre supprimé des favoris !")
-                except:
-                    print("Livre supprimé des favoris !")
-            else:
-                if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                    return JsonResponse({'success': False, 'message': 'Erreur lors de la suppression des favoris.'})
-                try:
-                    messages.error(request, "Erreur lors de la suppression des favoris.")
-                except:
-                    print("Erreur lors de la suppression des favoris.")
-            
+            if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+                return JsonResponse({'success': False, 'message': 'Erreur lors de la suppression des favoris.'})
+            try:
+                messages.error(request, "Erreur lors de la suppression des favoris.")
+            except:
+                print("Erreur lors de la suppression des favoris.")
+        
     except Exception as e:
         print(f"Erreur lors de la suppression des favoris: {e}")
         if request.headers.get('x-requested-with') == 'XMLHttpRequest':
@@ -306,12 +289,12 @@ def supprimer_favori(request, livre_id):
 
 def ajouter_categorie(request):
     """Vue pour ajouter une catégorie"""
-    if not request.session.get('utilisateur_profile'):
+    if not request.session.get('utilisateur_id'):
         messages.warning(request, "Vous devez être connecté pour ajouter une catégorie.")
         return redirect('connexion')
     
     # Vérifier si l'utilisateur est bibliothécaire
-    profile = request.session.get('utilisateur_profile', {})
+    profile = roles_session(request.session)
     if not profile.get('is_librarian', False):
         messages.error(request, "Vous n'avez pas les droits pour ajouter une catégorie.")
         return redirect('accueil')
@@ -359,12 +342,12 @@ def ajouter_categorie(request):
 
 def modifier_categorie(request, categorie_id):
     """Vue pour modifier une catégorie"""
-    if not request.session.get('utilisateur_profile'):
+    if not request.session.get('utilisateur_id'):
         messages.warning(request, "Vous devez être connecté pour modifier une catégorie.")
         return redirect('connexion')
     
     # Vérifier si l'utilisateur est bibliothécaire
-    profile = request.session.get('utilisateur_profile', {})
+    profile = roles_session(request.session)
     if not profile.get('is_librarian', False):
         messages.error(request, "Vous n'avez pas les droits pour modifier une catégorie.")
         return redirect('accueil')
@@ -434,12 +417,12 @@ def modifier_categorie(request, categorie_id):
 
 def supprimer_categorie(request, categorie_id):
     """Vue pour supprimer une catégorie"""
-    if not request.session.get('utilisateur_profile'):
+    if not request.session.get('utilisateur_id'):
         messages.warning(request, "Vous devez être connecté pour supprimer une catégorie.")
         return redirect('connexion')
     
     # Vérifier si l'utilisateur est bibliothécaire
-    profile = request.session.get('utilisateur_profile', {})
+    profile = roles_session(request.session)
     if not profile.get('is_librarian', False):
         messages.error(request, "Vous n'avez pas les droits pour supprimer une catégorie.")
         return redirect('accueil')
@@ -476,7 +459,7 @@ def supprimer_categorie(request, categorie_id):
 
 def ajouter_livre(request, categorie_id):
     """Vue pour ajouter un livre"""
-    if not request.session.get('utilisateur_profile'):
+    if not request.session.get('utilisateur_id'):
         try:
             messages.warning(request, "Vous devez être connecté pour ajouter un livre.")
         except:
@@ -484,7 +467,7 @@ def ajouter_livre(request, categorie_id):
         return redirect('connexion')
     
     # Vérifier si l'utilisateur est bibliothécaire
-    profile = request.session.get('utilisateur_profile', {})
+    profile = roles_session(request.session)
     if not profile.get('is_librarian', False):
         try:
             messages.error(request, "Vous n'avez pas les droits pour ajouter un livre.")
@@ -540,11 +523,9 @@ def ajouter_livre(request, categorie_id):
                         'date_publication': form.cleaned_data['date_publication'].strftime('%Y-%m-%d'),
                     }
                     
-                    # Gérer l'image si elle est fournie
+                    # Gérer l'image si elle est fournie : stockée une seule fois, avec ses miniatures
                     if form.cleaned_data.get('image'):
-                        # Ici, vous devriez uploader l'image vers Supabase Storage
-                        # Pour l'instant, on stocke juste le nom du fichier
-                        livre_data['image'] = form.cleaned_data['image'].name
+                        livre_data['image'] = enregistrer_couverture(form.cleaned_data['image'])
                     
                     # Créer le livre
                     result = supabase_service.create_livre(livre_data)
@@ -585,12 +566,12 @@ def ajouter_livre(request, categorie_id):
 
 def modifier_livre(request, livre_id):
     """Vue pour modifier un livre (placeholder)"""
-    if not request.session.get('utilisateur_profile'):
+    if not request.session.get('utilisateur_id'):
         messages.warning(request, "Vous devez être connecté pour modifier un livre.")
         return redirect('connexion')
     
     # Vérifier si l'utilisateur est bibliothécaire
-    profile = request.session.get('utilisateur_profile', {})
+    profile = roles_session(request.session)
     if not profile.get('is_librarian', False):
         messages.error(request, "Vous n'avez pas les droits pour modifier un livre.")
         return redirect('accueil')
@@ -600,7 +581,7 @@ def modifier_livre(request, livre_id):
 
 def supprimer_livre(request, livre_id):
     """Vue pour supprimer un livre"""
-    if not request.session.get('utilisateur_profile'):
+    if not request.session.get('utilisateur_id'):
         try:
             messages.warning(request, "Vous devez être connecté pour supprimer un livre.")
         except:
@@ -608,7 +589,7 @@ def supprimer_livre(request, livre_id):
         return redirect('connexion')
     
     # Vérifier si l'utilisateur est bibliothécaire
-    profile = request.session.get('utilisateur_profile', {})
+    profile = roles_session(request.session)
     if not profile.get('is_librarian', False):
         try:
             messages.error(request, "Vous n'avez pas les droits pour supprimer un livre.")
@@ -662,7 +643,7 @@ def supprimer_livre(request, livre_id):
 
 def mes_favoris(request):
     """Vue pour afficher les favoris de l'utilisateur"""
-    if not request.session.get('utilisateur_profile'):
+    if not request.session.get('utilisateur_id'):
         try:
             messages.warning(request, "Vous devez être connecté pour voir vos favoris.")
         except:
@@ -680,15 +661,8 @@ def mes_favoris(request):
                 print("Erreur d'authentification.")
             return redirect('connexion')
         
-        # Récupérer les favoris de l'utilisateur
-        favoris = supabase_service.get_favoris_utilisateur(user_id)
-        
-        # Récupérer les détails complets des livres favoris
-        livres_favoris = []
-        for favori in favoris:
-            livre = supabase_service.get_livre_by_id(favori['livre_id'])
-            if livre:
-                livres_favoris.append(livre)
+        # Récupérer les livres favoris avec leurs auteurs et catégories
+        livres_favoris = supabase_service.get_livres_favoris(user_id)
         
         return render(request, 'mes_favoris.html', {
             'livres_favoris': livres_favoris
@@ -702,14 +676,38 @@ def mes_favoris(request):
             print("Erreur lors du chargement de vos favoris.")
         return redirect('accueil')
 
+def position_curseur(curseur):
+    """Position de la page dans une liste de résultats classés"""
+    return int(curseur) if curseur and curseur.isdigit() else 0
+
+def paginer_resultats(resultats, curseur, taille=TAILLE_PAGE, total=None):
+    """Découpe une liste de résultats classés ; total : nombre de résultats si la liste n'en contient que le début"""
+    debut = position_curseur(curseur)
+    fin = debut + taille
+    total = len(resultats) if total is None else total
+    curseur_suivant = str(fin) if fin < total else None
+    return resultats[debut:fin], curseur_suivant
+
 def recherche(request):
     """Vue pour la recherche de livres"""
     query = request.GET.get('q', '').strip()
+    curseur_suivant = None
+    total = None
     
     if query and len(query) >= 2:  # Minimum 2 caractères pour la recherche
         try:
-            supabase_service = SupabaseService()
-            resultats = supabase_service.search_livres(query)
+            index = get_index()
+            if index is not None:
+                # Recherche dans l'index local, paginée par position : seuls les résultats
+                # jusqu'à la fin de la page sont classés, le total est compté
+                curseur = request.GET.get('curseur')
+                livres, total = index.rechercher_avec_total(query, limite=position_curseur(curseur) + TAILLE_PAGE)
+                resultats, curseur_suivant = paginer_resultats(livres, curseur, total=total)
+            else:
+                supabase_service = SupabaseService()
+                page = supabase_service.get_livres_page(query=query, curseur=request.GET.get('curseur'))
+                resultats = page['livres']
+                curseur_suivant = page['curseur_suivant']
             
             # Log de la recherche pour le débogage
             print(f"Recherche pour '{query}': {len(resultats)} résultats trouvés")
@@ -733,7 +731,11 @@ def recherche(request):
     return render(request, 'recherche_resultats.html', {
         'livres': resultats,
         'query': query,
-        'nombre_resultats': len(resultats)
+        # Total exact depuis l'index ; sinon taille de la page (« 24+ » s'il y a une suite)
+        'nombre_resultats': len(resultats) if total is None else total,
+        'total_exact': total is not None,
+        'curseur_suivant': curseur_suivant,
+        'page_suivante': bool(request.GET.get('curseur')),
     })
 
 def recherche_suggestions(request):
@@ -743,6 +745,11 @@ def recherche_suggestions(request):
 
     if query and len(query) >= 2:  # Minimum 2 caractères pour les suggestions
         try:
+            # Suggestions servies depuis la mémoire, sans requête Supabase
+            autocompletion = get_autocompletion()
+            if autocompletion is not None:
+                return JsonResponse(autocompletion.suggerer(query, limite=10), safe=False)
+            
             supabase_service = SupabaseService()
             
             # Recherche dans les titres de livres
@@ -780,11 +787,13 @@ def autocomplete(request):
         
         if term and len(term) >= 2:
             try:
-                supabase_service = SupabaseService()
-                
-                # Recherche dans les titres de livres
-                livres = supabase_service.search_livres(term)
-                suggestions = [livre['titre'] for livre in livres[:10]]
+                # Titres servis depuis la mémoire, sans requête Supabase
+                autocompletion = get_autocompletion()
+                if autocompletion is not None:
+                    suggestions = autocompletion.suggerer(term, limite=10, types={'livre'})
+                else:
+                    livres = SupabaseService().search_livres(term)
+                    suggestions = [livre['titre'] for livre in livres[:10]]
                 
             except Exception as e:
                 print(f"Erreur lors de l'autocomplétion: {e}")
@@ -792,4 +801,54 @@ def autocomplete(request):
         
         return JsonResponse(suggestions, safe=False)
     
-    return JsonResponse([], safe=False)
\ No newline at end of file
+    return JsonResponse([], safe=False)
+
+@require_GET
+def image_redimensionnee(request):
+    """Sert une image redimensionnée au format accepté par le navigateur"""
+    source = request.GET.get('source', '')
+    try:
+        largeur = int(request.GET.get('l', 480))
+    except ValueError:
+        return HttpResponseBadRequest("Largeur invalide")
+    
+    format_demande = request.GET.get('format')
+    format_sortie = choisir_format(request.headers.get('Accept'), format_demande)
+    try:
+        fichier, type_contenu, cle = obtenir_derive(source, largeur, format_sortie)
+    except SourceInvalide as e:
+        print(f"Image refusée ou illisible: {e}")
+        raise Http404("Image introuvable")
+    
+    # La clé dépend de la source, de la largeur et du format : elle sert d'ETag
+    etag = f'"{cle}"'
+    if request.headers.get('If-None-Match') == etag:
+        fichier.close()
+        reponse = HttpResponseNotModified()
+    else:
+        reponse = FileResponse(fichier, content_type=type_contenu)
+    reponse['ETag'] = etag
+    if est_distante(source):
+        # Une image distante peut changer sous la même URL : cache borné
+        reponse['Cache-Control'] = f'public, max-age={DUREE_DISTANTES}'
+    else:
+        reponse['Cache-Control'] = 'public, max-age=31536000, immutable'
+    if format_demande not in TYPES_CONTENU:
+        patch_vary_headers(reponse, ['Accept'])
+    return reponse
+
+@permission_requise('bibliothecaire')
+def exporter_livres(request, format_export):
+    """Export du catalogue en flux (CSV ou JSONL ; ?gzip=1 pour un fichier compressé)"""
+    if format_export not in FORMATS:
+        raise Http404("Format d'export inconnu")
+    livres = (ligne_livre(livre) for livre in SupabaseService().parcourir_livres())
+    return reponse_export(livres, COLONNES_LIVRES, 'livres', format_export, request.GET.get('gzip') == '1')
+
+@permission_requise('bibliothecaire')
+def exporter_rendez_vous(request, format_export):
+    """Export des rendez-vous en flux (CSV ou JSONL ; ?gzip=1 pour un fichier compressé)"""
+    if format_export not in FORMATS:
+        raise Http404("Format d'export inconnu")
+    rendez_vous = (ligne_rendez_vous(rdv) for rdv in SupabaseService().parcourir_rendez_vous())
+    return reponse_export(rendez_vous, COLONNES_RENDEZ_VOUS, 'rendez-vous', format_export, request.GET.get('gzip') == '1')
@@ -0,0 +1,182 @@
+"""
+Versions asynchrones des vues les plus fréquentées, activées par VUES_ASYNC
+lorsque le projet est servi en ASGI (voir bibliotheque/urls.py).
+
+Elles rendent les mêmes templates que les vues de views.py, mais lancent les
+lectures Supabase indépendantes en parallèle avec AsyncSupabaseService. Le
+rendu (processeurs de contexte, session) et les lectures de session restent
+synchrones : ils sont faits hors de la boucle d'événements. Les middlewares
+du projet (comptes/middleware.py) acceptent les deux modes, la chaîne reste
+donc asynchrone jusqu'à ces vues.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.http import JsonResponse
+from django.shortcuts import redirect, render
+
+from comptes.supabase_service_async import AsyncSupabaseService
+from .autocompletion import get_autocompletion
+from .views import demander_connexion_detail
+
+
+async def _rendre(request, template, contexte):
+    """render() dans un thread : les processeurs de contexte lisent la session et Supabase"""
+    return await sync_to_async(render)(request, template, contexte)
+
+
+def _est_bibliothecaire(request):
+    if hasattr(request, 'utilisateur') and request.utilisateur:
+        return request.utilisateur.est_bibliothecaire
+    return False
+
+
+async def home(request):
+    """
+    Vue d'accueil utilisant Supabase
+    """
+    try:
+        catalogue = await AsyncSupabaseService().get_catalogue()
+        list_categories = catalogue['categories']
+        list_livres = catalogue['livres']
+    except Exception as e:
+        print(f"Erreur lors de la récupération des données: {e}")
+        list_categories = []
+        list_livres = []
+
+    return await _rendre(request, "index.html", {
+        "list_categories": list_categories,
+        "list_livres": list_livres,
+        "est_bibliothecaire": _est_bibliothecaire(request),
+        "categories_existent": len(list_categories) > 0,
+        "livres_existent": len(list_livres) > 0
+    })
+
+
+async def details_categorie(request, categorie_id):
+    try:
+        supabase_service = AsyncSupabaseService()
+
+        # La catégorie et la page de livres sont récupérées en parallèle
+        categorie, page = await asyncio.gather(
+            supabase_service.get_categorie_by_id(categorie_id),
+            supabase_service.get_livres_page(categorie_id=categorie_id, curseur=request.GET.get('curseur')),
+        )
+
+        if not categorie:
+            messages.error(request, "Catégorie non trouvée.")
+            return redirect('accueil')
+
+    except Exception as e:
+        print(f"Erreur lors de la récupération des données: {e}")
+        messages.error(request, "Erreur lors du chargement de la catégorie.")
+        return redirect('accueil')
+
+    return await _rendre(request, "details.html", {
+        "categorie": categorie,
+        "livres": page['livres'],
+        "est_bibliothecaire": _est_bibliothecaire(request),
+        "livres_existent": len(page['livres']) > 0,
+        "curseur_suivant": page['curseur_suivant'],
+        "page_suivante": bool(request.GET.get('curseur')),
+    })
+
+
+async def detail_livre(request, categorie_id, livre_id):
+    """Vue pour afficher les détails d'un livre"""
+
+    if not await request.session.aget('utilisateur_id'):
+        return demander_connexion_detail(request, categorie_id, livre_id)
+
+    try:
+        supabase_service = AsyncSupabaseService()
+        user_id = await request.session.aget('utilisateur_id')
+
+        # Livre, catégorie et favoris sont indépendants : une seule attente pour les trois
+        livre, categorie, favoris_ids = await asyncio.gather(
+            supabase_service.get_livre_by_id(livre_id),
+            supabase_service.get_categorie_by_id(categorie_id),
+            supabase_service.get_favoris_ids(user_id) if user_id else asyncio.sleep(0, set()),
+        )
+
+        if not livre:
+            messages.error(request, "Livre non trouvé.")
+            return redirect('details_categorie', categorie_id=categorie_id)
+
+        if not categorie:
+            messages.error(request, "Catégorie non trouvée.")
+            return redirect('accueil')
+
+    except Exception as e:
+        print(f"Erreur lors de la récupération du livre: {e}")
+        messages.error(request, "Erreur lors du chargement du livre.")
+        return redirect('accueil')
+
+    return await _rendre(request, 'detail_livre.html', {
+        'categorie': categorie,
+        'livre': livre,
+        'est_favori': livre_id in favoris_ids,
+        'est_bibliothecaire': _est_bibliothecaire(request)
+    })
+
+
+async def mes_favoris(request):
+    """Vue pour afficher les favoris de l'utilisateur"""
+    if not await request.session.aget('utilisateur_id'):
+        messages.warning(request, "Vous devez être connecté pour voir vos favoris.")
+        return redirect('connexion')
+
+    user_id = await request.session.aget('utilisateur_id')
+    if not user_id:
+        messages.error(request, "Erreur d'authentification.")
+        return redirect('connexion')
+
+    try:
+        livres_favoris = await AsyncSupabaseService().get_livres_favoris(user_id)
+    except Exception as e:
+        print(f"Erreur lors de la récupération des favoris: {e}")
+        messages.error(request, "Erreur lors du chargement de vos favoris.")
+        return redirect('accueil')
+
+    return await _rendre(request, 'mes_favoris.html', {
+        'livres_favoris': livres_favoris
+    })
+
+
+async def recherche_suggestions(request):
+    """Vue pour les suggestions de recherche en temps réel"""
+    query = request.GET.get('q', '').strip()
+    suggestions = []
+
+    if query and len(query) >= 2:
+        try:
+            # La première construction de l'autocomplétion est synchrone : hors de la boucle
+            autocompletion = await sync_to_async(get_autocompletion)()
+            if autocompletion is not None:
+                return JsonResponse(autocompletion.suggerer(query, limite=10), safe=False)
+
+            supabase_service = AsyncSupabaseService()
+            livres, auteurs, categories = await asyncio.gather(
+                supabase_service.search_livres(query),
+                supabase_service.search_auteurs(query),
+                supabase_service.search_categories(query),
+            )
+
+            titres_livres = [livre['titre'] for livre in livres[:5]]
+            noms_auteurs = []
+            for auteur in auteurs[:5]:
+                nom_complet = f"{auteur.get('prenom', '')} {auteur.get('nom', '')}".strip()
+                if nom_complet:
+                    noms_auteurs.append(nom_complet)
+            noms_categories = [cat['nom'] for cat in categories[:5]]
+
+            suggestions = list(set(
+                titres_livres + noms_auteurs + noms_categories
+            ))[:10]
+
+        except Exception as e:
+            print(f"Erreur lors de la récupération des suggestions: {e}")
+            suggestions = []
+
+    return JsonResponse(suggestions, safe=False)
@@ -0,0 +1,330 @@
+from functools import wraps
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+from bibliotech.metriques import compter_cache
+from bibliotech.sessions import (
+    changer_version_catalogue, changer_version_favoris, changer_version_notifications,
+    lire_version_catalogue, lire_version_favoris, lire_version_notifications, lire_version_profil,
+)
+
+from .chargeur import get_chargeur
+from .signals import catalogue_modifie
+
+# Alias du cache (voir CACHES dans settings.py) : locmem par défaut, partageable (Redis, Memcached...)
+CATALOGUE_CACHE_ALIAS = getattr(settings, 'CATALOGUE_CACHE_ALIAS', 'default')
+
+# Durée de vie (en secondes) des entrées par table
+CATALOGUE_CACHE_TTL = getattr(settings, 'CATALOGUE_CACHE_TTL', {})
+TTL_PAR_DEFAUT = 300
+
+# La génération fait partie de chaque clé : la changer invalide tout le catalogue d'un coup.
+# Elle est gardée dans le fichier partagé de bibliotech.sessions, pas dans le cache : une écriture
+# faite par un worker (ou par une commande de gestion) invalide aussi les copies locmem des autres.
+
+
+def get_cache_catalogue():
+    return caches[CATALOGUE_CACHE_ALIAS]
+
+
+def _generation():
+    generation = lire_version_catalogue()
+    if generation is None:
+        # Sans génération fiable, le cache est contourné plutôt que de servir une entrée périmée
+        raise RuntimeError("génération du catalogue illisible")
+    return generation
+
+
+def _cle(table, nom, args, kwargs, generation):
+    empreinte = hashlib.md5(repr((args, sorted(kwargs.items()))).encode('utf-8')).hexdigest()
+    return f"catalogue:{generation}:{table}:{nom}:{empreinte}"
+
+
+def _est_vide(valeur):
+    if isinstance(valeur, dict):
+        return not any(valeur.values())
+    return not valeur
+
+
+def invalider_catalogue():
+    """Invalide toutes les lectures du catalogue mises en cache"""
+    changer_version_catalogue()
+
+
+def en_cache_catalogue(table):
+    """Met en cache le résultat d'une méthode de lecture, par table et arguments"""
+    def decorator(methode):
+        @wraps(methode)
+        def _wrapped(self, *args, **kwargs):
+            try:
+                cache = get_cache_catalogue()
+                cle = _cle(table, methode.__name__, args, kwargs, _generation())
+                valeur = compter_cache('catalogue', cache.get(cle))
+            except Exception as e:
+                print(f"Erreur lors de la lecture du cache du catalogue: {e}")
+                return methode(self, *args, **kwargs)
+
+            if valeur is not None:
+                return valeur
+
+            valeur = methode(self, *args, **kwargs)
+            # Les résultats vides ne sont pas conservés : ils peuvent provenir d'une erreur
+            if not _est_vide(valeur):
+                try:
+                    cache.set(cle, valeur, CATALOGUE_CACHE_TTL.get(table, TTL_PAR_DEFAUT))
+                except Exception as e:
+                    print(f"Erreur lors de l'écriture dans le cache du catalogue: {e}")
+            return valeur
+        return _wrapped
+    return decorator
+
+
+def en_cache_catalogue_async(table):
+    """Variante de en_cache_catalogue pour les méthodes asynchrones (mêmes clés, même cache)"""
+    def decorator(methode):
+        @wraps(methode)
+        async def _wrapped(self, *args, **kwargs):
+            try:
+                cache = get_cache_catalogue()
+                # Lecture SQLite locale, comme celle des versions de profil
+                cle = _cle(table, methode.__name__, args, kwargs, _generation())
+                valeur = compter_cache('catalogue', await cache.aget(cle))
+            except Exception as e:
+                print(f"Erreur lors de la lecture du cache du catalogue: {e}")
+                return await methode(self, *args, **kwargs)
+
+            if valeur is not None:
+                return valeur
+
+            valeur = await methode(self, *args, **kwargs)
+            if not _est_vide(valeur):
+                try:
+                    await cache.aset(cle, valeur, CATALOGUE_CACHE_TTL.get(table, TTL_PAR_DEFAUT))
+                except Exception as e:
+                    print(f"Erreur lors de l'écriture dans le cache du catalogue: {e}")
+            return valeur
+        return _wrapped
+    return decorator
+
+
+def invalide_catalogue(table, action):
+    """Invalide le cache du catalogue après une écriture réussie et signale la modification"""
+    def decorator(methode):
+        @wraps(methode)
+        def _wrapped(self, *args, **kwargs):
+            resultat = methode(self, *args, **kwargs)
+            if resultat:
+                invalider_catalogue()
+                ligne = resultat if isinstance(resultat, dict) else None
+                identifiant = ligne.get('id') if ligne and action == 'creation' else (args[0] if args else None)
+                # La ligne lue plus tôt dans la requête n'est plus à jour (ni, après une
+                # suppression d'auteur ou de catégorie, les livres passés à NULL)
+                get_chargeur().oublier(table, identifiant)
+                if action == 'suppression' and table != 'livres':
+                    get_chargeur().oublier('livres')
+                try:
+                    catalogue_modifie.send(sender=self.__class__, table=table, action=action,
+                                           identifiant=identifiant, ligne=ligne)
+                except Exception as e:
+                    print(f"Erreur lors de la notification de modification du catalogue: {e}")
+            return resultat
+        return _wrapped
+    return decorator
+
+
+# Cache des profils : une entrée par id, plus un index email -> id
+PROFIL_CACHE_ALIAS = getattr(settings, 'PROFIL_CACHE_ALIAS', 'default')
+PROFIL_CACHE_TTL = getattr(settings, 'PROFIL_CACHE_TTL', 600)
+
+
+def get_cache_profils():
+    return caches[PROFIL_CACHE_ALIAS]
+
+
+def _cle_profil(user_id):
+    # La version (partagée par tous les workers) fait partie de la clé : après un changement de
+    # profil, les copies des autres workers ne sont plus lues
+    return f"profil:id:{user_id}:{lire_version_profil(user_id)}"
+
+
+def _cle_email(email):
+    return f"profil:email:{email.strip().lower()}"
+
+
+def lire_profil(user_id):
+    """Retourne le profil en cache pour cet utilisateur, ou None"""
+    try:
+        return compter_cache('profils', get_cache_profils().get(_cle_profil(user_id)))
+    except Exception as e:
+        print(f"Erreur lors de la lecture du cache des profils: {e}")
+        return None
+
+
+def lire_profil_par_email(email):
+    """Retourne le profil en cache pour cet email, ou None"""
+    try:
+        cache = get_cache_profils()
+        user_id = cache.get(_cle_email(email))
+        return compter_cache('profils', cache.get(_cle_profil(user_id)) if user_id else None)
+    except Exception as e:
+        print(f"Erreur lors de la lecture du cache des profils: {e}")
+        return None
+
+
+def memoriser_profil(profil):
+    """Enregistre un profil sous son id et son email"""
+    if not profil or not profil.get('id'):
+        return
+    try:
+        valeurs = {_cle_profil(profil['id']): profil}
+        if profil.get('email'):
+            valeurs[_cle_email(profil['email'])] = profil['id']
+        get_cache_profils().set_many(valeurs, PROFIL_CACHE_TTL)
+    except Exception as e:
+        print(f"Erreur lors de l'écriture dans le cache des profils: {e}")
+
+
+def oublier_profil(user_id):
+    """Retire un profil du cache (et son entrée email)"""
+    try:
+        cache = get_cache_profils()
+        profil = cache.get(_cle_profil(user_id))
+        cles = [_cle_profil(user_id)]
+        if profil and profil.get('email'):
+            cles.append(_cle_email(profil['email']))
+        cache.delete_many(cles)
+    except Exception as e:
+        print(f"Erreur lors de l'invalidation du cache des profils: {e}")
+
+
+# Id du super administrateur (premier profil inscrit)
+CLE_SUPER_ADMIN = 'profil:super_admin'
+
+
+def lire_super_admin_id():
+    try:
+        return compter_cache('super_admin', get_cache_profils().get(CLE_SUPER_ADMIN))
+    except Exception as e:
+        print(f"Erreur lors de la lecture du cache des profils: {e}")
+        return None
+
+
+def memoriser_super_admin_id(user_id):
+    try:
+        get_cache_profils().set(CLE_SUPER_ADMIN, user_id, PROFIL_CACHE_TTL)
+    except Exception as e:
+        print(f"Erreur lors de l'écriture dans le cache des profils: {e}")
+
+
+def invalider_super_admin():
+    """À appeler quand un profil est créé ou supprimé, ou quand un rôle change"""
+    try:
+        get_cache_profils().delete(CLE_SUPER_ADMIN)
+    except Exception as e:
+        print(f"Erreur lors de l'invalidation du cache des profils: {e}")
+
+
+# Ensemble des IDs de livres favoris de chaque utilisateur. La version des favoris (partagée par
+# tous les workers) fait partie de la clé : après un ajout ou une suppression, les copies des
+# autres workers ne sont plus lues.
+FAVORIS_CACHE_TTL = getattr(settings, 'FAVORIS_CACHE_TTL', 3600)
+
+# Version à relever avant de lire les favoris en base, puis à passer à memoriser_favoris_ids :
+# une écriture faite entre les deux ne laisse pas l'ancien ensemble sous la nouvelle version
+version_favoris = lire_version_favoris
+
+
+def _cle_favoris(user_id, version):
+    if version is None:
+        raise RuntimeError("version des favoris illisible")
+    return f"favoris:{user_id}:{version}"
+
+
+def lire_favoris_ids(user_id):
+    """Retourne l'ensemble des favoris en cache pour cet utilisateur, ou None"""
+    try:
+        cle = _cle_favoris(user_id, lire_version_favoris(user_id))
+        return compter_cache('favoris', get_cache_profils().get(cle))
+    except Exception as e:
+        print(f"Erreur lors de la lecture du cache des favoris: {e}")
+        return None
+
+
+def memoriser_favoris_ids(user_id, livre_ids, version):
+    try:
+        get_cache_profils().set(_cle_favoris(user_id, version), set(livre_ids), FAVORIS_CACHE_TTL)
+    except Exception as e:
+        print(f"Erreur lors de l'écriture dans le cache des favoris: {e}")
+
+
+async def alire_favoris_ids(user_id):
+    try:
+        cle = _cle_favoris(user_id, lire_version_favoris(user_id))
+        return compter_cache('favoris', await get_cache_profils().aget(cle))
+    except Exception as e:
+        print(f"Erreur lors de la lecture du cache des favoris: {e}")
+        return None
+
+
+async def amemoriser_favoris_ids(user_id, livre_ids, version):
+    try:
+        await get_cache_profils().aset(_cle_favoris(user_id, version), set(livre_ids), FAVORIS_CACHE_TTL)
+    except Exception as e:
+        print(f"Erreur lors de l'écriture dans le cache des favoris: {e}")
+
+
+def modifier_favoris_ids(user_id, livre_id, ajoute):
+    """Répercute un ajout ou une suppression : nouvelle version, ensemble reporté s'il était en cache"""
+    livre_ids = lire_favoris_ids(user_id)
+    changer_version_favoris(user_id)
+    if livre_ids is None:
+        return
+    if ajoute:
+        livre_ids.add(livre_id)
+    else:
+        livre_ids.discard(livre_id)
+    memoriser_favoris_ids(user_id, livre_ids, lire_version_favoris(user_id))
+
+
+def oublier_favoris_ids(user_id):
+    """Après une écriture en erreur : plus aucun worker ne lit l'ensemble en cache"""
+    changer_version_favoris(user_id)
+
+
+# Nombre de notifications non lues de chaque utilisateur, tenu à jour à chaque ajout et lecture.
+# La version des notifications (partagée par tous les workers) fait partie de la clé : un worker
+# qui n'a pas vu le changement recompte une fois au lieu de servir un nombre faux. La durée de
+# vie borne l'écart laissé par deux écritures simultanées.
+NOTIFICATIONS_CACHE_TTL = getattr(settings, 'NOTIFICATIONS_CACHE_TTL', 300)
+
+
+def _cle_notifications(user_id, version):
+    return f"notifications:non_lues:{user_id}:{version}"
+
+
+def lire_notifications_non_lues(user_id):
+    """Retourne le nombre de notifications non lues en cache, ou None"""
+    try:
+        cle = _cle_notifications(user_id, lire_version_notifications(user_id))
+        return compter_cache('notifications', get_cache_profils().get(cle))
+    except Exception as e:
+        print(f"Erreur lors de la lecture du cache des notifications: {e}")
+        return None
+
+
+def memoriser_notifications_non_lues(user_id, nombre):
+    try:
+        cle = _cle_notifications(user_id, lire_version_notifications(user_id))
+        get_cache_profils().set(cle, nombre, NOTIFICATIONS_CACHE_TTL)
+    except Exception as e:
+        print(f"Erreur lors de l'écriture dans le cache des notifications: {e}")
+
+
+def modifier_notifications_non_lues(user_id, delta):
+    """Répercute un ajout (+1) ou une lecture (-1) : nouvelle version, compteur reporté s'il était en cache"""
+    nombre = lire_notifications_non_lues(user_id)
+    changer_version_notifications(user_id)
+    if nombre is not None:
+        memoriser_notifications_non_lues(user_id, max(nombre + delta, 0))
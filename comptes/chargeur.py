@@ -0,0 +1,108 @@
+"""
+Chargeur de lignes propre à la requête en cours.
+
+Le chargeur vit dans la mémoire de requête ouverte par ContexteRequeteMiddleware
+(voir comptes.contexte) et disparaît avec elle. Une ligne déjà lue pendant la
+requête n'est pas relue, et les IDs manquants sont lus ensemble avec un seul
+filtre in_() :
+
+- côté synchrone, charger() ne lit que les IDs encore inconnus ;
+- côté asynchrone, les charger_async() lancés dans le même tour de boucle
+  (typiquement par asyncio.gather) sont regroupés en une seule requête.
+
+Une ligne lue avec toutes ses colonnes ('*') sert aussi les lectures d'un
+sous-ensemble de colonnes. Les IDs introuvables ne sont pas mémorisés. Après
+une écriture, oublier() retire la ligne pour que la relecture aille en base.
+"""
+import asyncio
+from typing import Callable, Dict
+
+from .contexte import memo_requete
+
+
+class Chargeur:
+    def __init__(self):
+        self._lignes = {}      # (table, colonnes) -> {id: ligne}
+        self._futures = {}     # (table, colonnes) -> {id: future} des lectures asynchrones en cours
+        self._en_attente = {}  # (table, colonnes) -> IDs du prochain lot asynchrone
+        self._lecteurs = {}    # (table, colonnes) -> fonction de lecture du prochain lot
+        self._taches = set()
+
+    def _connues(self, table, colonnes, ids):
+        lignes = self._lignes.get((table, colonnes), {})
+        completes = self._lignes.get((table, '*'), {})
+        trouvees = {}
+        for identifiant in ids:
+            ligne = lignes.get(identifiant) or completes.get(identifiant)
+            if ligne is not None:
+                trouvees[identifiant] = ligne
+        return trouvees
+
+    def charger(self, table: str, colonnes: str, ids, lire: Callable) -> Dict[str, Dict]:
+        """Retourne les lignes des IDs demandés ; lire(ids) n'est appelé que pour les inconnus"""
+        ids = list(dict.fromkeys(ids))
+        trouvees = self._connues(table, colonnes, ids)
+        manquants = [identifiant for identifiant in ids if identifiant not in trouvees]
+        if manquants:
+            lues = lire(manquants)
+            self._lignes.setdefault((table, colonnes), {}).update(lues)
+            trouvees.update(lues)
+        return trouvees
+
+    def oublier(self, table: str, identifiant=None):
+        """Oublie une ligne (toute la table si identifiant est None), dans toutes les sélections"""
+        for (nom, _), lignes in self._lignes.items():
+            if nom != table:
+                continue
+            if identifiant is None:
+                lignes.clear()
+            else:
+                lignes.pop(identifiant, None)
+
+    async def charger_async(self, table: str, colonnes: str, identifiant, lire: Callable):
+        """Retourne la ligne d'un ID ; les demandes d'un même tour de boucle partagent une requête"""
+        ligne = self._connues(table, colonnes, [identifiant]).get(identifiant)
+        if ligne is not None:
+            return ligne
+
+        # Une lecture déjà en cours pour cet ID est partagée plutôt que relancée
+        cle = (table, colonnes)
+        futures = self._futures.setdefault(cle, {})
+        future = futures.get(identifiant) or self._futures.get((table, '*'), {}).get(identifiant)
+        if future is None:
+            boucle = asyncio.get_running_loop()
+            future = futures[identifiant] = boucle.create_future()
+            lot = self._en_attente.setdefault(cle, [])
+            if not lot:
+                # Premier ID du lot : la lecture part après les autres demandes du même tour
+                boucle.call_soon(self._lancer_lot, cle)
+            lot.append(identifiant)
+            self._lecteurs[cle] = lire
+        return await asyncio.shield(future)
+
+    def _lancer_lot(self, cle):
+        # Référence conservée jusqu'à la fin : la boucle ne garde qu'une référence faible aux tâches
+        tache = asyncio.ensure_future(self._lire_lot(cle))
+        self._taches.add(tache)
+        tache.add_done_callback(self._taches.discard)
+
+    async def _lire_lot(self, cle):
+        ids = self._en_attente.pop(cle, [])
+        lire = self._lecteurs.pop(cle)
+        futures = self._futures[cle]
+        try:
+            lues = await lire(ids)
+        except Exception as e:
+            lues = {}
+            print(f"Erreur lors du chargement groupé des {cle[0]}: {e}")
+        self._lignes.setdefault(cle, {}).update(lues)
+        for identifiant in ids:
+            # Les IDs introuvables ou en erreur pourront être redemandés
+            future = futures.pop(identifiant)
+            if not future.done():
+                future.set_result(lues.get(identifiant))
+
+
+def get_chargeur() -> Chargeur:
+    """Retourne le chargeur de la requête en cours (un chargeur jetable hors requête)"""
+    return memo_requete('chargeur', Chargeur)
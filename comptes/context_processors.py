@@ -1,33 +1,29 @@
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+
+from .session import utilisateur_requete
+from .supabase_service import SupabaseService
+
+
 def roles(request):
-    # Utiliser les données de session Supabase
-    profile = request.session.get('utilisateur_profile', {})
+    # Utilisateur de la requête (rôles décodés du masque de la session, profil chargé à la demande)
+    utilisateur = utilisateur_requete(request)
     
-    est_admin = profile.get('is_admin', False)
-    est_bibliothecaire = profile.get('is_librarian', False)
-    est_personnel = profile.get('is_administration', False)
+    est_admin = bool(utilisateur and utilisateur.is_admin)
+    est_bibliothecaire = bool(utilisateur and utilisateur.is_librarian)
+    est_personnel = bool(utilisateur and utilisateur.is_administration)
     est_usager = not (est_admin or est_bibliothecaire or est_personnel)
     
-    # Créer un objet utilisateur factice pour la compatibilité avec la navbar
-    class UtilisateurFactice:
-        def __init__(self, profile):
-            self.is_admin = profile.get('is_admin', False)
-            self.is_librarian = profile.get('is_librarian', False)
-            self.is_administration = profile.get('is_administration', False)
-            self.est_admin = profile.get('is_admin', False)
-            self.est_bibliothecaire = profile.get('is_librarian', False)
-            self.est_personnel = profile.get('is_administration', False)
-            self.email = profile.get('email', '')
-            self.nom = profile.get('nom', '')
-            self.prenom = profile.get('prenom', '')
-    
-    # Créer l'objet utilisateur si un profil existe
-    utilisateur = UtilisateurFactice(profile) if profile else None
-    
-    # Gestion des notifications (simplifiée pour l'instant)
-    nb_notifications_biblio = 0
-    nb_notifications_personnel = 0
+    # Notifications : compteur de non lues en cache (aucune requête Supabase tant qu'il est à jour),
+    # liste chargée seulement si le gabarit la parcourt
     nb_notifications_usager = 0
     notifications_usager = []
+    if utilisateur:
+        service = SupabaseService()
+        nb_notifications_usager = service.count_unread_notifications(utilisateur.id)
+        notifications_usager = SimpleLazyObject(lambda: service.get_notifications_non_lues(utilisateur.id, limite=5))
+    nb_notifications_biblio = nb_notifications_usager if est_bibliothecaire else 0
+    nb_notifications_personnel = nb_notifications_usager if est_personnel else 0
 
     return {
         "utilisateur": utilisateur,
@@ -39,6 +35,7 @@ def roles(request):
         "nb_notifications_personnel": nb_notifications_personnel,
         "nb_notifications_usager": nb_notifications_usager,
         "notifications_usager": notifications_usager,
+        # Flux Server-Sent Events en ASGI seulement : en WSGI, chaque flux occuperait un thread
+        "notifications_flux": getattr(settings, 'VUES_ASYNC', False),
+        "notifications_sondage_ms": getattr(settings, 'NOTIFICATIONS_SONDAGE', 60) * 1000,
     }
-
-
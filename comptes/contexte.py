@@ -0,0 +1,31 @@
+"""
+Mémoire limitée à la requête en cours.
+
+ContexteRequeteMiddleware ouvre un dictionnaire au début de chaque requête et
+le referme à la fin. Les valeurs calculées pendant le rendu (filtres de
+template, chargements répétés) y sont conservées pour n'être calculées qu'une
+seule fois par requête. Hors requête (shell, commandes, tests), rien n'est
+mémorisé.
+"""
+from contextvars import ContextVar
+
+_memo_requete = ContextVar('memo_requete', default=None)
+
+
+def debut_requete():
+    """Ouvre la mémoire de la requête ; retourne le jeton à passer à fin_requete()"""
+    return _memo_requete.set({})
+
+
+def fin_requete(jeton):
+    _memo_requete.reset(jeton)
+
+
+def memo_requete(cle, calcul):
+    """Retourne la valeur mémorisée pour cette requête, ou la calcule une fois"""
+    memo = _memo_requete.get()
+    if memo is None:
+        return calcul()
+    if cle not in memo:
+        memo[cle] = calcul()
+    return memo[cle]
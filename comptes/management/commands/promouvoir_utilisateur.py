@@ -1,5 +1,13 @@
 from django.core.management.base import BaseCommand
-from comptes.models import Utilisateur
+from comptes.supabase_service import SupabaseService
+
+# Champ du profil Supabase accordé par chaque rôle ('utilisateur' : aucun)
+ROLES = {
+    'admin': 'is_admin',
+    'bibliothecaire': 'is_librarian',
+    'personnel': 'is_administration',
+    'utilisateur': None,
+}
 
 
 class Command(BaseCommand):
@@ -7,7 +15,7 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('email', type=str, help='Email de l\'utilisateur')
-        parser.add_argument('role', type=str, choices=['admin', 'bibliothecaire', 'personnel', 'utilisateur'], 
+        parser.add_argument('role', type=str, choices=['admin', 'bibliothecaire', 'personnel', 'utilisateur'],
                           help='Nouveau rôle de l\'utilisateur')
 
     def handle(self, *args, **options):
@@ -15,40 +23,35 @@ class Command(BaseCommand):
         role = options['role']
 
         try:
-            utilisateur = Utilisateur.objects.get(email=email)
-            
-            # Réinitialiser tous les rôles
-            utilisateur.est_admin = False
-            utilisateur.est_bibliothecaire = False
-            utilisateur.est_personnel = False
-            
-            # Appliquer le nouveau rôle
-            if role == 'admin':
-                utilisateur.est_admin = True
+            service = SupabaseService()
+            profil = service.get_profile_by_email(email)
+            if not profil:
                 self.stdout.write(
-                    self.style.SUCCESS(f'{utilisateur.get_full_name()} a été promu administrateur')
+                    self.style.ERROR(f'Aucun utilisateur trouvé avec l\'email {email}')
                 )
-            elif role == 'bibliothecaire':
-                utilisateur.est_bibliothecaire = True
+                return
+
+            # Réinitialiser tous les rôles puis appliquer le nouveau ; update_profile change la
+            # version du profil, les sessions ouvertes prennent le nouveau rôle à leur prochaine requête
+            roles = {champ: champ == ROLES[role] for champ in ROLES.values() if champ}
+            if not service.update_profile(profil['id'], roles):
                 self.stdout.write(
-                    self.style.SUCCESS(f'{utilisateur.get_full_name()} a été promu bibliothécaire')
+                    self.style.ERROR(f'Erreur lors de la modification du profil de {email}')
                 )
+                return
+
+            nom = f"{profil.get('prenom') or ''} {profil.get('nom') or ''}".strip() or email
+            if role == 'admin':
+                self.stdout.write(self.style.SUCCESS(f'{nom} a été promu administrateur'))
+            elif role == 'bibliothecaire':
+                self.stdout.write(self.style.SUCCESS(f'{nom} a été promu bibliothécaire'))
             elif role == 'personnel':
-                utilisateur.est_personnel = True
-                self.stdout.write(
-                    self.style.SUCCESS(f'{utilisateur.get_full_name()} a été promu personnel administratif')
-                )
+                self.stdout.write(self.style.SUCCESS(f'{nom} a été promu personnel administratif'))
             else:  # utilisateur
                 self.stdout.write(
-                    self.style.SUCCESS(f'{utilisateur.get_full_name()} a été rétrogradé au statut d\'utilisateur simple')
+                    self.style.SUCCESS(f'{nom} a été rétrogradé au statut d\'utilisateur simple')
                 )
-            
-            utilisateur.save()
-            
-        except Utilisateur.DoesNotExist:
-            self.stdout.write(
-                self.style.ERROR(f'Aucun utilisateur trouvé avec l\'email {email}')
-            )
+
         except Exception as e:
             self.stdout.write(
                 self.style.ERROR(f'Erreur lors de la modification : {str(e)}')
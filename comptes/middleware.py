@@ -1,13 +1,30 @@
+import json
+import logging
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from django.shortcuts import redirect
 from django.urls import reverse
 from functools import wraps
 from django.contrib import messages
 from django.http import HttpResponseForbidden
+from .contexte import debut_requete, fin_requete
+from .session import utilisateur_requete, utilisateur_session
+from bibliotech.metriques import incrementer, observer
+from bibliotech.traces import appels_requete, resumer
+
+journal_traces = logging.getLogger('bibliotech.traces')
+
+# Champ du profil exigé par chaque rôle de permission_requise
+ROLES_PERMISSION = {
+    'admin': ('is_admin', "Accès refusé : réservé aux administrateurs."),
+    'bibliothecaire': ('is_librarian', "Accès refusé : réservé aux bibliothécaires."),
+    'personnel': ('is_administration', "Accès refusé : réservé au personnel administratif."),
+}
 
 def login_requis(view_func):
     @wraps(view_func)
     def _wrapped_view(request, *args, **kwargs):
-        if not request.session.get('utilisateur_id'):
+        if utilisateur_requete(request) is None:
             messages.warning(request, "Veuillez vous connecter pour accéder à cette page.")
             return redirect(f"{reverse('connexion')}?next={request.path}")
         return view_func(request, *args, **kwargs)
@@ -17,47 +34,111 @@ def permission_requise(role):
     def decorator(view_func):
         @wraps(view_func)
         def _wrapped_view(request, *args, **kwargs):
-            if not request.session.get('utilisateur_id'):
+            utilisateur = utilisateur_requete(request)
+            if utilisateur is None:
                 messages.warning(request, "Veuillez vous connecter pour accéder à cette page.")
                 return redirect(f"{reverse('connexion')}?next={request.path}")
             
-            profile = request.session.get('utilisateur_profile', {})
-            
             # Vérifier les permissions selon le rôle
-            if role == 'admin' and not profile.get('is_admin'):
-                return HttpResponseForbidden("Accès refusé : réservé aux administrateurs.")
-            elif role == 'bibliothecaire' and not profile.get('is_librarian'):
-                return HttpResponseForbidden("Accès refusé : réservé aux bibliothécaires.")
-            elif role == 'personnel' and not profile.get('is_administration'):
-                return HttpResponseForbidden("Accès refusé : réservé au personnel administratif.")
+            if role in ROLES_PERMISSION:
+                champ, refus = ROLES_PERMISSION[role]
+                if not utilisateur.a_role(champ):
+                    return HttpResponseForbidden(refus)
             
             return view_func(request, *args, **kwargs)
         return _wrapped_view
     return decorator
 
-class AuthentificationMiddleware:
+class MiddlewareMixte:
+    """
+    Base des middlewares du projet, utilisables en WSGI comme en ASGI : sous ASGI
+    avec VUES_ASYNC, la chaîne reste asynchrone jusqu'aux vues de views_async.py
+    au lieu que Django repasse chaque requête dans un thread (sync_to_async)
+    """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.asynchrone = iscoroutinefunction(get_response)
+        if self.asynchrone:
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        # Ajouter l'utilisateur à la requête si connecté
-        request.utilisateur = None
-        utilisateur_id = request.session.get('utilisateur_id')
-        
-        if utilisateur_id:
-            # Ajouter les informations de l'utilisateur depuis la session
-            request.utilisateur = type('Utilisateur', (), {
-                'id': utilisateur_id,
-                'email': request.session.get('utilisateur_email'),
-                'profile': request.session.get('utilisateur_profile', {}),
-                'is_authenticated': True
-            })
-            
-            # Ajouter les rôles depuis le profil
-            profile = request.session.get('utilisateur_profile', {})
-            request.utilisateur.est_admin = profile.get('is_admin', False)
-            request.utilisateur.est_bibliothecaire = profile.get('is_librarian', False)
-            request.utilisateur.est_personnel = profile.get('is_administration', False)
+        if self.asynchrone:
+            return self.__acall__(request)
+        return self.traiter(request)
+
+    def traiter(self, request):
+        raise NotImplementedError
+
+    async def __acall__(self, request):
+        raise NotImplementedError
+
+class ContexteRequeteMiddleware(MiddlewareMixte):
+    """Ouvre la mémoire propre à chaque requête (voir comptes.contexte et comptes.chargeur)"""
+    def traiter(self, request):
+        jeton = debut_requete()
+        try:
+            return self.get_response(request)
+        finally:
+            fin_requete(jeton)
+
+    async def __acall__(self, request):
+        jeton = debut_requete()
+        try:
+            return await self.get_response(request)
+        finally:
+            fin_requete(jeton)
+
+class TracesRequeteMiddleware(MiddlewareMixte):
+    """Résume chaque requête : en-tête Server-Timing, ligne de journal JSON et métriques par vue"""
+    def traiter(self, request):
+        debut = time.perf_counter()
+        response = self.get_response(request)
+        return self.resumer_requete(request, response, debut)
+
+    async def __acall__(self, request):
+        debut = time.perf_counter()
+        response = await self.get_response(request)
+        return self.resumer_requete(request, response, debut)
+
+    def resumer_requete(self, request, response, debut):
+        secondes = time.perf_counter() - debut
+        duree = round(secondes * 1000, 1)
+
+        # Nom d'URL (accueil, detail_livre, autocomplete...) : une série par vue, pas par chemin
+        vue = getattr(request.resolver_match, 'url_name', None) or 'aucune'
+        observer('bibliotech_vue_duree_secondes', secondes, vue=vue)
+        incrementer('bibliotech_requetes_total', vue=vue, statut=response.status_code)
+
+        # Appels rangés par les hooks de bibliotech/traces.py dans la mémoire de la requête
+        appels = appels_requete()
+        nombre, amont = resumer(appels)
+        response['Server-Timing'] = f'supabase;dur={amont};desc="{nombre} appels", total;dur={duree}'
+        journal_traces.info(json.dumps({
+            'methode': request.method,
+            'chemin': request.path,
+            'vue': getattr(request.resolver_match, 'view_name', None),
+            'statut': response.status_code,
+            'duree_ms': duree,
+            'supabase_ms': amont,
+            'supabase_appels': nombre,
+            'appels': appels,
+        }, ensure_ascii=False))
+        return response
+
+class AuthentificationMiddleware(MiddlewareMixte):
+    def traiter(self, request):
+        # Utilisateur connecté (ou None), partagé par les décorateurs et le processeur de contexte
+        request.utilisateur = utilisateur_session(request)
+        incrementer('bibliotech_sessions_total', etat='authentifiee' if request.utilisateur else 'anonyme')
         
         response = self.get_response(request)
-        return response
\ No newline at end of file
+        return response
+
+    async def __acall__(self, request):
+        # Session et profil sont lus dans un thread, hors de la boucle d'événements
+        request.utilisateur = await sync_to_async(utilisateur_session)(request)
+        incrementer('bibliotech_sessions_total', etat='authentifiee' if request.utilisateur else 'anonyme')
+        return await self.get_response(request)
@@ -0,0 +1,140 @@
+"""
+Notifications poussées vers les pages ouvertes (Server-Sent Events).
+
+En ASGI (VUES_ASYNC), chaque page d'un utilisateur connecté ouvre un
+EventSource sur /comptes/notifications/flux/. En WSGI, un flux occuperait un
+thread par page ouverte : les pages relisent plutôt le nombre de non lues
+(/comptes/notifications/non-lues/, compteur en cache) toutes les
+NOTIFICATIONS_SONDAGE secondes. Le flux surveille la version des notifications
+de l'utilisateur (bibliotech.sessions : une lecture SQLite locale par
+intervalle, aucune requête Supabase), quel que soit le worker ou le processus
+qui a écrit. Il n'interroge Supabase que lorsqu'elle change, et envoie alors
+le nombre de non lues et les nouvelles notifications. Une notification
+insérée sans passer par SupabaseService.create_notification ne change pas la
+version : si elle n'a pas bougé depuis RECOMPTE secondes, le flux recompte les
+non lues en base.
+
+Servi malgré tout en WSGI, un flux se ferme après
+NOTIFICATIONS_FLUX_DUREE secondes et le navigateur se reconnecte seul (champ
+retry, en-tête Last-Event-ID). En ASGI (VUES_ASYNC), le flux est asynchrone
+et n'occupe aucun thread pendant l'attente.
+"""
+import asyncio
+from datetime import datetime, timezone
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+from bibliotech.sessions import lire_version_notifications
+
+from .supabase_service import SupabaseService
+
+INTERVALLE = getattr(settings, 'NOTIFICATIONS_FLUX_INTERVALLE', 2)
+DUREE = getattr(settings, 'NOTIFICATIONS_FLUX_DUREE', 55)
+
+# Version immobile depuis RECOMPTE secondes : recomptage en base (durée de vie du compteur en cache)
+RECOMPTE = getattr(settings, 'NOTIFICATIONS_CACHE_TTL', 300)
+
+# Commentaire envoyé sans activité pour que les proxys ne coupent pas la connexion
+BATTEMENT = 15
+
+# Délai de reconnexion indiqué au navigateur, en millisecondes
+RECONNEXION_MS = 3000
+
+
+def evenement(nom, donnees, identifiant=None):
+    """Formate un événement Server-Sent Events"""
+    lignes = [f"event: {nom}"]
+    if identifiant:
+        lignes.append(f"id: {identifiant}")
+    lignes.append(f"data: {json.dumps(donnees, ensure_ascii=False, default=str)}")
+    return '\n'.join(lignes) + '\n\n'
+
+
+class Flux:
+    """État d'un flux : dernière version vue et date de la dernière notification envoyée"""
+
+    def __init__(self, user_id, depuis=None, service=None, recompte=RECOMPTE):
+        self.user_id = user_id
+        # Reprise après reconnexion : Last-Event-ID porte la date de la dernière notification reçue
+        self.reprise = bool(depuis)
+        self.depuis = depuis or datetime.now(timezone.utc).isoformat()
+        self.version = None
+        self.version_vue_le = None
+        self.non_lues = None
+        self.recompte = recompte
+        self.service = service or SupabaseService()
+
+    def a_change(self, maintenant):
+        version = lire_version_notifications(self.user_id)
+        if version is None:
+            return False
+        if version != self.version:
+            self.version, self.version_vue_le = version, maintenant
+            return True
+        if maintenant - self.version_vue_le < self.recompte:
+            return False
+        # Version immobile : recompter, pour les notifications insérées sans create_notification
+        self.version_vue_le = maintenant
+        nombre = self.service.recompter_notifications_non_lues(self.user_id)
+        self.version = lire_version_notifications(self.user_id)
+        return nombre is not None and nombre != self.non_lues
+
+    def etat(self, premier=False):
+        """Événement 'notifications' : nombre de non lues et notifications arrivées depuis le dernier envoi"""
+        non_lues = self.service.count_unread_notifications(self.user_id)
+        nouvelles = []
+        if non_lues and (self.reprise or not premier):
+            nouvelles = self.service.get_notifications_non_lues(self.user_id, apres=self.depuis)
+        if nouvelles:
+            self.depuis = max(notification['created_at'] for notification in nouvelles)
+        self.non_lues = non_lues
+        return evenement('notifications', {'non_lues': non_lues, 'nouvelles': nouvelles}, self.depuis)
+
+
+def evenements(flux, duree=DUREE, intervalle=INTERVALLE, attendre=time.sleep, horloge=time.monotonic):
+    """Flux synchrone (WSGI) : état initial, puis un événement à chaque changement de version"""
+    yield f"retry: {RECONNEXION_MS}\n\n"
+    debut = dernier = horloge()
+    flux.a_change(debut)
+    yield flux.etat(premier=True)
+    while horloge() - debut < duree:
+        attendre(intervalle)
+        if flux.a_change(horloge()):
+            yield flux.etat()
+            dernier = horloge()
+        elif horloge() - dernier >= BATTEMENT:
+            yield ": battement\n\n"
+            dernier = horloge()
+
+
+async def aevenements(flux, duree=DUREE, intervalle=INTERVALLE):
+    """Flux asynchrone (ASGI) : mêmes événements, lectures faites hors de la boucle"""
+    a_change = sync_to_async(flux.a_change, thread_sensitive=False)
+    etat = sync_to_async(flux.etat, thread_sensitive=False)
+    yield f"retry: {RECONNEXION_MS}\n\n"
+    debut = dernier = time.monotonic()
+    await a_change(debut)
+    yield await etat(premier=True)
+    while time.monotonic() - debut < duree:
+        await asyncio.sleep(intervalle)
+        if await a_change(time.monotonic()):
+            yield await etat()
+            dernier = time.monotonic()
+        elif time.monotonic() - dernier >= BATTEMENT:
+            yield ": battement\n\n"
+            dernier = time.monotonic()
+
+
+def reponse_flux(request, user_id):
+    """Réponse text/event-stream des notifications de cet utilisateur"""
+    flux = Flux(user_id, depuis=request.headers.get('Last-Event-ID'))
+    contenu = aevenements(flux) if getattr(settings, 'VUES_ASYNC', False) else evenements(flux)
+    response = StreamingHttpResponse(contenu, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Pas de mise en mémoire tampon par un proxy nginx : chaque événement part tout de suite
+    response['X-Accel-Buffering'] = 'no'
+    return response
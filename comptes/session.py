@@ -0,0 +1,147 @@
+"""
+Contenu de la session d'un utilisateur connecté.
+
+La session ne garde que l'identifiant, l'email et les rôles sous forme de
+masque de bits (quelques dizaines d'octets). Le profil complet n'y est plus
+copié : il est relu à la demande depuis le cache des profils
+(SupabaseService.get_profile_by_id), au plus une fois par requête, par
+l'objet Utilisateur que partagent le middleware, les décorateurs et le
+processeur de contexte.
+
+La session garde aussi la version du profil lue à la connexion. Chaque
+requête la compare à la version courante (bibliotech.sessions) ; si le
+profil a changé entre-temps (rôle modifié...), il est relu et la session
+mise à jour.
+"""
+from bibliotech.sessions import lire_version_profil
+
+from .supabase_service import SupabaseService
+
+# Un bit par rôle du profil Supabase
+ROLES = {
+    'is_admin': 1,
+    'is_librarian': 2,
+    'is_administration': 4,
+}
+
+
+def masque_roles(profil):
+    """Masque de bits des rôles d'un profil"""
+    profil = profil or {}
+    return sum(bit for champ, bit in ROLES.items() if profil.get(champ))
+
+
+def ouvrir_session(request, user_id, email, profil, version=None):
+    """Enregistre l'utilisateur connecté dans la session"""
+    if version is None:
+        version = lire_version_profil(user_id) or 0
+    request.session['utilisateur_id'] = user_id
+    request.session['utilisateur_email'] = email
+    request.session['utilisateur_roles'] = masque_roles(profil)
+    request.session['utilisateur_version'] = version
+
+
+def roles_session(session):
+    """Rôles de la session : {'is_admin': bool, 'is_librarian': bool, 'is_administration': bool}"""
+    masque = session.get('utilisateur_roles', 0)
+    return {champ: bool(masque & bit) for champ, bit in ROLES.items()}
+
+
+class Utilisateur:
+    """
+    Utilisateur connecté, construit une seule fois par requête.
+
+    Les rôles sont décodés du masque de la session ; le profil complet (nom,
+    prénom, téléphone...) n'est chargé que lorsqu'un de ses champs est lu.
+    """
+    __slots__ = ('id', 'email', 'roles', '_profil')
+
+    is_authenticated = True
+
+    def __init__(self, user_id, email, roles=0):
+        self.id = user_id
+        self.email = email
+        self.roles = roles
+        self._profil = None
+
+    @classmethod
+    def depuis_session(cls, session):
+        """Utilisateur de la session, ou None si anonyme"""
+        user_id = session.get('utilisateur_id')
+        if not user_id:
+            return None
+        return cls(user_id, session.get('utilisateur_email'), session.get('utilisateur_roles', 0))
+
+    def a_role(self, champ):
+        return bool(self.roles & ROLES[champ])
+
+    @property
+    def is_admin(self):
+        return bool(self.roles & ROLES['is_admin'])
+
+    @property
+    def is_librarian(self):
+        return bool(self.roles & ROLES['is_librarian'])
+
+    @property
+    def is_administration(self):
+        return bool(self.roles & ROLES['is_administration'])
+
+    # Noms français utilisés par les templates
+    est_admin = is_admin
+    est_bibliothecaire = is_librarian
+    est_personnel = is_administration
+
+    @property
+    def profile(self):
+        """Profil complet depuis le cache des profils, chargé à la première lecture"""
+        if self._profil is None:
+            profil = SupabaseService().get_profile_by_id(self.id)
+            # Profil introuvable (Supabase indisponible) : au moins l'email et les rôles de la session
+            self._profil = profil or {
+                'id': self.id, 'email': self.email,
+                **{champ: self.a_role(champ) for champ in ROLES},
+            }
+        return self._profil
+
+    @property
+    def nom(self):
+        return self.profile.get('nom', '')
+
+    @property
+    def prenom(self):
+        return self.profile.get('prenom', '')
+
+
+def utilisateur_session(request):
+    """Utilisateur de la session, relu depuis Supabase si son profil a changé depuis la connexion"""
+    utilisateur = Utilisateur.depuis_session(request.session)
+    if utilisateur is None:
+        return None
+    version = lire_version_profil(utilisateur.id)
+    if version is None or version == request.session.get('utilisateur_version', 0):
+        return utilisateur
+
+    profil = SupabaseService().get_profile_by_id(utilisateur.id)
+    if not profil:
+        # Supabase indisponible : on garde la session telle quelle et on réessaiera
+        return utilisateur
+    ouvrir_session(request, utilisateur.id, profil.get('email') or utilisateur.email, profil, version)
+    utilisateur = Utilisateur.depuis_session(request.session)
+    utilisateur._profil = profil
+    return utilisateur
+
+
+def utilisateur_requete(request):
+    """Utilisateur de la requête : celui d'AuthentificationMiddleware, sinon construit depuis la session"""
+    try:
+        return request.utilisateur
+    except AttributeError:
+        request.utilisateur = utilisateur_session(request)
+        return request.utilisateur
+
+
+def profil_session(request):
+    """Profil complet de l'utilisateur connecté, depuis le cache des profils ({} si anonyme)"""
+    utilisateur = utilisateur_requete(request)
+    return utilisateur.profile if utilisateur else {}
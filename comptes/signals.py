@@ -1,8 +1,13 @@
 from django.db.models.signals import pre_save
-from django.dispatch import receiver
+from django.dispatch import Signal, receiver
 from django.core.mail import send_mail
 from .models import RendezVous
 
+# Envoyé par SupabaseService après chaque écriture réussie sur le catalogue.
+# Arguments : table ('livres', 'categories', 'auteurs'), action ('creation', 'modification',
+# 'suppression'), identifiant et ligne (la ligne retournée par Supabase, si disponible)
+catalogue_modifie = Signal()
+
 @receiver(pre_save, sender=RendezVous)
 def notifier_changement_statut(sender, instance, **kwargs):
     if instance.id is None:
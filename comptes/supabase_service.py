@@ -1,50 +1,170 @@
-from bibliotech.supabase_client import supabase, supabase_admin, init_supabase_clients
+from bibliotech.metriques import compter_auth
+from bibliotech.sessions import changer_version_notifications, changer_version_profil
+from bibliotech.supabase_client import get_supabase_client
+from .chargeur import get_chargeur
+from .cache import (
+    en_cache_catalogue, invalide_catalogue,
+    lire_profil, lire_profil_par_email, memoriser_profil, oublier_profil,
+    lire_super_admin_id, memoriser_super_admin_id, invalider_super_admin,
+    lire_favoris_ids, memoriser_favoris_ids, modifier_favoris_ids, oublier_favoris_ids, version_favoris,
+    lire_notifications_non_lues, memoriser_notifications_non_lues, modifier_notifications_non_lues,
+)
+from datetime import date
 from typing import List, Dict, Optional
+import base64
+import json
 import uuid
 
+# Nombre maximal d'IDs par filtre in_() pour rester sous la limite de longueur d'URL
+TAILLE_LOT_IDS = 200
+
+# Taille de page par défaut des listes paginées
+TAILLE_PAGE = 24
+
+# Lignes lues par requête lors d'un parcours complet (exports), sous la limite max-rows de PostgREST
+TAILLE_LOT_EXPORT = 1000
+
+# Champs de profil dont la modification peut changer les droits
+CHAMPS_ROLES = {'is_admin', 'is_administration', 'is_librarian', 'is_user', 'profil'}
+
+# Statuts d'un rendez-vous, tels qu'annoncés à l'utilisateur
+LIBELLES_STATUTS = {'en_attente': 'en attente', 'confirme': 'confirmé', 'annule': 'annulé', 'termine': 'terminé'}
+
+
+def encoder_curseur(valeur, identifiant) -> str:
+    """Encode la position (valeur de tri, id) de la dernière ligne d'une page"""
+    brut = json.dumps([valeur, identifiant]).encode('utf-8')
+    return base64.urlsafe_b64encode(brut).decode('ascii')
+
+
+def decoder_curseur(curseur: str):
+    """Décode un curseur ; retourne None s'il est absent ou invalide"""
+    if not curseur:
+        return None
+    try:
+        valeur, identifiant = json.loads(base64.urlsafe_b64decode(curseur.encode('ascii')))
+    except Exception:
+        return None
+    # Les valeurs sont insérées dans un filtre PostgREST : on refuse tout caractère de syntaxe
+    for element in (valeur, identifiant):
+        if not isinstance(element, str) or any(c in element for c in '"\\(),'):
+            return None
+    return valeur, identifiant
+
+
+def filtrer_apres_curseur(requete, colonne: str, curseur, desc: bool = False):
+    """Ajoute la condition de pagination par clé : (colonne, id) strictement après le curseur"""
+    position = decoder_curseur(curseur)
+    if position is None:
+        return requete
+    valeur, identifiant = position
+    operateur = 'lt' if desc else 'gt'
+    requete.params = requete.params.add(
+        'or',
+        f'({colonne}.{operateur}."{valeur}",and({colonne}.eq."{valeur}",id.{operateur}."{identifiant}"))'
+    )
+    return requete
+
+
+def decouper_page(lignes: List[Dict], colonne: str, taille: int) -> Dict:
+    """Sépare la ligne supplémentaire demandée pour savoir s'il existe une page suivante"""
+    curseur_suivant = None
+    if len(lignes) > taille:
+        lignes = lignes[:taille]
+        derniere = lignes[-1]
+        curseur_suivant = encoder_curseur(derniere.get(colonne), derniere['id'])
+    return {"lignes": lignes, "curseur_suivant": curseur_suivant}
+
+# Sélections imbriquées (une seule requête PostgREST) et mise en forme de leurs résultats
+SELECTION_CATALOGUE = '*, livres(*, auteurs(id, nom, prenom))'
+SELECTION_SANS_CATEGORIE = '*, auteurs(id, nom, prenom)'
+SELECTION_FAVORIS = 'livre_id, livres(*, auteurs(id, nom, prenom), categories(id, nom, image))'
+SELECTION_LIVRES = '*, auteurs(id, nom, prenom), categories(id, nom, image)'
+
+def aplatir_catalogue(categories: List[Dict]) -> List[Dict]:
+    """Renomme les relations imbriquées de SELECTION_CATALOGUE en auteur / categorie"""
+    for categorie in categories:
+        resume_categorie = {'id': categorie['id'], 'nom': categorie.get('nom'), 'image': categorie.get('image')}
+        for livre in categorie.get('livres') or []:
+            livre['auteur'] = livre.pop('auteurs', None)
+            livre['categorie'] = resume_categorie
+    return categories
+
+def aplatir_sans_categorie(livres: List[Dict]) -> List[Dict]:
+    """Renomme la relation de SELECTION_SANS_CATEGORIE en auteur (categorie vide)"""
+    for livre in livres:
+        livre['auteur'] = livre.pop('auteurs', None)
+        livre['categorie'] = None
+    return livres
+
+def assembler_catalogue(categories: List[Dict], sans_categorie: List[Dict] = None) -> Dict:
+    """Compte les livres de chaque catégorie et rassemble la liste complète des livres"""
+    livres = []
+    for categorie in categories:
+        categorie['livres'] = categorie.get('livres') or []
+        categorie['nombre_livres'] = len(categorie['livres'])
+        livres.extend(categorie['livres'])
+    # Livres sans catégorie (categorie_id NULL) : absents de la sélection par catégorie
+    livres.extend(sans_categorie or [])
+    return {"categories": categories, "livres": livres}
+
+def aplatir_favoris(favoris: List[Dict]) -> List[Dict]:
+    """Extrait les livres d'un résultat de SELECTION_FAVORIS, avec auteur et categorie"""
+    livres = []
+    for favori in favoris:
+        livre = favori.get('livres')
+        if livre:
+            livre['auteur'] = livre.pop('auteurs', None)
+            livre['categorie'] = livre.pop('categories', None)
+            livres.append(livre)
+    return livres
+
 class SupabaseService:
     def __init__(self):
-        # Vérifier si les clients sont initialisés, sinon les initialiser
-        if supabase is None or supabase_admin is None:
-            init_supabase_clients()
-        
-        self.client = supabase
-        self.admin_client = supabase_admin
+        # Les clients sont partagés par tout le processus (pool de connexions commun) :
+        # instancier le service ne crée ni client ni connexion
+        self.client = get_supabase_client()
+        self.admin_client = get_supabase_client(admin=True)
     
     # Méthodes pour l'authentification
+    @compter_auth('inscription')
     def sign_up(self, email: str, password: str, user_data: Dict) -> Dict:
         """Inscription d'un utilisateur"""
         try:
             if not self.client:
                 return {"success": False, "error": "Client Supabase non initialisé"}
             
-            # Vérifier si l'utilisateur existe déjà
-            existing_user = self.client.table('profiles').select('id').eq('email', email).execute()
-            if existing_user.data:
+            # Vérifier si l'utilisateur existe déjà (sans requête : Supabase Auth refuse aussi les doublons)
+            if lire_profil_par_email(email):
                 return {"success": False, "error": "Un utilisateur avec cet email existe déjà"}
             
             # Créer l'utilisateur dans auth.users avec les données dans raw_user_meta_data
-            auth_response = self.client.auth.sign_up({
-                "email": email,
-                "password": password,
-                "options": {
-                    "data": user_data
-                }
-            })
+            try:
+                auth_response = self.client.auth.sign_up({
+                    "email": email,
+                    "password": password,
+                    "options": {
+                        "data": user_data
+                    }
+                })
+            except Exception as e:
+                if 'already registered' in str(e).lower():
+                    return {"success": False, "error": "Un utilisateur avec cet email existe déjà"}
+                raise
             
             if auth_response.user:
-                # Le profil est créé automatiquement par la fonction handle_new_user()
-                # Récupérer le profil créé
-                profile_response = self.client.table('profiles').select('*').eq('id', auth_response.user.id).execute()
+                # Avec la confirmation par email, un doublon est renvoyé sans identité
+                if auth_response.user.identities == []:
+                    return {"success": False, "error": "Un utilisateur avec cet email existe déjà"}
                 
-                if profile_response.data:
-                    return {
-                        "success": True,
-                        "user": auth_response.user,
-                        "profile": profile_response.data[0]
-                    }
-                else:
-                    return {"success": False, "error": "Profil non trouvé après création"}
+                # Le profil est créé par la fonction handle_new_user() à partir de ces mêmes
+                # données : inutile de le relire
+                invalider_super_admin()
+                return {
+                    "success": True,
+                    "user": auth_response.user,
+                    "profile": self._profil_depuis_utilisateur(auth_response.user)
+                }
             else:
                 return {"success": False, "error": "Erreur lors de la création de l'utilisateur"}
                 
@@ -56,6 +176,7 @@ class SupabaseService:
             print(f"Traceback: {traceback_str}")
             return {"success": False, "error": f"Erreur d'inscription: {error_msg}"}
     
+    @compter_auth('connexion')
     def sign_in(self, email: str, password: str) -> Dict:
         """Connexion d'un utilisateur"""
         try:
@@ -68,7 +189,7 @@ class SupabaseService:
             })
             
             if response.user:
-                # Récupérer le profil
+                # Récupérer le profil (depuis le cache s'il y est : un seul aller-retour)
                 profile = self.get_profile_by_id(response.user.id)
                 return {
                     "success": True,
@@ -81,6 +202,7 @@ class SupabaseService:
         except Exception as e:
             return {"success": False, "error": str(e)}
     
+    @compter_auth('deconnexion')
     def sign_out(self) -> bool:
         """Déconnexion"""
         try:
@@ -94,20 +216,37 @@ class SupabaseService:
             return False
     
     # Méthodes pour les profils
+    @staticmethod
+    def _profil_depuis_utilisateur(user) -> Dict:
+        """Reconstitue le profil créé par handle_new_user() à partir de l'utilisateur Auth"""
+        return {**(user.user_metadata or {}), "id": user.id, "email": user.email}
+    
     def get_profile_by_id(self, user_id: str) -> Optional[Dict]:
         """Récupère un profil par ID utilisateur"""
+        profil = lire_profil(user_id)
+        if profil:
+            return profil
         try:
             result = self.client.table('profiles').select('*').eq('id', user_id).execute()
-            return result.data[0] if result.data else None
+            if not result.data:
+                return None
+            memoriser_profil(result.data[0])
+            return result.data[0]
         except Exception as e:
             print(f"Erreur lors de la récupération du profil: {e}")
             return None
     
     def get_profile_by_email(self, email: str) -> Optional[Dict]:
         """Récupère un profil par email"""
+        profil = lire_profil_par_email(email)
+        if profil:
+            return profil
         try:
             result = self.client.table('profiles').select('*').eq('email', email).execute()
-            return result.data[0] if result.data else None
+            if not result.data:
+                return None
+            memoriser_profil(result.data[0])
+            return result.data[0]
         except Exception as e:
             print(f"Erreur lors de la récupération du profil: {e}")
             return None
@@ -116,11 +255,41 @@ class SupabaseService:
         """Met à jour un profil"""
         try:
             result = self.client.table('profiles').update(profile_data).eq('id', user_id).execute()
-            return result.data[0] if result.data else None
-        except Exception as e:
+            if not result.data:
+                oublier_profil(user_id)
+                return None
+            # Écriture immédiate dans le cache : les lectures suivantes voient la nouvelle version
+            # Les sessions de cet utilisateur relisent le profil à leur prochaine requête
+            changer_version_profil(user_id)
+            memoriser_profil(result.data[0])
+            if CHAMPS_ROLES & set(profile_data):
+                invalider_super_admin()
+            return result.data[0]
+        except Exception as e:
+            # L'état de la ligne est incertain : la prochaine lecture ira en base
+            changer_version_profil(user_id)
+            oublier_profil(user_id)
             print(f"Erreur lors de la mise à jour du profil: {e}")
             return None
     
+    def get_super_admin_id(self) -> Optional[str]:
+        """Retourne l'ID du super administrateur (premier utilisateur inscrit)"""
+        super_admin_id = lire_super_admin_id()
+        if super_admin_id:
+            return super_admin_id
+        try:
+            if not self.client:
+                print("Client Supabase non initialisé")
+                return None
+            result = self.client.table('profiles').select('id').order('created_at', desc=False).limit(1).execute()
+            if not result.data:
+                return None
+            memoriser_super_admin_id(result.data[0]['id'])
+            return result.data[0]['id']
+        except Exception as e:
+            print(f"Erreur lors de la récupération du super administrateur: {e}")
+            return None
+    
     # Méthodes pour les rendez-vous
     def get_rendezvous_by_user(self, user_id: str) -> List[Dict]:
         """Récupère les rendez-vous d'un utilisateur"""
@@ -140,26 +309,106 @@ class SupabaseService:
             print(f"Erreur lors de la création du rendez-vous: {e}")
             return None
     
+    def update_rendez_vous(self, rdv_id: str, rdv_data: Dict) -> Optional[Dict]:
+        """Met à jour un rendez-vous ; notifie son utilisateur si le statut change"""
+        try:
+            ancien_statut = None
+            if 'statut' in rdv_data:
+                ancien = self.client.table('rendezvous').select('statut').eq('id', rdv_id).limit(1).execute()
+                ancien_statut = ancien.data[0]['statut'] if ancien.data else None
+            result = self.client.table('rendezvous').update(rdv_data).eq('id', rdv_id).execute()
+            if not result.data:
+                return None
+            rdv = result.data[0]
+            if ancien_statut and rdv.get('statut') != ancien_statut and rdv.get('utilisateur_id'):
+                titre = rdv.get('titre_ouvrage') or 'votre ouvrage'
+                statut = LIBELLES_STATUTS.get(rdv['statut'], rdv['statut'])
+                self.create_notification(rdv['utilisateur_id'], f"Votre rendez-vous pour « {titre} » est maintenant {statut}.")
+            return rdv
+        except Exception as e:
+            print(f"Erreur lors de la mise à jour du rendez-vous: {e}")
+            return None
+    
     # Méthodes pour les notifications
     def get_notifications_by_user(self, user_id: str) -> List[Dict]:
-        """Récupère les notifications d'un utilisateur"""
+        """Récupère les notifications d'un utilisateur (les plus récentes d'abord)"""
         try:
-            result = self.client.table('notifications').select('*').eq('utilisateur_id', user_id).execute()
+            query = self.client.table('notifications').select('*').eq('utilisateur_id', user_id)
+            result = query.order('created_at', desc=True).execute()
             return result.data
         except Exception as e:
             print(f"Erreur lors de la récupération des notifications: {e}")
             return []
     
-    def mark_notification_as_read(self, notification_id: str) -> bool:
-        """Marque une notification comme lue"""
+    def get_notifications_non_lues(self, user_id: str, apres: str = None, limite: int = 20) -> List[Dict]:
+        """Notifications non lues d'un utilisateur, créées après `apres` (horodatage ISO) si donné"""
+        try:
+            query = self.client.table('notifications').select('*').eq('utilisateur_id', user_id).eq('lu', False)
+            if apres:
+                query = query.gt('created_at', apres)
+            result = query.order('created_at', desc=True).limit(limite).execute()
+            return result.data
+        except Exception as e:
+            print(f"Erreur lors de la récupération des notifications: {e}")
+            return []
+    
+    def count_unread_notifications(self, user_id: str) -> int:
+        """Nombre de notifications non lues : compteur en cache, compté en base seulement s'il manque"""
+        nombre = lire_notifications_non_lues(user_id)
+        if nombre is not None:
+            return nombre
+        nombre = self.recompter_notifications_non_lues(user_id)
+        return nombre if nombre is not None else 0
+    
+    def recompter_notifications_non_lues(self, user_id: str) -> Optional[int]:
+        """Compte en base les non lues, y compris celles insérées sans create_notification ;
+        change la version si le compteur en cache était faux. None en cas d'erreur"""
+        try:
+            query = self.client.table('notifications').select('id', count='exact')
+            result = query.eq('utilisateur_id', user_id).eq('lu', False).limit(1).execute()
+            nombre = result.count or 0
+        except Exception as e:
+            print(f"Erreur lors du comptage des notifications: {e}")
+            return None
+        if lire_notifications_non_lues(user_id) not in (None, nombre):
+            changer_version_notifications(user_id)
+        memoriser_notifications_non_lues(user_id, nombre)
+        return nombre
+    
+    def create_notification(self, user_id: str, message: str, url: str = None) -> Optional[Dict]:
+        """Crée une notification et met à jour le compteur de non lues"""
+        try:
+            # Aucune politique RLS n'autorise l'insertion : la notification est écrite par le serveur
+            result = self.admin_client.table('notifications').insert({
+                'utilisateur_id': user_id,
+                'message': message,
+                'url': url,
+            }).execute()
+            if not result.data:
+                return None
+            modifier_notifications_non_lues(user_id, 1)
+            return result.data[0]
+        except Exception as e:
+            print(f"Erreur lors de la création de la notification: {e}")
+            return None
+    
+    def mark_notification_as_read(self, notification_id: str, user_id: str = None) -> bool:
+        """Marque une notification comme lue (seulement celles de user_id s'il est donné)"""
         try:
-            result = self.client.table('notifications').update({'lu': True}).eq('id', notification_id).execute()
+            query = self.client.table('notifications').update({'lu': True}).eq('id', notification_id).eq('lu', False)
+            if user_id:
+                query = query.eq('utilisateur_id', user_id)
+            result = query.execute()
+            # Seules les notifications réellement passées à « lue » font baisser le compteur
+            for notification in result.data or []:
+                modifier_notifications_non_lues(notification['utilisateur_id'], -1)
             return True
         except Exception as e:
             print(f"Erreur lors de la mise à jour de la notification: {e}")
             return False
     
     # Méthodes pour les livres
+    @en_cache_catalogue('livres')
     def get_all_livres(self) -> List[Dict]:
         """Récupère tous les livres avec les informations des auteurs et catégories"""
         try:
@@ -171,35 +420,46 @@ class SupabaseService:
             result = self.client.table('livres').select('*').execute()
             livres = result.data
             
-            # Pour chaque livre, récupérer l'auteur et la catégorie
-            for livre in livres:
-                if livre.get('auteur_id'):
-                    try:
-                        auteur_result = self.client.table('auteurs').select('nom, prenom').eq('id', livre['auteur_id']).execute()
-                        if auteur_result.data:
-                            livre['auteur'] = auteur_result.data[0]
-                    except Exception as e:
-                        print(f"Erreur lors de la récupération de l'auteur {livre['auteur_id']}: {e}")
-                        livre['auteur'] = None
-                else:
-                    livre['auteur'] = None
-                
-                if livre.get('categorie_id'):
-                    try:
-                        categorie_result = self.client.table('categories').select('nom, image').eq('id', livre['categorie_id']).execute()
-                        if categorie_result.data:
-                            livre['categorie'] = categorie_result.data[0]
-                    except Exception as e:
-                        print(f"Erreur lors de la récupération de la catégorie {livre['categorie_id']}: {e}")
-                        livre['categorie'] = None
-                else:
-                    livre['categorie'] = None
-            
-            return livres
+            # Récupérer les auteurs et catégories en une requête par table
+            return self._hydrater_livres(livres)
         except Exception as e:
             print(f"Erreur lors de la récupération des livres: {e}")
             return []
     
+    def _charger_par_ids(self, table: str, colonnes: str, ids) -> Dict[str, Dict]:
+        """Récupère les lignes d'une table pour un ensemble d'IDs, sans relire celles déjà lues pendant la requête"""
+        return get_chargeur().charger(table, colonnes, ids, lambda manquants: self._lire_par_ids(table, colonnes, manquants))
+    
+    def _lire_par_ids(self, table: str, colonnes: str, ids) -> Dict[str, Dict]:
+        """Lit les lignes d'une table pour un ensemble d'IDs, par lots, indexées par ID"""
+        lignes = {}
+        ids = list(ids)
+        for debut in range(0, len(ids), TAILLE_LOT_IDS):
+            lot = ids[debut:debut + TAILLE_LOT_IDS]
+            try:
+                result = self.client.table(table).select(colonnes).in_('id', lot).execute()
+                for ligne in result.data:
+                    lignes[ligne['id']] = ligne
+            except Exception as e:
+                print(f"Erreur lors de la récupération des {table} {lot}: {e}")
+        return lignes
+    
+    def _hydrater_livres(self, livres: List[Dict]) -> List[Dict]:
+        """Ajoute l'auteur et la catégorie à chaque livre avec une seule requête par table"""
+        auteur_ids = {livre['auteur_id'] for livre in livres if livre.get('auteur_id')}
+        categorie_ids = {livre['categorie_id'] for livre in livres if livre.get('categorie_id')}
+        
+        auteurs = self._charger_par_ids('auteurs', 'id, nom, prenom', auteur_ids) if auteur_ids else {}
+        # Toutes les colonnes : la catégorie sert aussi un get_categorie_by_id ultérieur dans la requête
+        categories = self._charger_par_ids('categories', '*', categorie_ids) if categorie_ids else {}
+        
+        for livre in livres:
+            livre['auteur'] = auteurs.get(livre.get('auteur_id'))
+            livre['categorie'] = categories.get(livre.get('categorie_id'))
+        
+        return livres
+    
+    @en_cache_catalogue('livres')
     def search_livres(self, query: str) -> List[Dict]:
         """Recherche des livres avec les informations des auteurs et catégories"""
         try:
@@ -211,35 +471,40 @@ class SupabaseService:
             result = self.client.table('livres').select('*').ilike('titre', f'%{query}%').execute()
             livres = result.data
             
-            # Pour chaque livre trouvé, récupérer l'auteur et la catégorie
-            for livre in livres:
-                if livre.get('auteur_id'):
-                    try:
-                        auteur_result = self.client.table('auteurs').select('nom, prenom').eq('id', livre['auteur_id']).execute()
-                        if auteur_result.data:
-                            livre['auteur'] = auteur_result.data[0]
-                    except Exception as e:
-                        print(f"Erreur lors de la récupération de l'auteur {livre['auteur_id']}: {e}")
-                        livre['auteur'] = None
-                else:
-                    livre['auteur'] = None
-                
-                if livre.get('categorie_id'):
-                    try:
-                        categorie_result = self.client.table('categories').select('nom, image').eq('id', livre['categorie_id']).execute()
-                        if categorie_result.data:
-                            livre['categorie'] = categorie_result.data[0]
-                    except Exception as e:
-                        print(f"Erreur lors de la récupération de la catégorie {livre['categorie_id']}: {e}")
-                        livre['categorie'] = None
-                else:
-                    livre['categorie'] = None
-            
-            return livres
+            # Récupérer les auteurs et catégories en une requête par table
+            return self._hydrater_livres(livres)
         except Exception as e:
             print(f"Erreur lors de la recherche de livres: {e}")
             return []
     
+    @en_cache_catalogue('livres')
+    def get_livres_page(self, categorie_id: str = None, query: str = None, curseur: str = None, taille: int = TAILLE_PAGE) -> Dict:
+        """Récupère une page de livres (par catégorie et/ou titre), triée par (created_at, id)"""
+        try:
+            if not self.client:
+                print("Client Supabase non initialisé")
+                return {"livres": [], "curseur_suivant": None}
+            
+            requete = self.client.table('livres').select('*')
+            if categorie_id:
+                requete = requete.eq('categorie_id', categorie_id)
+            if query:
+                requete = requete.ilike('titre', f'%{query}%')
+            requete = filtrer_apres_curseur(requete, 'created_at', curseur)
+            
+            # Une ligne de plus que la taille de page pour savoir s'il existe une suite
+            result = requete.order('created_at').order('id').limit(taille + 1).execute()
+            page = decouper_page(result.data, 'created_at', taille)
+            
+            return {
+                "livres": self._hydrater_livres(page['lignes']),
+                "curseur_suivant": page['curseur_suivant'],
+            }
+        except Exception as e:
+            print(f"Erreur lors de la récupération de la page de livres: {e}")
+            return {"livres": [], "curseur_suivant": None}
+    
+    @en_cache_catalogue('auteurs')
     def search_auteurs(self, query: str) -> List[Dict]:
         """Recherche des auteurs par nom ou prénom"""
         try:
@@ -253,6 +518,7 @@ class SupabaseService:
             print(f"Erreur lors de la recherche d'auteurs: {e}")
             return []
     
+    @en_cache_catalogue('categories')
     def search_categories(self, query: str) -> List[Dict]:
         """Recherche des catégories par nom"""
         try:
@@ -267,6 +533,7 @@ class SupabaseService:
             return []
     
     # Méthodes pour les catégories
+    @en_cache_catalogue('categories')
     def get_all_categories(self) -> List[Dict]:
         """Récupère toutes les catégories"""
         try:
@@ -279,6 +546,38 @@ class SupabaseService:
             print(f"Erreur lors de la récupération des catégories: {e}")
             return []
     
+    @en_cache_catalogue('livres')
+    def get_catalogue(self) -> Dict:
+        """Récupère les catégories avec leurs livres et leurs auteurs en une seule requête"""
+        try:
+            if not self.client:
+                print("Client Supabase non initialisé")
+                return {"categories": [], "livres": []}
+            
+            try:
+                # Sélection imbriquée : catégories -> livres -> auteur
+                result = self.client.table('categories').select(SELECTION_CATALOGUE).execute()
+                categories = aplatir_catalogue(result.data)
+                query = self.client.table('livres').select(SELECTION_SANS_CATEGORIE)
+                sans_categorie = aplatir_sans_categorie(query.is_('categorie_id', 'null').execute().data)
+            except Exception as e:
+                # Repli sans jointure : trois requêtes quel que soit le nombre de catégories
+                print(f"Sélection imbriquée indisponible, repli sur des requêtes séparées: {e}")
+                categories = self.client.table('categories').select('*').execute().data
+                livres = self._hydrater_livres(self.client.table('livres').select('*').execute().data)
+                livres_par_categorie = {}
+                for livre in livres:
+                    livres_par_categorie.setdefault(livre.get('categorie_id'), []).append(livre)
+                for categorie in categories:
+                    categorie['livres'] = livres_par_categorie.get(categorie['id'], [])
+                sans_categorie = livres_par_categorie.get(None, [])
+            
+            return assembler_catalogue(categories, sans_categorie)
+        except Exception as e:
+            print(f"Erreur lors de la récupération du catalogue: {e}")
+            return {"categories": [], "livres": []}
+    
+    @invalide_catalogue('categories', 'creation')
     def create_categorie(self, categorie_data: Dict) -> Optional[Dict]:
         """Crée une nouvelle catégorie"""
         try:
@@ -291,6 +590,7 @@ class SupabaseService:
             print(f"Erreur lors de la création de la catégorie: {e}")
             return None
     
+    @invalide_catalogue('categories', 'modification')
     def update_categorie(self, categorie_id: str, categorie_data: Dict) -> bool:
         """Met à jour une catégorie"""
         try:
@@ -318,6 +618,7 @@ class SupabaseService:
             traceback.print_exc()
             return False
     
+    @invalide_catalogue('categories', 'suppression')
     def delete_categorie(self, categorie_id: str) -> bool:
         """Supprime une catégorie"""
         try:
@@ -330,30 +631,7 @@ class SupabaseService:
             print(f"Erreur lors de la suppression de la catégorie: {e}")
             return False
     
-    def create_livre(self, livre_data: Dict) -> Optional[Dict]:
-        """Crée un nouveau livre"""
-        try:
-            if not self.client:
-                print("Client Supabase non initialisé")
-                return None
-            result = self.client.table('livres').insert(livre_data).execute()
-            return result.data[0] if result.data else None
-        except Exception as e:
-            print(f"Erreur lors de la création du livre: {e}")
-            return None
-    
-    def get_livres_by_categorie(self, categorie_id: str) -> List[Dict]:
-        """Récupère tous les livres d'une catégorie"""
-        try:
-            if not self.client:
-                print("Client Supabase non initialisé")
-                return []
-            result = self.client.table('livres').select('*, auteurs(*), categories(*)').eq('categorie_id', categorie_id).execute()
-            return result.data
-        except Exception as e:
-            print(f"Erreur lors de la récupération des livres: {e}")
-            return []
-    
+    @en_cache_catalogue('auteurs')
     def get_auteur_by_name(self, nom: str, prenom: str = None) -> Optional[Dict]:
         """Récupère un auteur par nom et prénom"""
         try:
@@ -373,6 +651,7 @@ class SupabaseService:
             print(f"Erreur lors de la récupération de l'auteur: {e}")
             return None
     
+    @invalide_catalogue('auteurs', 'creation')
     def create_auteur(self, auteur_data: Dict) -> Optional[Dict]:
         """Crée un nouvel auteur"""
         try:
@@ -385,18 +664,6 @@ class SupabaseService:
             print(f"Erreur lors de la création de l'auteur: {e}")
             return None
     
-    def delete_livre(self, livre_id: str) -> bool:
-        """Supprime un livre"""
-        try:
-            if not self.client:
-                print("Client Supabase non initialisé")
-                return False
-            result = self.client.table('livres').delete().eq('id', livre_id).execute()
-            return True
-        except Exception as e:
-            print(f"Erreur lors de la suppression du livre: {e}")
-            return False
-    
     def get_all_rendez_vous(self) -> List[Dict]:
         """Récupère tous les rendez-vous"""
         try:
@@ -409,15 +676,74 @@ class SupabaseService:
             print(f"Erreur lors de la récupération des rendez-vous: {e}")
             return []
     
+    def get_rendez_vous_page(self, curseur: str = None, taille: int = TAILLE_PAGE, a_partir_du: str = None) -> Dict:
+        """Récupère une page des rendez-vous à partir d'une date (aujourd'hui par défaut), du plus proche au plus lointain"""
+        try:
+            if not self.client:
+                print("Client Supabase non initialisé")
+                return {"rendez_vous": [], "curseur_suivant": None}
+            
+            a_partir_du = a_partir_du or date.today().isoformat()
+            requete = self.client.table('rendezvous').select('*').gte('date_souhaitee', a_partir_du)
+            requete = filtrer_apres_curseur(requete, 'date_souhaitee', curseur)
+            result = requete.order('date_souhaitee').order('id').limit(taille + 1).execute()
+            page = decouper_page(result.data, 'date_souhaitee', taille)
+            
+            return {"rendez_vous": page['lignes'], "curseur_suivant": page['curseur_suivant']}
+        except Exception as e:
+            print(f"Erreur lors de la récupération de la page de rendez-vous: {e}")
+            return {"rendez_vous": [], "curseur_suivant": None}
+    
+    def _parcourir(self, table: str, selection: str, taille: int):
+        """Parcourt toute une table par pages, en pagination par clé sur l'id"""
+        dernier_id = None
+        while True:
+            requete = self.client.table(table).select(selection)
+            if dernier_id is not None:
+                requete = requete.gt('id', dernier_id)
+            lignes = requete.order('id').limit(taille).execute().data
+            if lignes:
+                yield lignes
+            if len(lignes) < taille:
+                return
+            dernier_id = lignes[-1]['id']
+    
+    def parcourir_livres(self, taille: int = TAILLE_LOT_EXPORT):
+        """Produit tous les livres, avec auteur et catégorie, page par page (mémoire constante)
+
+        Une erreur Supabase interrompt le parcours : un export reste incomplet plutôt
+        que silencieusement tronqué.
+        """
+        if not self.client:
+            print("Client Supabase non initialisé")
+            return
+        for livres in self._parcourir('livres', SELECTION_LIVRES, taille):
+            for livre in livres:
+                livre['auteur'] = livre.pop('auteurs', None)
+                livre['categorie'] = livre.pop('categories', None)
+            yield from livres
+    
+    def parcourir_rendez_vous(self, taille: int = TAILLE_LOT_EXPORT):
+        """Produit tous les rendez-vous page par page (mémoire constante)"""
+        if not self.client:
+            print("Client Supabase non initialisé")
+            return
+        for rendez_vous in self._parcourir('rendezvous', '*', taille):
+            yield from rendez_vous
+    
+    @en_cache_catalogue('categories')
     def get_categorie_by_id(self, categorie_id: str) -> Optional[Dict]:
         """Récupère une catégorie par ID"""
         try:
-            result = self.client.table('categories').select('*').eq('id', categorie_id).execute()
-            return result.data[0] if result.data else None
+            if not self.client:
+                print("Client Supabase non initialisé")
+                return None
+            return self._charger_par_ids('categories', '*', [categorie_id]).get(categorie_id)
         except Exception as e:
             print(f"Erreur lors de la récupération de la catégorie: {e}")
             return None
     
+    @en_cache_catalogue('livres')
     def get_livres_by_categorie(self, categorie_id: str) -> List[Dict]:
         """Récupère les livres d'une catégorie avec les informations des auteurs"""
         try:
@@ -429,35 +755,13 @@ class SupabaseService:
             result = self.client.table('livres').select('*').eq('categorie_id', categorie_id).execute()
             livres = result.data
             
-            # Ensuite, pour chaque livre, récupérer l'auteur et la catégorie séparément
-            for livre in livres:
-                if livre.get('auteur_id'):
-                    try:
-                        auteur_result = self.client.table('auteurs').select('nom, prenom').eq('id', livre['auteur_id']).execute()
-                        if auteur_result.data:
-                            livre['auteur'] = auteur_result.data[0]
-                    except Exception as e:
-                        print(f"Erreur lors de la récupération de l'auteur {livre['auteur_id']}: {e}")
-                        livre['auteur'] = None
-                else:
-                    livre['auteur'] = None
-                
-                if livre.get('categorie_id'):
-                    try:
-                        categorie_result = self.client.table('categories').select('nom, image').eq('id', livre['categorie_id']).execute()
-                        if categorie_result.data:
-                            livre['categorie'] = categorie_result.data[0]
-                    except Exception as e:
-                        print(f"Erreur lors de la récupération de la catégorie {livre['categorie_id']}: {e}")
-                        livre['categorie'] = None
-                else:
-                    livre['categorie'] = None
-            
-            return livres
+            # Ensuite, récupérer les auteurs et catégories en une requête par table
+            return self._hydrater_livres(livres)
         except Exception as e:
             print(f"Erreur lors de la récupération des livres par catégorie: {e}")
             return []
     
+    @en_cache_catalogue('livres')
     def get_livre_by_id(self, livre_id: str) -> Optional[Dict]:
         """Récupère un livre par ID avec les informations de l'auteur et de la catégorie"""
         try:
@@ -466,80 +770,50 @@ class SupabaseService:
                 return None
             
             # Récupérer le livre
-            result = self.client.table('livres').select('*').eq('id', livre_id).execute()
-            if not result.data:
+            livre = self._charger_par_ids('livres', '*', [livre_id]).get(livre_id)
+            if not livre:
                 return None
             
-            livre = result.data[0]
-            
-            # Récupérer l'auteur
-            if livre.get('auteur_id'):
-                try:
-                    auteur_result = self.client.table('auteurs').select('nom, prenom').eq('id', livre['auteur_id']).execute()
-                    if auteur_result.data:
-                        livre['auteur'] = auteur_result.data[0]
-                except Exception as e:
-                    print(f"Erreur lors de la récupération de l'auteur {livre['auteur_id']}: {e}")
-                    livre['auteur'] = None
-            else:
-                livre['auteur'] = None
-            
-            # Récupérer la catégorie
-            if livre.get('categorie_id'):
-                try:
-                    categorie_result = self.client.table('categories').select('nom, image').eq('id', livre['categorie_id']).execute()
-                    if categorie_result.data:
-                        livre['categorie'] = categorie_result.data[0]
-                except Exception as e:
-                    print(f"Erreur lors de la récupération de la catégorie {livre['categorie_id']}: {e}")
-                    livre['categorie'] = None
-            else:
-                livre['categorie'] = None
-            
-            return livre
+            # Récupérer l'auteur et la catégorie
+            return self._hydrater_livres([livre])[0]
         except Exception as e:
             print(f"Erreur lors de la récupération du livre: {e}")
             return None
     
     def ajouter_favori(self, user_id: str, livre_id: str) -> bool:
-        """Ajoute un livre aux favoris d'un utilisateur"""
+        """Ajoute un livre aux favoris d'un utilisateur (sans effet s'il y est déjà)"""
         try:
             if not self.client:
                 print("Client Supabase non initialisé")
                 return False
             
-            # Vérifier si le favori existe déjà
-            existing = self.client.table('favoris').select('*').eq('user_id', user_id).eq('livre_id', livre_id).execute()
-            
-            if existing.data:
-                print("Le livre est déjà dans les favoris")
-                return True
-            
-            # Ajouter le favori
-            result = self.client.table('favoris').insert({
-                'user_id': user_id,
-                'livre_id': livre_id
-            }).execute()
-            
-            return len(result.data) > 0
+            # Une seule requête : la contrainte UNIQUE(user_id, livre_id) ignore les doublons
+            self.client.table('favoris').upsert(
+                {'user_id': user_id, 'livre_id': livre_id},
+                on_conflict='user_id,livre_id',
+                ignore_duplicates=True,
+            ).execute()
+            modifier_favoris_ids(user_id, livre_id, ajoute=True)
+            return True
             
         except Exception as e:
+            oublier_favoris_ids(user_id)
             print(f"Erreur lors de l'ajout aux favoris: {e}")
             return False
     
     def supprimer_favori(self, user_id: str, livre_id: str) -> bool:
-        """Supprime un livre des favoris d'un utilisateur"""
+        """Supprime un livre des favoris d'un utilisateur (sans effet s'il n'y est pas)"""
         try:
             if not self.client:
                 print("Client Supabase non initialisé")
                 return False
             
-            # Supprimer le favori
-            result = self.client.table('favoris').delete().eq('user_id', user_id).eq('livre_id', livre_id).execute()
-            
+            self.client.table('favoris').delete().eq('user_id', user_id).eq('livre_id', livre_id).execute()
+            modifier_favoris_ids(user_id, livre_id, ajoute=False)
             return True
             
         except Exception as e:
+            oublier_favoris_ids(user_id)
             print(f"Erreur lors de la suppression des favoris: {e}")
             return False
     
@@ -550,14 +824,68 @@ class SupabaseService:
                 print("Client Supabase non initialisé")
                 return []
             
+            version = version_favoris(user_id)
             result = self.client.table('favoris').select('*').eq('user_id', user_id).execute()
+            memoriser_favoris_ids(user_id, (favori['livre_id'] for favori in result.data), version)
             return result.data
             
         except Exception as e:
             print(f"Erreur lors de la récupération des favoris: {e}")
             return []
     
+    def get_favoris_ids(self, user_id: str) -> set:
+        """Retourne l'ensemble des IDs des livres favoris d'un utilisateur"""
+        livre_ids = lire_favoris_ids(user_id)
+        if livre_ids is not None:
+            return livre_ids
+        try:
+            if not self.client:
+                print("Client Supabase non initialisé")
+                return set()
+            
+            version = version_favoris(user_id)
+            result = self.client.table('favoris').select('livre_id').eq('user_id', user_id).execute()
+            livre_ids = {favori['livre_id'] for favori in result.data}
+            memoriser_favoris_ids(user_id, livre_ids, version)
+            return livre_ids
+            
+        except Exception as e:
+            print(f"Erreur lors de la récupération des favoris: {e}")
+            return set()
+    
+    def is_favori(self, user_id: str, livre_id: str) -> bool:
+        """Vérifie si un livre est dans les favoris d'un utilisateur"""
+        return livre_id in self.get_favoris_ids(user_id)
+    
+    def get_livres_favoris(self, user_id: str) -> List[Dict]:
+        """Récupère les livres favoris d'un utilisateur avec auteur et catégorie en une seule requête"""
+        try:
+            if not self.client:
+                print("Client Supabase non initialisé")
+                return []
+            
+            version = version_favoris(user_id)
+            try:
+                # Sélection imbriquée : favoris -> livre -> auteur et catégorie
+                result = self.client.table('favoris').select(SELECTION_FAVORIS).eq('user_id', user_id).execute()
+                livres = aplatir_favoris(result.data)
+                livre_ids = [favori['livre_id'] for favori in result.data]
+            except Exception as e:
+                # Repli sans jointure : nombre de requêtes indépendant du nombre de favoris
+                print(f"Sélection imbriquée indisponible, repli sur des requêtes séparées: {e}")
+                result = self.client.table('favoris').select('livre_id').eq('user_id', user_id).execute()
+                livre_ids = [favori['livre_id'] for favori in result.data]
+                livres_par_id = self._charger_par_ids('livres', '*', livre_ids)
+                livres = self._hydrater_livres([livres_par_id[i] for i in livre_ids if i in livres_par_id])
+            
+            memoriser_favoris_ids(user_id, livre_ids, version)
+            return livres
+            
+        except Exception as e:
+            print(f"Erreur lors de la récupération des livres favoris: {e}")
+            return []
     
+    @invalide_catalogue('livres', 'creation')
     def create_livre(self, livre_data: Dict) -> Optional[Dict]:
         """Crée un nouveau livre"""
         try:
@@ -567,6 +895,7 @@ class SupabaseService:
             print(f"Erreur lors de la création du livre: {e}")
             return None
     
+    @invalide_catalogue('livres', 'modification')
     def update_livre(self, livre_id: str, livre_data: Dict) -> Optional[Dict]:
         """Met à jour un livre"""
         try:
@@ -576,6 +905,7 @@ class SupabaseService:
             print(f"Erreur lors de la mise à jour du livre: {e}")
             return None
     
+    @invalide_catalogue('livres', 'suppression')
     def delete_livre(self, livre_id: str) -> bool:
         """Supprime un livre"""
         try:
@@ -0,0 +1,248 @@
+"""
+Variante asynchrone de SupabaseService, pour les vues async servies en ASGI.
+
+Les lectures indépendantes sont lancées ensemble avec asyncio.gather : la
+durée d'une page devient celle de l'appel le plus lent et non la somme des
+appels. Les méthodes portent les mêmes noms et renvoient les mêmes données que
+celles du service synchrone : elles partagent donc les entrées du cache du
+catalogue.
+"""
+import asyncio
+from typing import Dict, List, Optional
+
+from bibliotech.supabase_client import get_async_postgrest_client
+from .chargeur import get_chargeur
+from .cache import alire_favoris_ids, amemoriser_favoris_ids, en_cache_catalogue_async, version_favoris
+from .supabase_service import (
+    SELECTION_CATALOGUE, SELECTION_FAVORIS, SELECTION_SANS_CATEGORIE, TAILLE_LOT_IDS, TAILLE_PAGE,
+    aplatir_catalogue, aplatir_favoris, aplatir_sans_categorie, assembler_catalogue, decouper_page,
+    filtrer_apres_curseur,
+)
+
+
+class AsyncSupabaseService:
+    def __init__(self, client=None):
+        # Client de la boucle d'événements courante : à instancier dans une vue async
+        self.client = client if client is not None else get_async_postgrest_client()
+
+    async def _charger_par_ids(self, table: str, colonnes: str, ids) -> Dict[str, Dict]:
+        """Récupère les lignes d'une table pour un ensemble d'IDs, regroupées avec les demandes simultanées"""
+        ids = list(ids)
+        chargeur = get_chargeur()
+        lire = lambda manquants: self._lire_par_ids(table, colonnes, manquants)
+        lignes = await asyncio.gather(*(chargeur.charger_async(table, colonnes, i, lire) for i in ids))
+        return {identifiant: ligne for identifiant, ligne in zip(ids, lignes) if ligne is not None}
+
+    async def _lire_par_ids(self, table: str, colonnes: str, ids) -> Dict[str, Dict]:
+        """Lit les lignes d'une table pour un ensemble d'IDs, tous les lots en parallèle"""
+        ids = list(ids)
+        lots = [ids[debut:debut + TAILLE_LOT_IDS] for debut in range(0, len(ids), TAILLE_LOT_IDS)]
+        resultats = await asyncio.gather(
+            *(self.client.table(table).select(colonnes).in_('id', lot).execute() for lot in lots),
+            return_exceptions=True,
+        )
+        lignes = {}
+        for lot, result in zip(lots, resultats):
+            if isinstance(result, Exception):
+                print(f"Erreur lors de la récupération des {table} {lot}: {result}")
+                continue
+            for ligne in result.data:
+                lignes[ligne['id']] = ligne
+        return lignes
+
+    async def _vide(self):
+        return {}
+
+    async def _hydrater_livres(self, livres: List[Dict]) -> List[Dict]:
+        """Ajoute l'auteur et la catégorie à chaque livre, les deux tables en parallèle"""
+        auteur_ids = {livre['auteur_id'] for livre in livres if livre.get('auteur_id')}
+        categorie_ids = {livre['categorie_id'] for livre in livres if livre.get('categorie_id')}
+
+        auteurs, categories = await asyncio.gather(
+            self._charger_par_ids('auteurs', 'id, nom, prenom', auteur_ids) if auteur_ids else self._vide(),
+            self._charger_par_ids('categories', '*', categorie_ids) if categorie_ids else self._vide(),
+        )
+
+        for livre in livres:
+            livre['auteur'] = auteurs.get(livre.get('auteur_id'))
+            livre['categorie'] = categories.get(livre.get('categorie_id'))
+
+        return livres
+
+    @en_cache_catalogue_async('livres')
+    async def get_catalogue(self) -> Dict:
+        """Récupère les catégories avec leurs livres et leurs auteurs en une seule requête"""
+        try:
+            if not self.client:
+                print("Client Supabase non initialisé")
+                return {"categories": [], "livres": []}
+
+            try:
+                # Catégories avec leurs livres, et livres sans catégorie, en parallèle
+                result, result_sans_categorie = await asyncio.gather(
+                    self.client.table('categories').select(SELECTION_CATALOGUE).execute(),
+                    self.client.table('livres').select(SELECTION_SANS_CATEGORIE).is_('categorie_id', 'null').execute(),
+                )
+                categories = aplatir_catalogue(result.data)
+                sans_categorie = aplatir_sans_categorie(result_sans_categorie.data)
+            except Exception as e:
+                # Repli sans jointure : catégories et livres en parallèle
+                print(f"Sélection imbriquée indisponible, repli sur des requêtes séparées: {e}")
+                result_categories, result_livres = await asyncio.gather(
+                    self.client.table('categories').select('*').execute(),
+                    self.client.table('livres').select('*').execute(),
+                )
+                categories = result_categories.data
+                livres = await self._hydrater_livres(result_livres.data)
+                livres_par_categorie = {}
+                for livre in livres:
+                    livres_par_categorie.setdefault(livre.get('categorie_id'), []).append(livre)
+                for categorie in categories:
+                    categorie['livres'] = livres_par_categorie.get(categorie['id'], [])
+                sans_categorie = livres_par_categorie.get(None, [])
+
+            return assembler_catalogue(categories, sans_categorie)
+        except Exception as e:
+            print(f"Erreur lors de la récupération du catalogue: {e}")
+            return {"categories": [], "livres": []}
+
+    @en_cache_catalogue_async('categories')
+    async def get_categorie_by_id(self, categorie_id: str) -> Optional[Dict]:
+        """Récupère une catégorie par ID"""
+        try:
+            if not self.client:
+                print("Client Supabase non initialisé")
+                return None
+            return (await self._charger_par_ids('categories', '*', [categorie_id])).get(categorie_id)
+        except Exception as e:
+            print(f"Erreur lors de la récupération de la catégorie: {e}")
+            return None
+
+    @en_cache_catalogue_async('livres')
+    async def get_livre_by_id(self, livre_id: str) -> Optional[Dict]:
+        """Récupère un livre par ID avec les informations de l'auteur et de la catégorie"""
+        try:
+            if not self.client:
+                print("Client Supabase non initialisé")
+                return None
+
+            livre = (await self._charger_par_ids('livres', '*', [livre_id])).get(livre_id)
+            if not livre:
+                return None
+
+            return (await self._hydrater_livres([livre]))[0]
+        except Exception as e:
+            print(f"Erreur lors de la récupération du livre: {e}")
+            return None
+
+    @en_cache_catalogue_async('livres')
+    async def get_livres_page(self, categorie_id: str = None, query: str = None, curseur: str = None, taille: int = TAILLE_PAGE) -> Dict:
+        """Récupère une page de livres (par catégorie et/ou titre), triée par (created_at, id)"""
+        try:
+            if not self.client:
+                print("Client Supabase non initialisé")
+                return {"livres": [], "curseur_suivant": None}
+
+            requete = self.client.table('livres').select('*')
+            if categorie_id:
+                requete = requete.eq('categorie_id', categorie_id)
+            if query:
+                requete = requete.ilike('titre', f'%{query}%')
+            requete = filtrer_apres_curseur(requete, 'created_at', curseur)
+
+            result = await requete.order('created_at').order('id').limit(taille + 1).execute()
+            page = decouper_page(result.data, 'created_at', taille)
+
+            return {
+                "livres": await self._hydrater_livres(page['lignes']),
+                "curseur_suivant": page['curseur_suivant'],
+            }
+        except Exception as e:
+            print(f"Erreur lors de la récupération de la page de livres: {e}")
+            return {"livres": [], "curseur_suivant": None}
+
+    @en_cache_catalogue_async('livres')
+    async def search_livres(self, query: str) -> List[Dict]:
+        """Recherche des livres avec les informations des auteurs et catégories"""
+        try:
+            if not self.client:
+                print("Client Supabase non initialisé")
+                return []
+
+            result = await self.client.table('livres').select('*').ilike('titre', f'%{query}%').execute()
+            return await self._hydrater_livres(result.data)
+        except Exception as e:
+            print(f"Erreur lors de la recherche de livres: {e}")
+            return []
+
+    @en_cache_catalogue_async('auteurs')
+    async def search_auteurs(self, query: str) -> List[Dict]:
+        """Recherche des auteurs par nom ou prénom"""
+        try:
+            if not self.client:
+                print("Client Supabase non initialisé")
+                return []
+
+            result = await self.client.table('auteurs').select('*').ilike('nom', f'%{query}%').execute()
+            return result.data
+        except Exception as e:
+            print(f"Erreur lors de la recherche d'auteurs: {e}")
+            return []
+
+    @en_cache_catalogue_async('categories')
+    async def search_categories(self, query: str) -> List[Dict]:
+        """Recherche des catégories par nom"""
+        try:
+            if not self.client:
+                print("Client Supabase non initialisé")
+                return []
+
+            result = await self.client.table('categories').select('*').ilike('nom', f'%{query}%').execute()
+            return result.data
+        except Exception as e:
+            print(f"Erreur lors de la recherche de catégories: {e}")
+            return []
+
+    async def get_favoris_ids(self, user_id: str) -> set:
+        """Retourne l'ensemble des IDs des livres favoris d'un utilisateur"""
+        livre_ids = await alire_favoris_ids(user_id)
+        if livre_ids is not None:
+            return livre_ids
+        try:
+            if not self.client:
+                print("Client Supabase non initialisé")
+                return set()
+
+            version = version_favoris(user_id)
+            result = await self.client.table('favoris').select('livre_id').eq('user_id', user_id).execute()
+            livre_ids = {favori['livre_id'] for favori in result.data}
+            await amemoriser_favoris_ids(user_id, livre_ids, version)
+            return livre_ids
+        except Exception as e:
+            print(f"Erreur lors de la récupération des favoris: {e}")
+            return set()
+
+    async def get_livres_favoris(self, user_id: str) -> List[Dict]:
+        """Récupère les livres favoris d'un utilisateur avec auteur et catégorie en une seule requête"""
+        try:
+            if not self.client:
+                print("Client Supabase non initialisé")
+                return []
+
+            version = version_favoris(user_id)
+            try:
+                result = await self.client.table('favoris').select(SELECTION_FAVORIS).eq('user_id', user_id).execute()
+                livres = aplatir_favoris(result.data)
+                livre_ids = [favori['livre_id'] for favori in result.data]
+            except Exception as e:
+                print(f"Sélection imbriquée indisponible, repli sur des requêtes séparées: {e}")
+                result = await self.client.table('favoris').select('livre_id').eq('user_id', user_id).execute()
+                livre_ids = [favori['livre_id'] for favori in result.data]
+                livres_par_id = await self._charger_par_ids('livres', '*', livre_ids)
+                livres = await self._hydrater_livres([livres_par_id[i] for i in livre_ids if i in livres_par_id])
+
+            await amemoriser_favoris_ids(user_id, livre_ids, version)
+            return livres
+        except Exception as e:
+            print(f"Erreur lors de la récupération des livres favoris: {e}")
+            return []
@@ -1,3 +1,1037 @@
-from django.test import TestCase
+from asgiref.sync import sync_to_async
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.urls import reverse
+from postgrest import SyncPostgrestClient
+from postgrest.utils import SyncClient
 
-# Create your tests here.
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import json
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+from bibliotech.metriques import Registre, format_texte, metriques
+from bibliotech.sessions import SessionStore, changer_version_catalogue, changer_version_profil, lire_version_profil
+from bibliotech import supabase_client
+from bibliotech.supabase_local import BaseLocale, TransportLocal, creer_client, creer_client_async
+from bibliotech.traces import appels_requete, event_hooks
+
+from .cache import get_cache_catalogue, get_cache_profils
+from .chargeur import get_chargeur
+from .contexte import debut_requete, fin_requete
+from .middleware import AuthentificationMiddleware, ContexteRequeteMiddleware, TracesRequeteMiddleware, permission_requise
+from .notifications import Flux, evenements
+from .session import ROLES, Utilisateur, ouvrir_session, profil_session, roles_session
+from .templatetags.comptes_extras import first_utilisateur_id, is_super_admin
+from .supabase_service_async import AsyncSupabaseService
+from .views import gestion_rdv_bibliothecaire, notifications_non_lues
+from .supabase_service import SupabaseService, decoder_curseur, decouper_page, encoder_curseur, filtrer_apres_curseur
+
+
+class FausseRequete:
+    """Imite le constructeur de requêtes PostgREST sur des données en mémoire"""
+
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.filtres = []
+        self.colonnes = '*'
+        self.tri = None
+        self.nombre = None
+
+    def select(self, colonnes='*'):
+        self.colonnes = colonnes
+        return self
+
+    def eq(self, colonne, valeur):
+        self.filtres.append(lambda ligne: ligne.get(colonne) == valeur)
+        return self
+
+    def in_(self, colonne, valeurs):
+        valeurs = set(valeurs)
+        self.filtres.append(lambda ligne: ligne.get(colonne) in valeurs)
+        return self
+
+    def is_(self, colonne, valeur):
+        attendu = None if valeur == 'null' else valeur
+        self.filtres.append(lambda ligne: ligne.get(colonne) is attendu)
+        return self
+
+    def ilike(self, colonne, motif):
+        motif = motif.strip('%').lower()
+        self.filtres.append(lambda ligne: motif in (ligne.get(colonne) or '').lower())
+        return self
+
+    def insert(self, donnees):
+        self.insertion = donnees
+        return self
+
+    def order(self, colonne, desc=False):
+        self.tri = (colonne, desc)
+        return self
+
+    def limit(self, nombre):
+        self.nombre = nombre
+        return self
+
+    def upsert(self, donnees, on_conflict='', ignore_duplicates=False):
+        self.insertion = donnees
+        self.conflit = on_conflict.split(',') if on_conflict else None
+        return self
+
+    def delete(self):
+        self.suppression = True
+        return self
+
+    def update(self, donnees):
+        self.modification = donnees
+        return self
+
+    def execute(self):
+        self.client.requetes.append(self.table)
+        if '(' in self.colonnes:
+            raise Exception("Sélection imbriquée non prise en charge")
+        if hasattr(self, 'insertion'):
+            lignes = self.insertion if isinstance(self.insertion, list) else [self.insertion]
+            if getattr(self, 'conflit', None):
+                existantes = self.client.tables.get(self.table, [])
+                lignes = [l for l in lignes if not any(all(e.get(c) == l.get(c) for c in self.conflit) for e in existantes)]
+            self.client.tables.setdefault(self.table, []).extend(dict(l) for l in lignes)
+            return type('Reponse', (), {'data': [dict(l) for l in lignes]})
+        if hasattr(self, 'suppression'):
+            table = self.client.tables.get(self.table, [])
+            supprimees = [l for l in table if all(f(l) for f in self.filtres)]
+            table[:] = [l for l in table if l not in supprimees]
+            return type('Reponse', (), {'data': supprimees})
+        if hasattr(self, 'modification'):
+            lignes = [l for l in self.client.tables.get(self.table, []) if all(f(l) for f in self.filtres)]
+            for ligne in lignes:
+                ligne.update(self.modification)
+            return type('Reponse', (), {'data': [dict(l) for l in lignes]})
+        lignes = [dict(l) for l in self.client.tables.get(self.table, []) if all(f(l) for f in self.filtres)]
+        if self.tri:
+            lignes.sort(key=lambda l: l.get(self.tri[0]), reverse=self.tri[1])
+        if self.nombre is not None:
+            lignes = lignes[:self.nombre]
+        return type('Reponse', (), {'data': lignes})
+
+
+class FausseAuth:
+    """Imite Supabase Auth : les utilisateurs sont les lignes de la table profiles"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def sign_in_with_password(self, identifiants):
+        self.client.requetes.append('auth')
+        for profil in self.client.tables.get('profiles', []):
+            if profil['email'] == identifiants['email']:
+                return SimpleNamespace(user=SimpleNamespace(id=profil['id'], email=profil['email']))
+        return SimpleNamespace(user=None)
+
+    def sign_up(self, donnees):
+        self.client.requetes.append('auth')
+        if any(p['email'] == donnees['email'] for p in self.client.tables.get('profiles', [])):
+            raise Exception("User already registered")
+        user = SimpleNamespace(id='u-nouveau', email=donnees['email'], identities=[{'provider': 'email'}],
+                               user_metadata=donnees['options']['data'])
+        return SimpleNamespace(user=user)
+
+
+class FauxClient:
+    def __init__(self, tables):
+        self.tables = tables
+        self.requetes = []
+        self.auth = FausseAuth(self)
+
+    def table(self, nom):
+        return FausseRequete(self, nom)
+
+
+class FausseRequeteAsync(FausseRequete):
+    """Variante asynchrone qui mesure le nombre de requêtes en vol simultanément"""
+
+    async def execute(self):
+        self.client.en_vol += 1
+        self.client.max_en_vol = max(self.client.max_en_vol, self.client.en_vol)
+        try:
+            await asyncio.sleep(0.01)
+            return FausseRequete.execute(self)
+        finally:
+            self.client.en_vol -= 1
+
+
+class FauxClientAsync(FauxClient):
+    def __init__(self, tables):
+        super().__init__(tables)
+        self.en_vol = 0
+        self.max_en_vol = 0
+
+    def table(self, nom):
+        return FausseRequeteAsync(self, nom)
+
+
+def creer_service(tables):
+    service = SupabaseService.__new__(SupabaseService)
+    service.client = service.admin_client = FauxClient(tables)
+    return service
+
+
+class HydratationLivresTests(SimpleTestCase):
+    def setUp(self):
+        get_cache_catalogue().clear()
+        self.tables = {
+            'auteurs': [{'id': f'a{i}', 'nom': f'Nom {i}', 'prenom': ''} for i in range(3)],
+            'categories': [{'id': 'c1', 'nom': 'Histoire', 'image': None}],
+            'livres': [
+                {'id': f'l{i}', 'titre': f'Livre {i}', 'auteur_id': f'a{i % 3}', 'categorie_id': 'c1'}
+                for i in range(30)
+            ] + [{'id': 'orphelin', 'titre': 'Sans auteur', 'auteur_id': None, 'categorie_id': None}],
+        }
+
+    def test_une_requete_par_table(self):
+        service = creer_service(self.tables)
+        livres = service.get_all_livres()
+        self.assertEqual(len(livres), 31)
+        self.assertEqual(service.client.requetes, ['livres', 'auteurs', 'categories'])
+        self.assertEqual(livres[4]['auteur']['nom'], 'Nom 1')
+        self.assertEqual(livres[4]['categorie']['nom'], 'Histoire')
+        self.assertIsNone(livres[-1]['auteur'])
+        self.assertIsNone(livres[-1]['categorie'])
+
+    def test_livre_par_id(self):
+        service = creer_service(self.tables)
+        livre = service.get_livre_by_id('l2')
+        self.assertEqual(livre['auteur']['nom'], 'Nom 2')
+        self.assertIsNone(service.get_livre_by_id('inconnu'))
+
+    def test_catalogue_independant_du_nombre_de_categories(self):
+        self.tables['categories'] += [{'id': f'vide{i}', 'nom': f'Vide {i}', 'image': None} for i in range(10)]
+        service = creer_service(self.tables)
+        catalogue = service.get_catalogue()
+        self.assertEqual(len(service.client.requetes), 5)
+        self.assertEqual(len(catalogue['categories']), 11)
+        self.assertEqual(catalogue['categories'][0]['nombre_livres'], 30)
+        # Le livre sans catégorie figure dans la liste complète
+        self.assertEqual(len(catalogue['livres']), 31)
+
+
+class CacheCatalogueTests(SimpleTestCase):
+    def setUp(self):
+        get_cache_catalogue().clear()
+        self.tables = {'categories': [{'id': 'c1', 'nom': 'Droit', 'image': None}], 'livres': [], 'auteurs': []}
+
+    def test_lecture_en_cache_puis_invalidation(self):
+        service = creer_service(self.tables)
+        self.assertEqual(service.get_all_categories()[0]['nom'], 'Droit')
+        self.assertEqual(service.get_all_categories()[0]['nom'], 'Droit')
+        self.assertEqual(service.client.requetes, ['categories'])
+
+        service.create_categorie({'id': 'c2', 'nom': 'Economie', 'image': None})
+        self.assertEqual(len(service.get_all_categories()), 2)
+        self.assertEqual(service.client.requetes, ['categories', 'categories', 'categories'])
+
+    def test_ecriture_d_un_autre_worker(self):
+        service = creer_service(self.tables)
+        service.get_all_categories()
+        # Un autre worker (ou une commande de gestion) écrit : seule la génération partagée change
+        changer_version_catalogue()
+        self.tables['categories'][0]['nom'] = 'Droit public'
+        self.assertEqual(service.get_all_categories()[0]['nom'], 'Droit public')
+        self.assertEqual(service.client.requetes, ['categories', 'categories'])
+
+    def test_resultat_vide_non_conserve(self):
+        service = creer_service(self.tables)
+        self.assertIsNone(service.get_categorie_by_id('inconnue'))
+        self.assertIsNone(service.get_categorie_by_id('inconnue'))
+        self.assertEqual(service.client.requetes, ['categories', 'categories'])
+
+
+class ProfilsTests(SimpleTestCase):
+    def setUp(self):
+        get_cache_profils().clear()
+        self.tables = {'profiles': [{'id': 'u1', 'email': 'amina@exemple.ma', 'nom': 'Alaoui', 'is_librarian': False}]}
+
+    def test_connexion_en_un_aller_retour_avec_profil_en_cache(self):
+        service = creer_service(self.tables)
+        self.assertEqual(service.sign_in('amina@exemple.ma', 'secret')['profile']['nom'], 'Alaoui')
+        self.assertEqual(service.client.requetes, ['auth', 'profiles'])
+        service.client.requetes.clear()
+        self.assertEqual(service.sign_in('amina@exemple.ma', 'secret')['profile']['nom'], 'Alaoui')
+        self.assertEqual(service.client.requetes, ['auth'])
+
+    def test_ecriture_directe_dans_le_cache(self):
+        service = creer_service(self.tables)
+        service.get_profile_by_id('u1')
+        service.update_profile('u1', {'is_librarian': True})
+        service.client.requetes.clear()
+        self.assertTrue(service.get_profile_by_id('u1')['is_librarian'])
+        self.assertTrue(service.get_profile_by_email('AMINA@exemple.ma')['is_librarian'])
+        self.assertEqual(service.client.requetes, [])
+
+    def test_inscription_sans_relecture_du_profil(self):
+        service = creer_service(self.tables)
+        resultat = service.sign_up('karim@exemple.ma', 'secret', {'nom': 'Bennani', 'is_user': True})
+        self.assertTrue(resultat['success'])
+        self.assertEqual(resultat['profile'], {'nom': 'Bennani', 'is_user': True, 'id': 'u-nouveau', 'email': 'karim@exemple.ma'})
+        self.assertEqual(service.client.requetes, ['auth'])
+        self.assertFalse(service.sign_up('amina@exemple.ma', 'secret', {})['success'])
+
+
+class SuperAdminTests(SimpleTestCase):
+    def setUp(self):
+        get_cache_profils().clear()
+        self.service = creer_service({'profiles': [
+            {'id': 'u2', 'email': 'b@exemple.ma', 'created_at': '2024-02-01', 'is_admin': False},
+            {'id': 'u1', 'email': 'a@exemple.ma', 'created_at': '2024-01-01', 'is_admin': True},
+        ]})
+        patcher = mock.patch('comptes.templatetags.comptes_extras.SupabaseService', return_value=self.service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def rendu(self):
+        """Simule une requête dont le rendu évalue plusieurs fois les filtres"""
+        jeton = debut_requete()
+        try:
+            return [is_super_admin({'id': 'u1'}), is_super_admin({'id': 'u2'}), first_utilisateur_id(None)]
+        finally:
+            fin_requete(jeton)
+
+    def test_une_lecture_par_requete_puis_cache(self):
+        self.assertEqual(self.rendu(), [True, False, 'u1'])
+        self.assertEqual(self.rendu(), [True, False, 'u1'])
+        self.assertEqual(self.service.client.requetes, ['profiles'])
+
+    def test_memo_requete_sans_cache(self):
+        jeton = debut_requete()
+        try:
+            first_utilisateur_id(None)
+            get_cache_profils().clear()
+            self.assertEqual(first_utilisateur_id(None), 'u1')
+        finally:
+            fin_requete(jeton)
+        self.assertEqual(self.service.client.requetes, ['profiles'])
+
+    def test_invalidation_au_changement_de_role(self):
+        self.rendu()
+        self.service.update_profile('u2', {'is_admin': True})
+        self.service.client.requetes.clear()
+        self.rendu()
+        self.assertEqual(self.service.client.requetes, ['profiles'])
+
+
+class FavorisTests(SimpleTestCase):
+    def setUp(self):
+        get_cache_profils().clear()
+        self.tables = {
+            'auteurs': [{'id': 'a1', 'nom': 'Ayache', 'prenom': 'Germain'}],
+            'categories': [{'id': 'c1', 'nom': 'Histoire', 'image': None}],
+            'livres': [{'id': f'l{i}', 'titre': f'Livre {i}', 'auteur_id': 'a1', 'categorie_id': 'c1'} for i in range(250)],
+            'favoris': [{'user_id': 'u1', 'livre_id': f'l{i}'} for i in range(200)],
+        }
+        self.service = creer_service(self.tables)
+
+    def test_verification_par_ensemble_en_cache(self):
+        self.assertTrue(self.service.is_favori('u1', 'l5'))
+        self.assertFalse(self.service.is_favori('u1', 'l220'))
+        self.assertEqual(self.service.client.requetes, ['favoris'])
+
+    def test_ajout_et_suppression_idempotents(self):
+        self.service.is_favori('u1', 'l220')
+        self.assertTrue(self.service.ajouter_favori('u1', 'l220'))
+        self.assertTrue(self.service.ajouter_favori('u1', 'l220'))
+        self.assertEqual(sum(f['livre_id'] == 'l220' for f in self.tables['favoris']), 1)
+        self.assertTrue(self.service.is_favori('u1', 'l220'))
+        self.assertTrue(self.service.supprimer_favori('u1', 'l220'))
+        self.assertTrue(self.service.supprimer_favori('u1', 'l220'))
+        self.assertFalse(self.service.is_favori('u1', 'l220'))
+        self.assertEqual(self.service.client.requetes, ['favoris'] * 5)
+
+    def test_ecriture_d_un_autre_worker(self):
+        self.assertFalse(self.service.is_favori('u1', 'l220'))
+        # Autre worker : son propre cache locmem, mêmes versions partagées
+        autre = creer_service(self.tables)
+        with mock.patch('comptes.cache.get_cache_profils', return_value=LocMemCache('autre-worker', {})):
+            self.assertTrue(autre.ajouter_favori('u1', 'l220'))
+        self.assertTrue(self.service.is_favori('u1', 'l220'))
+        self.assertEqual(self.service.client.requetes, ['favoris', 'favoris'])
+
+    def test_livres_favoris_sans_requete_par_livre(self):
+        livres = self.service.get_livres_favoris('u1')
+        self.assertEqual(len(livres), 200)
+        self.assertEqual(livres[0]['auteur']['nom'], 'Ayache')
+        self.assertEqual(livres[0]['categorie']['nom'], 'Histoire')
+        # Sélection imbriquée refusée par le faux client, puis repli en quatre requêtes
+        self.assertEqual(self.service.client.requetes, ['favoris', 'favoris', 'livres', 'auteurs', 'categories'])
+
+
+class ServiceAsyncTests(SimpleTestCase):
+    def setUp(self):
+        get_cache_catalogue().clear()
+        get_cache_profils().clear()
+        self.tables = {
+            'auteurs': [{'id': 'a1', 'nom': 'Ayache', 'prenom': 'Germain'}],
+            'categories': [{'id': 'c1', 'nom': 'Histoire', 'image': None}],
+            'livres': [{'id': 'l1', 'titre': 'Histoire du Maroc', 'auteur_id': 'a1', 'categorie_id': 'c1'}],
+            'favoris': [{'user_id': 'u1', 'livre_id': 'l1'}],
+        }
+        self.client = FauxClientAsync(self.tables)
+        self.service = AsyncSupabaseService(self.client)
+
+    async def test_lectures_independantes_en_parallele(self):
+        livre, categorie, favoris_ids = await asyncio.gather(
+            self.service.get_livre_by_id('l1'),
+            self.service.get_categorie_by_id('c1'),
+            self.service.get_favoris_ids('u1'),
+        )
+        self.assertEqual(livre['auteur']['nom'], 'Ayache')
+        self.assertEqual(livre['categorie']['nom'], 'Histoire')
+        self.assertEqual(categorie['nom'], 'Histoire')
+        self.assertEqual(favoris_ids, {'l1'})
+        self.assertEqual(self.client.max_en_vol, 3)
+
+    async def test_catalogue_repli_en_parallele(self):
+        catalogue = await self.service.get_catalogue()
+        self.assertEqual(catalogue['categories'][0]['nombre_livres'], 1)
+        self.assertEqual(catalogue['livres'][0]['auteur']['nom'], 'Ayache')
+        self.assertEqual(self.client.max_en_vol, 2)
+
+    async def test_cache_partage_avec_le_service_synchrone(self):
+        creer_service(self.tables).get_categorie_by_id('c1')
+        self.assertEqual((await self.service.get_categorie_by_id('c1'))['nom'], 'Histoire')
+        self.assertEqual(self.client.requetes, [])
+
+    async def test_catalogue_partage_avec_le_service_synchrone(self):
+        creer_service(self.tables).get_catalogue()
+        self.assertEqual((await self.service.get_catalogue())['livres'][0]['titre'], 'Histoire du Maroc')
+        self.assertEqual(self.client.requetes, [])
+
+
+class ChargeurTests(SimpleTestCase):
+    def setUp(self):
+        get_cache_catalogue().clear()
+        self.tables = {
+            'auteurs': [{'id': 'a1', 'nom': 'Ayache', 'prenom': 'Germain'}],
+            'categories': [{'id': 'c1', 'nom': 'Histoire', 'image': None}],
+            'livres': [{'id': f'l{i}', 'titre': f'Livre {i}', 'auteur_id': 'a1', 'categorie_id': 'c1'} for i in range(3)],
+        }
+        jeton = debut_requete()
+        self.addCleanup(fin_requete, jeton)
+
+    def test_aucune_ligne_lue_deux_fois_par_requete(self):
+        service = creer_service(self.tables)
+        service.get_livre_by_id('l0')
+        service.get_categorie_by_id('c1')
+        service.get_livres_by_categorie('c1')
+        self.assertEqual(service.client.requetes, ['livres', 'auteurs', 'categories', 'livres'])
+
+    def test_seuls_les_ids_inconnus_sont_lus(self):
+        lus = []
+        def lire(ids):
+            lus.append(ids)
+            return {i: {'id': i} for i in ids}
+        get_chargeur().charger('livres', '*', ['l0', 'l1'], lire)
+        get_chargeur().charger('livres', 'id, titre', ['l1', 'l2', 'l2'], lire)
+        self.assertEqual(lus, [['l0', 'l1'], ['l2']])
+
+    def test_relecture_apres_ecriture_dans_la_requete(self):
+        service = creer_service(self.tables)
+        self.assertEqual(service.get_livre_by_id('l0')['titre'], 'Livre 0')
+        service.update_livre('l0', {'titre': 'Livre zéro'})
+        self.assertEqual(service.get_livre_by_id('l0')['titre'], 'Livre zéro')
+        service.update_categorie('c1', {'nom': 'Histoire moderne'})
+        self.assertEqual(service.get_categorie_by_id('c1')['nom'], 'Histoire moderne')
+
+    async def test_demandes_simultanees_regroupees(self):
+        lus = []
+        async def lire(ids):
+            lus.append(ids)
+            return {i: {'id': i} for i in ids if i != 'inconnu'}
+        chargeur = get_chargeur()
+        lignes = await asyncio.gather(*(chargeur.charger_async('livres', '*', i, lire) for i in ['l0', 'l1', 'l0', 'inconnu']))
+        self.assertEqual(lignes, [{'id': 'l0'}, {'id': 'l1'}, {'id': 'l0'}, None])
+        self.assertEqual(await chargeur.charger_async('livres', '*', 'l1', lire), {'id': 'l1'})
+        self.assertEqual(lus, [['l0', 'l1', 'inconnu']])
+
+
+class PaginationTests(SimpleTestCase):
+    def test_curseur_aller_retour(self):
+        curseur = encoder_curseur('2025-01-02T10:00:00+00:00', 'abc')
+        self.assertEqual(decoder_curseur(curseur), ('2025-01-02T10:00:00+00:00', 'abc'))
+
+    def test_curseur_invalide_ignore(self):
+        self.assertIsNone(decoder_curseur('pas-un-curseur'))
+        self.assertIsNone(decoder_curseur(encoder_curseur('x', 'a),id.gt.(0')))
+
+    def test_filtre_apres_curseur(self):
+        requete = SyncPostgrestClient('http://localhost').from_('livres').select('*')
+        requete = filtrer_apres_curseur(requete, 'created_at', encoder_curseur('2025-01-02', 'l9'))
+        self.assertEqual(
+            requete.params['or'],
+            '(created_at.gt."2025-01-02",and(created_at.eq."2025-01-02",id.gt."l9"))'
+        )
+
+    def test_decouper_page(self):
+        lignes = [{'id': f'l{i}', 'created_at': f'2025-01-0{i}'} for i in range(1, 5)]
+        page = decouper_page(lignes, 'created_at', 3)
+        self.assertEqual(len(page['lignes']), 3)
+        self.assertEqual(decoder_curseur(page['curseur_suivant']), ('2025-01-03', 'l3'))
+        self.assertIsNone(decouper_page(lignes, 'created_at', 4)['curseur_suivant'])
+
+
+class TracesTests(SimpleTestCase):
+    def setUp(self):
+        def repondre(requete):
+            if requete.method == 'GET':
+                return httpx.Response(200, json=[{'id': 'l1'}, {'id': 'l2'}], headers={'Content-Range': '0-1/*'})
+            return httpx.Response(201, json=[], headers={'Content-Range': '*/*'})
+        self.client = SyncPostgrestClient('http://supabase.local/rest/v1')
+        self.client.session = SyncClient(
+            base_url='http://supabase.local/rest/v1', transport=httpx.MockTransport(repondre), event_hooks=event_hooks(),
+        )
+
+    def test_appels_enregistres_sans_valeurs_de_filtres(self):
+        jeton = debut_requete()
+        self.addCleanup(fin_requete, jeton)
+        self.client.table('livres').select('*').eq('categorie_id', 'c1').ilike('titre', '%maroc%').execute()
+        self.client.table('favoris').upsert({'user_id': 'u1', 'livre_id': 'l1'}, ignore_duplicates=True).execute()
+        lecture, ecriture = appels_requete()
+        self.assertEqual((lecture['table'], lecture['operation'], lecture['lignes']), ('livres', 'select', 2))
+        self.assertEqual(lecture['filtres'], ['categorie_id=eq', 'titre=ilike'])
+        self.assertGreater(lecture['octets'], 0)
+        self.assertEqual((ecriture['table'], ecriture['operation']), ('favoris', 'upsert'))
+
+    def test_rien_conserve_hors_requete(self):
+        self.client.table('livres').select('*').execute()
+        self.assertEqual(appels_requete(), [])
+
+    def test_server_timing_et_ligne_de_journal(self):
+        def vue(request):
+            self.client.table('livres').select('*').execute()
+            self.client.table('auteurs').select('*').execute()
+            return HttpResponse('ok')
+        middleware = ContexteRequeteMiddleware(TracesRequeteMiddleware(vue))
+        with self.assertLogs('bibliotech.traces', 'INFO') as journal:
+            reponse = middleware(RequestFactory().get('/bibliotheque/'))
+        self.assertRegex(reponse['Server-Timing'], r'^supabase;dur=[\d.]+;desc="2 appels", total;dur=[\d.]+$')
+        ligne = json.loads(journal.records[0].getMessage())
+        self.assertEqual((ligne['chemin'], ligne['supabase_appels']), ('/bibliotheque/', 2))
+        self.assertEqual([appel['table'] for appel in ligne['appels']], ['livres', 'auteurs'])
+
+    async def test_chaine_de_middlewares_asynchrone(self):
+        async def vue(request):
+            await sync_to_async(self.client.table('livres').select('*').execute)()
+            return HttpResponse('ok')
+        middleware = ContexteRequeteMiddleware(TracesRequeteMiddleware(AuthentificationMiddleware(vue)))
+        # Sous ASGI, Django n'intercale pas de thread : chaque middleware est une coroutine
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        requete = RequestFactory().get('/bibliotheque/')
+        requete.session = {}
+        with self.assertLogs('bibliotech.traces', 'INFO') as journal:
+            reponse = await middleware(requete)
+        self.assertIsNone(requete.utilisateur)
+        self.assertRegex(reponse['Server-Timing'], r'^supabase;dur=[\d.]+;desc="1 appels", total;dur=[\d.]+$')
+        self.assertEqual(json.loads(journal.records[0].getMessage())['supabase_appels'], 1)
+        self.assertFalse(asyncio.iscoroutinefunction(ContexteRequeteMiddleware(lambda request: HttpResponse('ok'))))
+
+
+class MetriquesTests(SimpleTestCase):
+    def setUp(self):
+        dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(dossier.cleanup)
+        self.dossier = dossier.name
+
+    def test_agregation_entre_processus(self):
+        for pid, duree in ((101, 0.02), (102, 3.0)):
+            with mock.patch('bibliotech.metriques.os.getpid', return_value=pid):
+                registre = Registre(self.dossier, intervalle=60)
+                registre.incrementer('bibliotech_cache_total', cache='catalogue', resultat='hit')
+                registre.observer('bibliotech_vue_duree_secondes', duree, vue='detail_livre')
+                registre.ecrire()
+        texte = format_texte(*Registre(self.dossier).collecter())
+        self.assertIn('# TYPE bibliotech_cache_total counter', texte)
+        self.assertIn('bibliotech_cache_total{cache="catalogue",resultat="hit"} 2', texte)
+        self.assertIn('bibliotech_vue_duree_secondes_bucket{vue="detail_livre",le="0.025"} 1', texte)
+        self.assertIn('bibliotech_vue_duree_secondes_bucket{vue="detail_livre",le="+Inf"} 2', texte)
+        self.assertIn('bibliotech_vue_duree_secondes_count{vue="detail_livre"} 2', texte)
+
+    def test_ecriture_differee(self):
+        registre = Registre(self.dossier, intervalle=60)
+        registre.incrementer('bibliotech_auth_total', operation='connexion', resultat='succes')
+        self.assertEqual(os.listdir(self.dossier), [])
+        registre.intervalle = 0
+        registre.incrementer('bibliotech_auth_total', operation='connexion', resultat='echec')
+        self.assertEqual(len(os.listdir(self.dossier)), 1)
+        self.assertRegex(os.listdir(self.dossier)[0], rf'^{os.getpid()}-\d+\.json$')
+
+    def test_pid_reutilise_et_workers_arretes_archives(self):
+        for _ in range(2):
+            # Deux workers successifs avec le même pid
+            with mock.patch('bibliotech.metriques.os.getpid', return_value=4242):
+                registre = Registre(self.dossier, intervalle=60)
+                registre.incrementer('bibliotech_auth_total', operation='connexion', resultat='succes')
+                registre.ecrire()
+        with mock.patch('bibliotech.metriques._processus_actif', side_effect=lambda pid: pid != 4242):
+            for _ in range(2):
+                compteurs, _ = Registre(self.dossier, intervalle=60).collecter()
+                self.assertEqual(compteurs[('bibliotech_auth_total', (('operation', 'connexion'), ('resultat', 'succes')))], 2)
+        self.assertFalse([nom for nom in os.listdir(self.dossier) if nom.startswith('4242-')])
+
+    def test_vue_protegee_par_jeton(self):
+        with mock.patch('bibliotech.metriques.registre', Registre(self.dossier)), self.settings(METRIQUES_JETON=''):
+            self.assertEqual(metriques(RequestFactory().get('/metrics')).status_code, 403)
+        with mock.patch('bibliotech.metriques.registre', Registre(self.dossier)), \
+                self.settings(METRIQUES_JETON='secret'):
+            self.assertEqual(metriques(RequestFactory().get('/metrics')).status_code, 403)
+            reponse = metriques(RequestFactory().get('/metrics', HTTP_AUTHORIZATION='Bearer secret'))
+        self.assertEqual(reponse.status_code, 200)
+        self.assertTrue(reponse['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+
+class SupabaseLocalTests(SimpleTestCase):
+    def setUp(self):
+        get_cache_catalogue().clear()
+        get_cache_profils().clear()
+        self.base = BaseLocale()
+        self.service = self.creer_service()
+        self.auteur = self.service.create_auteur({'nom': 'Laroui', 'prenom': 'Fouad'})
+        self.categorie = self.service.create_categorie({'nom': 'Littérature'})
+        for i in range(30):
+            self.service.create_livre({
+                'titre': f'Élégie {i:02}', 'auteur_id': self.auteur['id'], 'categorie_id': self.categorie['id'],
+                'numero_inventaire': f'INV{i}', 'date_publication': '2001-01-01',
+            })
+
+    def creer_service(self, latence=0):
+        service = SupabaseService.__new__(SupabaseService)
+        service.client = service.admin_client = creer_client(self.base, latence)
+        return service
+
+    def test_catalogue_par_selection_imbriquee(self):
+        catalogue = self.service.get_catalogue()
+        self.assertEqual(catalogue['categories'][0]['nombre_livres'], 30)
+        self.assertEqual(catalogue['livres'][0]['auteur']['nom'], 'Laroui')
+
+    def test_catalogue_avec_livres_sans_categorie(self):
+        self.service.create_livre({
+            'titre': 'Hors catégorie', 'auteur_id': self.auteur['id'],
+            'numero_inventaire': 'INV-SC', 'date_publication': '2001-01-01',
+        })
+        catalogue = self.service.get_catalogue()
+        self.assertEqual(catalogue['categories'][0]['nombre_livres'], 30)
+        self.assertEqual(len(catalogue['livres']), 31)
+        sans_categorie = [livre for livre in catalogue['livres'] if livre['titre'] == 'Hors catégorie'][0]
+        self.assertIsNone(sans_categorie['categorie'])
+        self.assertEqual(sans_categorie['auteur']['nom'], 'Laroui')
+
+    async def test_catalogue_async_par_selection_imbriquee(self):
+        await sync_to_async(self.service.create_livre)({
+            'titre': 'Hors catégorie', 'auteur_id': self.auteur['id'],
+            'numero_inventaire': 'INV-SC', 'date_publication': '2001-01-01',
+        })
+        service = AsyncSupabaseService(creer_client_async(self.service.client, self.base))
+        # Sélections imbriquées comprises par la base locale : pas de repli en requêtes séparées
+        with mock.patch.object(AsyncSupabaseService, '_hydrater_livres', side_effect=AssertionError('repli inattendu')):
+            catalogue = await service.get_catalogue()
+        self.assertEqual(catalogue['categories'][0]['nombre_livres'], 30)
+        self.assertEqual(len(catalogue['livres']), 31)
+        sans_categorie = [livre for livre in catalogue['livres'] if livre['titre'] == 'Hors catégorie'][0]
+        self.assertIsNone(sans_categorie['categorie'])
+        self.assertEqual(sans_categorie['auteur']['nom'], 'Laroui')
+
+    def test_recherche_et_pagination(self):
+        self.assertEqual(len(self.service.search_livres('ÉLÉGIE 1')), 10)
+        premiere = self.service.get_livres_page()
+        seconde = self.service.get_livres_page(curseur=premiere['curseur_suivant'])
+        self.assertEqual((len(premiere['livres']), len(seconde['livres'])), (24, 6))
+        self.assertIsNone(seconde['curseur_suivant'])
+        self.assertEqual(len({livre['id'] for livre in premiere['livres'] + seconde['livres']}), 30)
+
+    def test_rendez_vous_a_venir_pagines_par_date_souhaitee(self):
+        for jour in range(1, 31):
+            self.service.create_rendezvous({
+                'nom': 'Alaoui', 'prenom': 'Amina', 'telephone': '0600000000', 'email': 'amina@exemple.ma',
+                'type_utilisateur': 'etudiant', 'raison': 'Consultation', 'date_souhaitee': f'2030-01-{jour:02}',
+            })
+        premiere = self.service.get_rendez_vous_page(taille=15, a_partir_du='2030-01-10')
+        seconde = self.service.get_rendez_vous_page(curseur=premiere['curseur_suivant'], taille=15, a_partir_du='2030-01-10')
+        self.assertEqual(premiere['rendez_vous'][0]['date_souhaitee'], '2030-01-10')
+        dates = [rdv['date_souhaitee'] for rdv in premiere['rendez_vous'] + seconde['rendez_vous']]
+        self.assertEqual(dates, sorted(dates))
+        self.assertEqual(len(dates), 21)
+        self.assertIsNone(seconde['curseur_suivant'])
+
+    def test_inscription_cree_le_profil(self):
+        inscription = self.service.sign_up('amina@exemple.ma', 'secret12', {'nom': 'Alaoui', 'prenom': 'Amina'})
+        self.assertTrue(inscription['success'])
+        get_cache_profils().clear()
+        self.assertEqual(self.service.get_profile_by_id(inscription['profile']['id'])['nom'], 'Alaoui')
+        self.assertFalse(self.service.sign_up('amina@exemple.ma', 'secret12', {'nom': 'Alaoui'})['success'])
+        self.assertFalse(self.service.sign_in('amina@exemple.ma', 'mauvais')['success'])
+        self.assertTrue(self.service.sign_in('amina@exemple.ma', 'secret12')['success'])
+
+    def test_favoris_idempotents(self):
+        user_id = self.service.sign_up('amina@exemple.ma', 'secret12', {'nom': 'Alaoui'})['profile']['id']
+        livre_id = self.service.search_livres('Élégie 05')[0]['id']
+        self.assertTrue(self.service.ajouter_favori(user_id, livre_id))
+        self.assertTrue(self.service.ajouter_favori(user_id, livre_id))
+        get_cache_profils().clear()
+        self.assertEqual(self.service.get_favoris_ids(user_id), {livre_id})
+        self.assertEqual(self.service.get_livres_favoris(user_id)[0]['categorie']['nom'], 'Littérature')
+
+    def test_erreurs_postgrest(self):
+        with self.assertRaises(Exception) as contexte:
+            self.service.client.table('livres').select('inconnue').execute()
+        self.assertEqual(contexte.exception.code, '42703')
+        with self.assertRaises(Exception) as contexte:
+            self.service.client.table('auteurs').insert({'prenom': 'Sans nom'}).execute()
+        self.assertEqual(contexte.exception.code, '23502')
+
+    def test_latence_injectee(self):
+        service = self.creer_service(latence=0.05)
+        debut = time.perf_counter()
+        service.client.table('categories').select('id').execute()
+        self.assertGreaterEqual(time.perf_counter() - debut, 0.05)
+
+    def test_service_async(self):
+        async def scenario():
+            service = AsyncSupabaseService(client=creer_client_async(self.service.client, self.base))
+            return await service.get_livres_page(query='élégie 2')
+        self.assertEqual(len(asyncio.run(scenario())['livres']), 10)
+
+
+class TransportEnPanne(httpx.BaseTransport):
+    """Transport local qui peut simuler une connexion rompue"""
+
+    def __init__(self, base):
+        self.local = TransportLocal(base)
+        self.en_panne = False
+
+    def handle_request(self, requete):
+        if self.en_panne:
+            raise httpx.ConnectError('connexion rompue', request=requete)
+        return self.local.handle_request(requete)
+
+
+class ClientSupabaseTests(SimpleTestCase):
+    def setUp(self):
+        self.base = BaseLocale()
+        self.transports = []
+
+        def transport_local(asynchrone=False):
+            self.transports.append(TransportEnPanne(self.base))
+            return self.transports[-1]
+
+        for cible, valeur in (
+            ('bibliotech.supabase_client.SUPABASE_URL', 'http://supabase.local'),
+            ('bibliotech.supabase_client.SUPABASE_KEY', 'local.anon'),
+            ('bibliotech.supabase_client.SUPABASE_SERVICE_KEY', 'local.service'),
+            ('bibliotech.supabase_client.SUPABASE_LOCAL', 'tests'),
+            ('bibliotech.supabase_local.transport_local', transport_local),
+        ):
+            patcher = mock.patch(cible, valeur)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        supabase_client.fermer_clients_supabase()
+        self.addCleanup(supabase_client.fermer_clients_supabase)
+
+    def test_clients_crees_a_la_premiere_utilisation(self):
+        self.assertEqual(supabase_client._clients, {})
+        with mock.patch.object(supabase_client, '_creer_client', wraps=supabase_client._creer_client) as creer:
+            with ThreadPoolExecutor(8) as executeur:
+                clients = list(executeur.map(lambda _: supabase_client.get_supabase_client(), range(16)))
+            admin = supabase_client.get_supabase_client(admin=True)
+        self.assertEqual(len({id(client) for client in clients}), 1)
+        self.assertIsNot(admin, clients[0])
+        self.assertEqual(creer.call_count, 2)
+        self.assertIs(supabase_client.supabase, clients[0])
+        self.assertIs(supabase_client.supabase_admin, admin)
+
+    def test_repli_en_http11_sans_h2(self):
+        with mock.patch.dict(sys.modules, {'h2': None}), self.assertLogs('bibliotech.supabase_client', 'WARNING'):
+            transport = supabase_client._creer_transport(httpx.Limits())
+        self.assertFalse(transport._pool._http2)
+        self.assertTrue(supabase_client._creer_transport(httpx.Limits())._pool._http2)
+
+    def test_client_recree_apres_une_erreur_de_connexion(self):
+        client = supabase_client.get_supabase_client()
+        self.transports[0].en_panne = True
+        with self.assertLogs('bibliotech.supabase_client', 'WARNING'):
+            with self.assertRaises(httpx.ConnectError):
+                client.table('livres').select('*').execute()
+            # Vérification de santé en arrière-plan
+            limite = time.monotonic() + 5
+            while 'anon' in supabase_client._clients and time.monotonic() < limite:
+                time.sleep(0.01)
+            with supabase_client._verrou:
+                pass
+        # La vérification a échoué : le client est retiré du registre et fermé
+        self.assertNotIn('anon', supabase_client._clients)
+        self.assertTrue(client.postgrest.session.is_closed)
+
+        nouveau = supabase_client.get_supabase_client()
+        self.assertIsNot(nouveau, client)
+        self.assertEqual(nouveau.table('livres').select('*').execute().data, [])
+
+        # Au plus une vérification par INTERVALLE_SANTE
+        self.transports[-2].en_panne = True
+        with mock.patch.object(supabase_client, 'verifier_sante_supabase') as verifier:
+            with self.assertRaises(httpx.ConnectError):
+                nouveau.table('livres').select('*').execute()
+        verifier.assert_not_called()
+
+    def test_fermeture_du_registre(self):
+        client = supabase_client.get_supabase_client()
+        supabase_client.fermer_clients_supabase()
+        self.assertTrue(client.postgrest.session.is_closed)
+        self.assertEqual(supabase_client._clients, {})
+        self.assertIsNone(supabase_client.supabase)
+
+
+class SessionsTests(SimpleTestCase):
+    def setUp(self):
+        self.dossier = tempfile.TemporaryDirectory()
+        reglages = override_settings(SESSION_FICHIER=os.path.join(self.dossier.name, 'sessions.sqlite3'))
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+        self.addCleanup(self.dossier.cleanup)
+
+    def test_session_partagee_et_ecrite_seulement_si_modifiee(self):
+        session = SessionStore()
+        session['utilisateur_id'] = 'u1'
+        session.save()
+
+        # Un autre worker relit la même session depuis le fichier
+        relue = SessionStore(session.session_key)
+        self.assertEqual(relue['utilisateur_id'], 'u1')
+        self.assertFalse(relue.modified)
+
+        relue.delete()
+        self.assertFalse(SessionStore(session.session_key).exists(session.session_key))
+        self.assertEqual(SessionStore(session.session_key).get('utilisateur_id'), None)
+
+    def test_renouvellement_pres_de_l_expiration(self):
+        session = SessionStore()
+        session.set_expiry(60)
+        session.save()
+        with override_settings(SESSION_RENOUVELLEMENT=30):
+            relue = SessionStore(session.session_key)
+            relue.load()
+            self.assertFalse(relue.modified)
+        with override_settings(SESSION_RENOUVELLEMENT=120):
+            relue = SessionStore(session.session_key)
+            relue.load()
+            self.assertTrue(relue.modified)
+
+    def test_session_compacte(self):
+        requete = RequestFactory().get('/')
+        requete.session = {}
+        profil = {'id': 'u1', 'email': 'amina@exemple.ma', 'nom': 'Alaoui', 'is_librarian': True, 'is_admin': False}
+        ouvrir_session(requete, 'u1', 'amina@exemple.ma', profil)
+        self.assertEqual(requete.session, {
+            'utilisateur_id': 'u1', 'utilisateur_email': 'amina@exemple.ma', 'utilisateur_roles': ROLES['is_librarian'],
+            'utilisateur_version': 0,
+        })
+        self.assertEqual(roles_session(requete.session), {'is_admin': False, 'is_librarian': True, 'is_administration': False})
+
+        vue = permission_requise('admin')(lambda request: HttpResponse('ok'))
+        self.assertEqual(vue(requete).status_code, 403)
+        vue = permission_requise('bibliothecaire')(lambda request: HttpResponse('ok'))
+        self.assertEqual(vue(requete).status_code, 200)
+
+        # Profil complet relu depuis le cache des profils
+        with mock.patch('comptes.session.SupabaseService') as service:
+            service.return_value.get_profile_by_id.return_value = profil
+            self.assertEqual(profil_session(requete)['nom'], 'Alaoui')
+            service.return_value.get_profile_by_id.assert_called_once_with('u1')
+
+    def test_utilisateur_unique_par_requete(self):
+        requete = RequestFactory().get('/')
+        requete.session = {'utilisateur_id': 'u1', 'utilisateur_email': 'amina@exemple.ma',
+                           'utilisateur_roles': ROLES['is_admin'] | ROLES['is_administration']}
+        vue = permission_requise('personnel')(lambda request: HttpResponse('ok'))
+        with mock.patch('comptes.session.SupabaseService') as service:
+            service.return_value.get_profile_by_id.return_value = {'id': 'u1', 'nom': 'Alaoui', 'prenom': 'Amina'}
+            AuthentificationMiddleware(vue)(requete)
+            utilisateur = requete.utilisateur
+            self.assertIsInstance(utilisateur, Utilisateur)
+            self.assertFalse(hasattr(utilisateur, '__dict__'))
+            self.assertTrue(utilisateur.est_admin and utilisateur.est_personnel)
+            self.assertFalse(utilisateur.est_bibliothecaire)
+            # Le profil n'est chargé qu'à la première lecture d'un de ses champs, puis conservé
+            service.return_value.get_profile_by_id.assert_not_called()
+            self.assertEqual((utilisateur.prenom, utilisateur.nom), ('Amina', 'Alaoui'))
+            self.assertIs(profil_session(requete), utilisateur.profile)
+            service.return_value.get_profile_by_id.assert_called_once_with('u1')
+
+        anonyme = RequestFactory().get('/')
+        anonyme.session = {}
+        AuthentificationMiddleware(lambda request: HttpResponse('ok'))(anonyme)
+        self.assertIsNone(anonyme.utilisateur)
+
+    def test_profil_relu_apres_changement_de_role(self):
+        get_cache_profils().clear()
+        service = creer_service({'profiles': [{'id': 'u1', 'email': 'amina@exemple.ma', 'nom': 'Alaoui', 'is_librarian': False}]})
+        requete = RequestFactory().get('/')
+        requete.session = {}
+        ouvrir_session(requete, 'u1', 'amina@exemple.ma', service.get_profile_by_id('u1'))
+
+        def utilisateur():
+            requete.__dict__.pop('utilisateur', None)
+            with mock.patch('comptes.session.SupabaseService', return_value=service):
+                AuthentificationMiddleware(lambda request: HttpResponse('ok'))(requete)
+            return requete.utilisateur
+
+        # Version inchangée : aucune lecture du profil
+        service.client.requetes.clear()
+        self.assertFalse(utilisateur().est_bibliothecaire)
+        self.assertEqual(service.client.requetes, [])
+
+        # Promotion (par exemple depuis un autre processus) : la session est mise à jour à la requête suivante
+        service.update_profile('u1', {'is_librarian': True})
+        self.assertEqual(lire_version_profil('u1'), 1)
+        self.assertTrue(utilisateur().est_bibliothecaire)
+        self.assertEqual(requete.session['utilisateur_version'], 1)
+
+        # Copie du profil d'un autre worker : plus lue une fois la version changée
+        changer_version_profil('u1')
+        service.client.requetes.clear()
+        self.assertTrue(utilisateur().est_bibliothecaire)
+        self.assertEqual(service.client.requetes, ['profiles'])
+        self.assertEqual(requete.session['utilisateur_version'], 2)
+
+
+class NotificationsTests(SimpleTestCase):
+    def setUp(self):
+        get_cache_profils().clear()
+        self.dossier = tempfile.TemporaryDirectory()
+        reglages = override_settings(SESSION_FICHIER=os.path.join(self.dossier.name, 'sessions.sqlite3'))
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+        self.addCleanup(self.dossier.cleanup)
+        self.service = SupabaseService.__new__(SupabaseService)
+        self.service.client = self.service.admin_client = creer_client(BaseLocale())
+        self.user_id = self.service.sign_up('amina@exemple.ma', 'secret12', {'nom': 'Alaoui'})['profile']['id']
+
+    def test_compteur_tenu_a_jour_sans_recompter(self):
+        self.assertEqual(self.service.count_unread_notifications(self.user_id), 0)
+        notification = self.service.create_notification(self.user_id, 'Rendez-vous confirmé')
+        self.service.create_notification(self.user_id, 'Nouveau livre')
+
+        with mock.patch.object(self.service.client, 'table', side_effect=AssertionError('requête inattendue')):
+            self.assertEqual(self.service.count_unread_notifications(self.user_id), 2)
+
+        self.assertTrue(self.service.mark_notification_as_read(notification['id'], user_id=self.user_id))
+        # Déjà lue : le compteur ne baisse pas une seconde fois
+        self.assertTrue(self.service.mark_notification_as_read(notification['id'], user_id=self.user_id))
+        self.assertEqual(self.service.count_unread_notifications(self.user_id), 1)
+
+        # Un autre worker (cache vide) recompte en base une seule fois
+        get_cache_profils().clear()
+        self.assertEqual(self.service.count_unread_notifications(self.user_id), 1)
+
+    def test_flux_pousse_les_nouvelles_notifications(self):
+        horloge = iter(range(1000))
+        flux = Flux(self.user_id, service=self.service)
+        evenements_flux = evenements(flux, duree=100, intervalle=0, attendre=lambda _: None, horloge=lambda: next(horloge))
+        self.assertEqual(next(evenements_flux), 'retry: 3000\n\n')
+        self.assertIn('"non_lues": 0', next(evenements_flux))
+
+        self.service.create_notification(self.user_id, 'Rendez-vous confirmé', '/comptes/mon-compte/')
+        evenement = next(evenements_flux)
+        donnees = json.loads(evenement.split('data: ')[1])
+        self.assertEqual(donnees['non_lues'], 1)
+        self.assertEqual([n['message'] for n in donnees['nouvelles']], ['Rendez-vous confirmé'])
+        self.assertIn(f"id: {donnees['nouvelles'][0]['created_at']}", evenement)
+
+        # Sans changement : un battement pour garder la connexion ouverte
+        self.assertEqual(next(evenements_flux), ': battement\n\n')
+
+    def test_flux_recompte_les_notifications_inserees_ailleurs(self):
+        horloge = iter(range(1000))
+        flux = Flux(self.user_id, service=self.service, recompte=10)
+        evenements_flux = evenements(flux, duree=100, intervalle=0, attendre=lambda _: None, horloge=lambda: next(horloge))
+        next(evenements_flux)
+        self.assertIn('"non_lues": 0', next(evenements_flux))
+
+        # Insérée sans create_notification : la version ne bouge pas, le recomptage la trouve
+        self.service.client.table('notifications').insert({'utilisateur_id': self.user_id, 'message': 'Message direct'}).execute()
+        donnees = json.loads(next(evenements_flux).split('data: ')[1])
+        self.assertEqual(donnees['non_lues'], 1)
+        self.assertEqual([n['message'] for n in donnees['nouvelles']], ['Message direct'])
+        # Les autres workers voient la nouvelle version
+        self.assertEqual(self.service.count_unread_notifications(self.user_id), 1)
+
+    def test_compteur_relu_periodiquement_sans_flux_en_wsgi(self):
+        requete = RequestFactory().get('/')
+        requete.session = {}
+        ouvrir_session(requete, self.user_id, 'amina@exemple.ma', {})
+        self.service.create_notification(self.user_id, 'Rendez-vous confirmé')
+
+        with mock.patch('comptes.views.SupabaseService', return_value=self.service):
+            self.assertEqual(json.loads(notifications_non_lues(requete).content), {'non_lues': 1})
+
+        for vues_async, attendu, absent in ((False, '/comptes/notifications/non-lues/', 'EventSource'),
+                                            (True, 'EventSource', '/comptes/notifications/non-lues/')):
+            requete.__dict__.pop('utilisateur', None)
+            with override_settings(VUES_ASYNC=vues_async), \
+                    mock.patch('comptes.context_processors.SupabaseService', return_value=self.service):
+                page = render_to_string('_nav.html', request=requete)
+            self.assertIn(attendu, page)
+            self.assertNotIn(absent, page)
+
+    def test_changement_de_statut_notifie_l_utilisateur(self):
+        rdv = self.service.client.table('rendezvous').insert({
+            'utilisateur_id': self.user_id, 'nom': 'Alaoui', 'prenom': 'Amina', 'telephone': '0600000000',
+            'email': 'amina@exemple.ma', 'type_utilisateur': 'etudiant', 'raison': 'Consultation',
+            'date_souhaitee': '2030-01-15', 'titre_ouvrage': 'Les Misérables',
+        }).execute().data[0]
+
+        self.assertEqual(self.service.update_rendez_vous(rdv['id'], {'statut': 'confirme'})['statut'], 'confirme')
+        # Même statut, ou seulement les heures : pas de nouvelle notification
+        self.service.update_rendez_vous(rdv['id'], {'statut': 'confirme'})
+        self.service.update_rendez_vous(rdv['id'], {'heure_entree': '10:00'})
+
+        notifications = self.service.get_notifications_by_user(self.user_id)
+        self.assertEqual([n['message'] for n in notifications], ['Votre rendez-vous pour « Les Misérables » est maintenant confirmé.'])
+        self.assertEqual(self.service.count_unread_notifications(self.user_id), 1)
+
+    def test_formulaire_de_gestion_des_rendez_vous(self):
+        rdv = self.service.client.table('rendezvous').insert({
+            'utilisateur_id': self.user_id, 'nom': 'Alaoui', 'prenom': 'Amina', 'telephone': '0600000000',
+            'email': 'amina@exemple.ma', 'type_utilisateur': 'etudiant', 'raison': 'Consultation',
+            'date_souhaitee': '2030-01-15', 'titre_ouvrage': 'Les Misérables',
+        }).execute().data[0]
+
+        def envoyer(donnees, xhr=False):
+            entetes = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'} if xhr else {}
+            requete = RequestFactory().post('/comptes/gestion-rdv-bibliothecaire/', dict(donnees, rdv_id=rdv['id']), **entetes)
+            requete.session = {}
+            ouvrir_session(requete, 'bibliothecaire', 'biblio@exemple.ma', {'is_librarian': True})
+            with mock.patch('comptes.views.SupabaseService', return_value=self.service):
+                return gestion_rdv_bibliothecaire(requete)
+
+        def lire():
+            return self.service.client.table('rendezvous').select('*').eq('id', rdv['id']).execute().data[0]
+
+        reponse = envoyer({'heure_entree': '10:00', 'heure_sortie': '', 'statut': 'confirme'})
+        self.assertEqual((reponse.status_code, reponse['Location']), (302, reverse('gestion_rdv_bibliothecaire')))
+        self.assertEqual((lire()['heure_entree'], lire()['heure_sortie'], lire()['statut']), ('10:00', None, 'confirme'))
+
+        reponse = envoyer({'heure_sortie': '11:30'}, xhr=True)
+        self.assertEqual((reponse.status_code, json.loads(reponse.content)), (200, {'ok': True}))
+        self.assertEqual((lire()['heure_sortie'], lire()['statut']), ('11:30', 'confirme'))
+
+        # Statut inconnu : rien n'est enregistré, pas même les heures
+        reponse = envoyer({'heure_entree': '09:00', 'statut': 'perdu'}, xhr=True)
+        self.assertEqual((reponse.status_code, json.loads(reponse.content)), (400, {'ok': False}))
+        self.assertEqual(envoyer({'statut': 'perdu'}).status_code, 302)
+        self.assertEqual((lire()['heure_entree'], lire()['statut']), ('10:00', 'confirme'))
@@ -10,4 +10,8 @@ urlpatterns = [
     path('dashboard-admin/', views.dashboard_admin, name='dashboard_admin'),
     path('rendez-vous/', views.rendez_vous, name='rendez_vous'),
     path('gestion-rdv-bibliothecaire/', views.gestion_rdv_bibliothecaire, name='gestion_rdv_bibliothecaire'),
+    path('notifications/', views.mes_notifications, name='mes_notifications'),
+    path('notifications/<str:notification_id>/lue/', views.notification_marquer_lue, name='notification_marquer_lue'),
+    path('notifications/flux/', views.flux_notifications, name='flux_notifications'),
+    path('notifications/non-lues/', views.notifications_non_lues, name='notifications_non_lues'),
 ]
\ No newline at end of file
@@ -1,8 +1,13 @@
+from datetime import date
+from django.http import JsonResponse
 from django.shortcuts import render, redirect
 from django.contrib import messages
+from django.utils.http import url_has_allowed_host_and_scheme
 from .forms import InscriptionForm, ConnexionForm, RendezVousForm
-from .supabase_service import SupabaseService
+from .supabase_service import LIBELLES_STATUTS, SupabaseService
 from .middleware import login_requis
+from .notifications import reponse_flux
+from .session import ouvrir_session, profil_session, roles_session
 
 def inscription(request):
     if request.method == "POST":
@@ -54,9 +59,7 @@ def connexion(request):
             
             if result['success']:
                 # Créer une session pour l'utilisateur avec les données Supabase
-                request.session['utilisateur_id'] = result['user'].id
-                request.session['utilisateur_email'] = result['user'].email
-                request.session['utilisateur_profile'] = result['profile']
+                ouvrir_session(request, result['user'].id, result['user'].email, result['profile'])
                 
                 messages.success(request, "Vous êtes bien connecté(e) !")
                 
@@ -95,12 +98,12 @@ def deconnexion(request):
 
 @login_requis
 def mon_compte(request):
-    return render(request, 'mon_compte.html')
+    return render(request, 'mon_compte.html', {'profil': profil_session(request)})
 
 @login_requis
 def dashboard_bibliothecaire(request):
     # Vérifier que l'utilisateur est bien un bibliothécaire
-    profile = request.session.get('utilisateur_profile', {})
+    profile = profil_session(request)
     if not profile.get('is_librarian'):
         messages.error(request, "Accès non autorisé.")
         return redirect('accueil')
@@ -110,7 +113,7 @@ def dashboard_bibliothecaire(request):
 @login_requis
 def dashboard_admin(request):
     # Vérifier que l'utilisateur est bien un admin
-    profile = request.session.get('utilisateur_profile', {})
+    profile = profil_session(request)
     if not profile.get('is_admin'):
         messages.error(request, "Accès non autorisé.")
         return redirect('accueil')
@@ -119,7 +122,7 @@ def dashboard_admin(request):
 
 def rendez_vous(request):
     """Vue pour prendre rendez-vous"""
-    if not request.session.get('utilisateur_profile'):
+    if not request.session.get('utilisateur_id'):
         try:
             messages.warning(request, "Vous devez être connecté pour prendre rendez-vous.")
         except:
@@ -127,7 +130,7 @@ def rendez_vous(request):
         return redirect('connexion')
     
     # Récupérer les informations de l'utilisateur connecté
-    profile = request.session.get('utilisateur_profile', {})
+    profile = profil_session(request)
     
     # Pré-remplir le formulaire avec les données utilisateur
     initial_data = {
@@ -168,7 +171,7 @@ def rendez_vous(request):
                 else:
                     # Créer le rendez-vous
                     user_id = request.session.get('utilisateur_id')
-                    profile = request.session.get('utilisateur_profile', {})
+                    profile = profil_session(request)
                     
                     rendez_vous_data = {
                         'user_id': user_id,
@@ -230,7 +233,7 @@ def rendez_vous(request):
 
 def gestion_rdv_bibliothecaire(request):
     """Vue pour la gestion des rendez-vous par les bibliothécaires"""
-    if not request.session.get('utilisateur_profile'):
+    if not request.session.get('utilisateur_id'):
         try:
             messages.warning(request, "Vous devez être connecté pour accéder à cette page.")
         except:
@@ -238,7 +241,7 @@ def gestion_rdv_bibliothecaire(request):
         return redirect('connexion')
     
     # Vérifier si l'utilisateur est bibliothécaire
-    profile = request.session.get('utilisateur_profile', {})
+    profile = roles_session(request.session)
     if not profile.get('is_librarian', False):
         try:
             messages.error(request, "Vous n'avez pas les droits pour accéder à cette page.")
@@ -246,14 +249,50 @@ def gestion_rdv_bibliothecaire(request):
             print("Vous n'avez pas les droits pour accéder à cette page.")
         return redirect('accueil')
     
+    if request.method == 'POST':
+        # Heures d'entrée/sortie et statut d'un rendez-vous ; un changement de statut notifie l'utilisateur
+        rdv_data = {champ: request.POST[champ] or None for champ in ('heure_entree', 'heure_sortie') if champ in request.POST}
+        if 'statut' in request.POST:
+            rdv_data['statut'] = request.POST['statut']
+        rdv = None
+        # Un statut inconnu refuse tout le formulaire plutôt que d'enregistrer les seules heures
+        if request.POST.get('rdv_id') and rdv_data and rdv_data.get('statut', 'en_attente') in LIBELLES_STATUTS:
+            rdv = SupabaseService().update_rendez_vous(request.POST['rdv_id'], rdv_data)
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            return JsonResponse({'ok': rdv is not None}, status=200 if rdv else 400)
+        try:
+            if rdv:
+                messages.success(request, "Rendez-vous mis à jour.")
+            else:
+                messages.error(request, "Erreur lors de la mise à jour du rendez-vous.")
+        except:
+            print("Mise à jour du rendez-vous.")
+        return redirect('gestion_rdv_bibliothecaire')
+    
     try:
         supabase_service = SupabaseService()
         
-        # Récupérer tous les rendez-vous
-        rendez_vous = supabase_service.get_all_rendez_vous()
+        # Récupérer une page des rendez-vous du jour et à venir, du plus proche au plus lointain
+        aujourd_hui = date.today().isoformat()
+        page = supabase_service.get_rendez_vous_page(curseur=request.GET.get('curseur'), a_partir_du=aujourd_hui)
+        rendez_vous = page['rendez_vous']
+        
+        # Répartir la page entre les rendez-vous du jour et ceux à venir
+        rdvs_today = []
+        rdvs_future = []
+        for rdv in rendez_vous:
+            date_rdv = str(rdv.get('date_souhaitee') or rdv.get('appointment_date') or '')[:10]
+            if date_rdv == aujourd_hui:
+                rdvs_today.append(rdv)
+            elif date_rdv > aujourd_hui:
+                rdvs_future.append(rdv)
         
         return render(request, 'gestion_rdv_bibliothecaire.html', {
-            'rendez_vous': rendez_vous
+            'rendez_vous': rendez_vous,
+            'rdvs_today': rdvs_today,
+            'rdvs_future': rdvs_future,
+            'curseur_suivant': page['curseur_suivant'],
+            'page_suivante': bool(request.GET.get('curseur')),
         })
         
     except Exception as e:
@@ -262,4 +301,36 @@ def gestion_rdv_bibliothecaire(request):
             messages.error(request, "Erreur lors du chargement des rendez-vous.")
         except:
             print("Erreur lors du chargement des rendez-vous.")
-        return redirect('dashboard_bibliothecaire')
\ No newline at end of file
+        return redirect('dashboard_bibliothecaire')
+
+
+@login_requis
+def mes_notifications(request):
+    """Liste des notifications de l'utilisateur connecté"""
+    notifications = SupabaseService().get_notifications_by_user(request.session.get('utilisateur_id'))
+    return render(request, 'mes_notifications.html', {
+        'notifications': notifications,
+        'toutes_lues': all(notif.get('lu') for notif in notifications),
+    })
+
+@login_requis
+def notification_marquer_lue(request, notification_id):
+    """Marque une notification comme lue puis suit son lien"""
+    SupabaseService().mark_notification_as_read(notification_id, user_id=request.session.get('utilisateur_id'))
+    suivant = request.GET.get('suivant', '')
+    if suivant and url_has_allowed_host_and_scheme(suivant, allowed_hosts={request.get_host()}):
+        return redirect(suivant)
+    return redirect('mes_notifications')
+
+@login_requis
+def flux_notifications(request):
+    """Flux Server-Sent Events : nombre de non lues et nouvelles notifications, poussés aux pages ouvertes"""
+    return reponse_flux(request, request.session.get('utilisateur_id'))
+
+@login_requis
+def notifications_non_lues(request):
+    """Nombre de non lues, relu périodiquement par les pages quand le flux n'est pas servi (WSGI)"""
+    non_lues = SupabaseService().count_unread_notifications(request.session.get('utilisateur_id'))
+    response = JsonResponse({'non_lues': non_lues})
+    response['Cache-Control'] = 'no-cache'
+    return response